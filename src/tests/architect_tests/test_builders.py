@@ -11,6 +11,7 @@ from triage.component.catwalk.utils import filename_friendly_hash
 from triage.component.architect.feature_group_creator import FeatureGroup
 from triage.component.architect.builders import MatrixBuilder
 from triage.component.catwalk.db import ensure_db
+from triage.database_reflection import table_exists
 from triage.component.catwalk.storage import ProjectStorage
 from triage.component.results_schema.schema import Matrix
 
@@ -335,6 +336,67 @@ def test_make_entity_date_table():
             assert test.all().all()
 
 
+def test_entity_date_table_shared():
+    dates = [
+        datetime.datetime(2016, 1, 1, 0, 0),
+        datetime.datetime(2016, 2, 1, 0, 0),
+        datetime.datetime(2016, 3, 1, 0, 0),
+    ]
+
+    with testing.postgresql.Postgresql() as postgresql:
+        # create an engine and generate a table with fake feature data
+        engine = create_engine(postgresql.url())
+        create_schemas(
+            engine=engine, features_tables=features_tables, labels=labels, states=states
+        )
+
+        with get_matrix_storage_engine() as matrix_storage_engine:
+            builder = MatrixBuilder(
+                db_config=db_config,
+                matrix_storage_engine=matrix_storage_engine,
+                experiment_hash=experiment_hash,
+                engine=engine,
+            )
+            build_kwargs = dict(
+                as_of_times=dates,
+                label_type="binary",
+                label_name="booking",
+                state="active",
+                matrix_type="train",
+                label_timespan="1 month",
+            )
+            first_table_name = builder.make_entity_date_table(
+                matrix_uuid="first_uuid", **build_kwargs
+            )
+            # matrices with the same rows share the table, and it's indexed
+            assert builder.make_entity_date_table(
+                matrix_uuid="second_uuid", **build_kwargs
+            ) == first_table_name
+            assert table_exists("features.{}".format(first_table_name), engine)
+            ((num_indexes,),) = engine.execute(
+                "select count(*) from pg_indexes where tablename = %s", first_table_name
+            )
+            assert num_indexes == 1
+
+            # matrices with other rows don't
+            test_table_name = builder.make_entity_date_table(
+                matrix_uuid="test_uuid", **dict(build_kwargs, matrix_type="test")
+            )
+            assert test_table_name != first_table_name
+
+            builder.clean_up_entity_date_tables([
+                {
+                    "as_of_times": dates,
+                    "label_name": "booking",
+                    "label_type": "binary",
+                    "matrix_type": "train",
+                    "matrix_metadata": {"state": "active", "label_timespan": "1 month"},
+                }
+            ])
+            assert not table_exists("features.{}".format(first_table_name), engine)
+            assert table_exists("features.{}".format(test_table_name), engine)
+
+
 def test_make_entity_date_table_include_missing_labels():
     """ Test that the make_entity_date_table function contains the correct
     values.
@@ -402,6 +464,78 @@ def test_make_entity_date_table_include_missing_labels():
             assert sorted(result.values.tolist()) == sorted(ids_dates.values.tolist())
 
 
+def test_make_entity_date_table_negative_downsampling():
+    """ Test that train entity-date tables keep every positive row and a
+    repeatable sample of the negative rows, and that test tables keep every row.
+    """
+    dates = [
+        datetime.datetime(2016, 1, 1, 0, 0),
+        datetime.datetime(2016, 2, 1, 0, 0),
+        datetime.datetime(2016, 3, 1, 0, 0),
+        datetime.datetime(2016, 4, 1, 0, 0),
+        datetime.datetime(2016, 5, 1, 0, 0),
+    ]
+    row_labels = dict(
+        ((entity_id, as_of_date), label)
+        for entity_id, as_of_date, timespan, name, _, label in labels
+        if timespan == "1 month" and name == "booking"
+    )
+
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        create_schemas(
+            engine=engine, features_tables=features_tables, labels=labels, states=states
+        )
+
+        with get_matrix_storage_engine() as matrix_storage_engine:
+            def entity_dates(matrix_type, **kwargs):
+                builder = MatrixBuilder(
+                    db_config=db_config,
+                    matrix_storage_engine=matrix_storage_engine,
+                    experiment_hash=experiment_hash,
+                    engine=engine,
+                    **kwargs
+                )
+                entity_date_table_name = builder.make_entity_date_table(
+                    as_of_times=dates,
+                    label_type="binary",
+                    label_name="booking",
+                    state="active",
+                    matrix_uuid="my_uuid",
+                    matrix_type=matrix_type,
+                    label_timespan="1 month",
+                )
+                result = pd.read_sql(
+                    "select entity_id, as_of_date from features.{}".format(
+                        entity_date_table_name
+                    ),
+                    engine,
+                )
+                return set(
+                    (entity_id, as_of_date.strftime("%Y-%m-%d"))
+                    for entity_id, as_of_date in result.values.tolist()
+                )
+
+            all_rows = entity_dates("train")
+            sampled_rows = entity_dates(
+                "train", negative_sample_rate=0.5, negative_sample_seed=1
+            )
+            positives = set(row for row in all_rows if row_labels[row] == 1)
+            negatives = all_rows - positives
+            assert positives and negatives
+            assert positives <= sampled_rows <= all_rows
+            assert 0 < len(sampled_rows & negatives) < len(negatives)
+
+            # the same seed picks the same rows
+            assert sampled_rows == entity_dates(
+                "train", negative_sample_rate=0.5, negative_sample_seed=1
+            )
+            assert entity_dates("train", negative_sample_rate=1) == all_rows
+            assert entity_dates(
+                "test", negative_sample_rate=0.5, negative_sample_seed=1
+            ) == entity_dates("test")
+
+
 def test_load_features_data():
     dates = [datetime.datetime(2016, 1, 1, 0, 0), datetime.datetime(2016, 2, 1, 0, 0)]
 
@@ -644,6 +778,34 @@ class TestMergeFeatureCSVs(TestCase):
             with self.assertRaises(ValueError):
                 builder.merge_feature_csvs(dataframes, matrix_uuid="1234")
 
+    def test_feature_nulls(self):
+        """Nulls in features raise an error, unless the check is turned off"""
+        dataframes = [
+            pd.DataFrame.from_records(
+                [(1, 3, 1), (4, 5, None)],
+                columns=("entity_id", "as_of_date", "label"),
+                index=["entity_id", "as_of_date"],
+            ),
+            pd.DataFrame.from_records(
+                [(1, 3, 3), (4, 5, None)],
+                columns=("entity_id", "as_of_date", "f1"),
+                index=["entity_id", "as_of_date"],
+            ),
+        ]
+        with get_matrix_storage_engine() as matrix_storage_engine:
+            builder = MatrixBuilder(
+                db_config=db_config,
+                matrix_storage_engine=matrix_storage_engine,
+                experiment_hash=experiment_hash,
+                engine=None,
+            )
+            with self.assertRaises(ValueError):
+                builder.merge_feature_csvs(dataframes, matrix_uuid="1234")
+
+            builder.check_feature_nulls = False
+            merged = builder.merge_feature_csvs(dataframes, matrix_uuid="1234")
+            assert list(merged.columns) == ["f1", "label"]
+
 
 class TestBuildMatrix(TestCase):
     @property
@@ -740,6 +902,204 @@ class TestBuildMatrix(TestCase):
 
                 assert len(matrix_storage_engine.get_store(uuid).design_matrix) == 5
 
+    def test_superset_matrices(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            # create an engine and generate a table with fake feature data
+            engine = create_engine(postgresql.url())
+            ensure_db(engine)
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states,
+            )
+
+            feature_dictionaries = [
+                FeatureGroup(name="group0", features_by_table={"features0": ["f2", "f1"]}),
+                FeatureGroup(
+                    name="group1",
+                    features_by_table={"features0": ["f1"], "features1": ["f3", "f4"]},
+                ),
+            ]
+            build_tasks = []
+            for feature_dictionary in feature_dictionaries:
+                matrix_metadata = dict(
+                    self.good_metadata, feature_groups=feature_dictionary.names
+                )
+                build_tasks.append(dict(
+                    as_of_times=self.good_dates,
+                    label_name="booking",
+                    label_type="binary",
+                    feature_dictionary=feature_dictionary,
+                    matrix_metadata=matrix_metadata,
+                    matrix_uuid=filename_friendly_hash(matrix_metadata),
+                    matrix_type="train",
+                ))
+
+            with get_matrix_storage_engine() as matrix_storage_engine:
+                builder = MatrixBuilder(
+                    db_config=db_config,
+                    matrix_storage_engine=matrix_storage_engine,
+                    experiment_hash=experiment_hash,
+                    engine=engine,
+                )
+                for build_task in build_tasks:
+                    builder.build_matrix(**build_task)
+                separately_built = [
+                    matrix_storage_engine.get_store(build_task["matrix_uuid"]).design_matrix
+                    for build_task in build_tasks
+                ]
+
+            with get_matrix_storage_engine() as matrix_storage_engine:
+                builder = MatrixBuilder(
+                    db_config=db_config,
+                    matrix_storage_engine=matrix_storage_engine,
+                    experiment_hash=experiment_hash,
+                    engine=engine,
+                )
+                builder.load_features_data = Mock(wraps=builder.load_features_data)
+                builder.build_superset_matrices(build_tasks)
+                # one extraction of the union of the features for both matrices
+                assert builder.load_features_data.call_count == 1
+                assert builder.load_features_data.call_args[0][1] == {
+                    "features0": ["f2", "f1"],
+                    "features1": ["f3", "f4"],
+                }
+                for build_task, expected in zip(build_tasks, separately_built):
+                    design_matrix = matrix_storage_engine.get_store(
+                        build_task["matrix_uuid"]
+                    ).design_matrix
+                    pd.testing.assert_frame_equal(design_matrix, expected)
+
+    def test_feature_slices(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            # create an engine and generate a table with fake feature data
+            engine = create_engine(postgresql.url())
+            ensure_db(engine)
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states,
+            )
+
+            with TemporaryDirectory() as temp_dir:
+                project_storage = ProjectStorage(temp_dir)
+                matrix_storage_engine = project_storage.matrix_storage_engine()
+                builder = MatrixBuilder(
+                    db_config=db_config,
+                    matrix_storage_engine=matrix_storage_engine,
+                    experiment_hash=experiment_hash,
+                    engine=engine,
+                )
+                sliced_builder = MatrixBuilder(
+                    db_config=db_config,
+                    matrix_storage_engine=matrix_storage_engine,
+                    experiment_hash=experiment_hash,
+                    engine=engine,
+                    feature_slice_storage_engine=project_storage.feature_slice_storage_engine(
+                        "test"
+                    ),
+                )
+                sliced_builder.query_to_df = Mock(wraps=sliced_builder.query_to_df)
+                entity_date_table_name = builder.make_entity_date_table(
+                    self.good_dates,
+                    "booking",
+                    "binary",
+                    "active",
+                    "train",
+                    "slices",
+                    "1 month",
+                )
+                expected = builder.load_features_data(
+                    self.good_dates, self.good_feature_dictionary, entity_date_table_name, "slices"
+                )
+                sliced = sliced_builder.load_features_data(
+                    self.good_dates, self.good_feature_dictionary, entity_date_table_name, "slices"
+                )
+                for expected_df, sliced_df in zip(expected, sliced):
+                    pd.testing.assert_frame_equal(sliced_df, expected_df)
+                # one query for the entity-dates, one per table and date for the slices
+                assert sliced_builder.query_to_df.call_count == 1 + 2 * 3
+
+                # a matrix sharing dates with the first only extracts the new date
+                sliced_builder.query_to_df.reset_mock()
+                later_dates = self.good_dates[1:] + [datetime.datetime(2016, 4, 1, 0, 0)]
+                entity_date_table_name = builder.make_entity_date_table(
+                    later_dates,
+                    "booking",
+                    "binary",
+                    "active",
+                    "train",
+                    "slices_later",
+                    "1 month",
+                )
+                expected = builder.load_features_data(
+                    later_dates, self.good_feature_dictionary, entity_date_table_name, "later"
+                )
+                sliced = sliced_builder.load_features_data(
+                    later_dates, self.good_feature_dictionary, entity_date_table_name, "later"
+                )
+                for expected_df, sliced_df in zip(expected, sliced):
+                    pd.testing.assert_frame_equal(sliced_df, expected_df)
+                assert sliced_builder.query_to_df.call_count == 1 + 2 * 1
+
+    def test_stream_matrix(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            # create an engine and generate a table with fake feature data
+            engine = create_engine(postgresql.url())
+            ensure_db(engine)
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states,
+            )
+
+            with get_matrix_storage_engine() as matrix_storage_engine:
+                builder = MatrixBuilder(
+                    db_config=db_config,
+                    matrix_storage_engine=matrix_storage_engine,
+                    experiment_hash=experiment_hash,
+                    engine=engine,
+                )
+                streaming_builder = MatrixBuilder(
+                    db_config=db_config,
+                    matrix_storage_engine=matrix_storage_engine,
+                    experiment_hash=experiment_hash,
+                    engine=engine,
+                    stream_chunk_size=2,
+                )
+                streaming_builder.merge_feature_csvs = Mock(
+                    wraps=streaming_builder.merge_feature_csvs
+                )
+                build_args = dict(
+                    as_of_times=self.good_dates,
+                    label_name="booking",
+                    label_type="binary",
+                    feature_dictionary=self.good_feature_dictionary,
+                    matrix_type="train",
+                )
+                whole_metadata = dict(self.good_metadata, matrix_id="whole")
+                streamed_metadata = dict(self.good_metadata, matrix_id="streamed")
+                builder.build_matrix(
+                    matrix_metadata=whole_metadata,
+                    matrix_uuid="whole",
+                    **build_args
+                )
+                streaming_builder.build_matrix(
+                    matrix_metadata=streamed_metadata,
+                    matrix_uuid="streamed",
+                    **build_args
+                )
+                # 5 rows in chunks of 2
+                assert streaming_builder.merge_feature_csvs.call_count == 3
+                whole = matrix_storage_engine.get_store("whole")
+                streamed = matrix_storage_engine.get_store("streamed")
+                pd.testing.assert_frame_equal(streamed.design_matrix, whole.design_matrix)
+                pd.testing.assert_series_equal(streamed.labels, whole.labels)
+                assert builder.sessionmaker().query(Matrix).get("streamed").num_observations == 5
+
     def test_nullcheck(self):
         f0_dict = {(r[0], r[1]): r for r in features0_pre}
         f1_dict = {(r[0], r[1]): r for r in features1_pre}
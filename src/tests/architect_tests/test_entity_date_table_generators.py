@@ -193,3 +193,79 @@ def test_entity_date_table_generator_noreplace():
             )
         )
         assert results == expected_output
+
+
+def test_entity_date_table_generator_parallel():
+    input_data = [
+        (1, datetime(2016, 1, 1), True),
+        (2, datetime(2016, 2, 1), True),
+        (3, datetime(2016, 3, 1), True),
+    ]
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        utils.create_binary_outcome_events(engine, "events", input_data)
+        table_generator = EntityDateTableGenerator(
+            query="select entity_id from events where outcome_date < '{as_of_date}'::date",
+            db_engine=engine,
+            entity_date_table_name="exp_hash_entity_date",
+            n_db_processes=3,
+        )
+        as_of_dates = [
+            datetime(2016, 2, 1),
+            datetime(2016, 3, 1),
+            datetime(2016, 4, 1),
+        ]
+        table_generator.generate_entity_date_table(as_of_dates)
+        results = list(
+            engine.execute(
+                f"""
+                select entity_id, as_of_date from {table_generator.entity_date_table_name}
+                order by entity_id, as_of_date
+            """
+            )
+        )
+        assert results == [
+            (1, datetime(2016, 2, 1)),
+            (1, datetime(2016, 3, 1)),
+            (1, datetime(2016, 4, 1)),
+            (2, datetime(2016, 3, 1)),
+            (2, datetime(2016, 4, 1)),
+            (3, datetime(2016, 4, 1)),
+        ]
+        assert not engine.execute(
+            "select to_regclass(%s)", table_generator.staging_table_name
+        ).scalar()
+        assert table_generator._dates_without_rows(
+            as_of_dates + [datetime(2016, 5, 1)]
+        ) == [datetime(2016, 5, 1)]
+
+
+def test_entity_date_table_generator_long_table_names():
+    # index names made from table names this long would be cut short by postgres,
+    # but each table should still get its own index
+    input_data = [
+        (1, datetime(2016, 1, 1), True),
+        (2, datetime(2016, 1, 1), True),
+    ]
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        utils.create_binary_outcome_events(engine, "events", input_data)
+        table_names = ["cohort_{}_{}".format("x" * 54, suffix) for suffix in "ab"]
+        for table_name in table_names:
+            table_generator = EntityDateTableGenerator(
+                query="select entity_id from events where outcome_date < '{as_of_date}'::date",
+                db_engine=engine,
+                entity_date_table_name=table_name,
+                replace=False,
+            )
+            for _ in range(2):
+                table_generator.generate_entity_date_table([datetime(2016, 2, 1)])
+
+        for table_name in table_names:
+            indexes = [
+                row[0] for row in engine.execute(
+                    "select indexdef from pg_indexes where tablename = %s", table_name
+                )
+            ]
+            assert len(indexes) == 1
+            assert "(entity_id, as_of_date)" in indexes[0]
@@ -594,6 +594,54 @@ def test_generate_table_tasks(test_engine):
         assert isinstance(task["inserts"], list)
 
 
+def test_batch_inserts(test_engine):
+    test_engine.execute('create schema features')
+    aggregation = SpacetimeAggregation(
+        prefix="prefix1",
+        aggregates=[
+            Aggregate(
+                quantity="quantity_one",
+                function="count",
+                impute_rules={"coltype": "aggregate", "all": {"type": "zero"}},
+            )
+        ],
+        groups=["entity_id"],
+        intervals=["all"],
+        date_column="knowledge_date",
+        output_date_column="as_of_date",
+        dates=["2013-09-30", "2014-09-30", "2015-01-01"],
+        state_table="states",
+        state_group="entity_id",
+        schema="features",
+        from_obj="data",
+    )
+    feature_generator = FeatureGenerator(
+        db_engine=test_engine,
+        features_schema_name="features",
+    )
+    table_tasks = feature_generator.generate_all_table_tasks(
+        [aggregation], task_type="aggregation"
+    )
+    task = table_tasks["prefix1_entity_id"]
+    feature_generator.run_commands(task["prepare"])
+
+    # the planner is able to estimate a cost for each insert
+    costs = feature_generator.insert_costs(task["inserts"])
+    assert len(costs) == 3
+    assert all(cost > 0 for cost in costs)
+
+    # every insert ends up in exactly one batch
+    batches = feature_generator.batch_inserts(task["inserts"], n_processes=2)
+    assert len(batches) == 2
+    assert sorted(str(insert) for batch in batches for insert in batch) == \
+        sorted(str(insert) for insert in task["inserts"])
+
+    for batch in batches:
+        feature_generator.run_insert_batch(batch, table_name="prefix1_entity_id")
+    ((row_count,),) = test_engine.execute("select count(*) from features.prefix1_entity_id")
+    assert row_count == 7
+
+
 def test_aggregations(test_engine):
     aggregate_config = [
         {
@@ -929,3 +977,85 @@ class TestValidations:
         base_config["categoricals"][0]["imputation"]["all"] = {"type": "constant"}
         with pytest.raises(ValueError):
             feature_generator.validate([base_config])
+
+
+def test_aggregations_prefilter_fromobjs(test_engine):
+    aggregate_config = [
+        {
+            "prefix": prefix,
+            "aggregates_imputation": {"all": {"type": "constant", "value": 7}},
+            "aggregates": [{"quantity": "quantity_one", "metrics": ["sum"]}],
+            "groups": ["entity_id"],
+            "intervals": ["all"],
+            "knowledge_date_column": "knowledge_date",
+            "from_obj": "data",
+        }
+        for prefix in ("aprefix", "bprefix")
+    ]
+
+    feature_generator = FeatureGenerator(
+        db_engine=test_engine,
+        features_schema_name="features",
+        feature_start_time="2013-01-01",
+        prefilter_fromobjs=True,
+    )
+    output_tables = feature_generator.create_all_tables(
+        feature_dates=["2015-01-01"],
+        feature_aggregation_config=aggregate_config,
+        state_table="states",
+    )
+
+    # both aggregations read from the same cohort-filtered table
+    assert len(feature_generator.from_objs) == 1
+    (from_obj_table,) = feature_generator.from_objs.keys()
+    assert from_obj_table.startswith("features.from_obj_")
+    assert test_engine.execute(f"select count(*) from {from_obj_table}").scalar() == 4
+
+    for output_table in output_tables:
+        records = pandas.read_sql(
+            f"select * from features.{output_table} order by as_of_date, entity_id",
+            test_engine,
+        ).to_dict("records")
+        assert [record["entity_id"] for record in records] == [1, 3, 4]
+        prefix = output_table.split("_")[0]
+        assert [record[f"{prefix}_entity_id_all_quantity_one_sum"] for record in records] == [
+            10000, 600, 1236
+        ]
+
+
+def test_null_counts_table(test_engine):
+    aggregate_config = [
+        {
+            "prefix": "aprefix",
+            "aggregates_imputation": {"all": {"type": "zero"}},
+            "aggregates": [{"quantity": "quantity_one", "metrics": ["sum"]}],
+            "groups": ["entity_id"],
+            "intervals": ["all"],
+            "knowledge_date_column": "knowledge_date",
+            "from_obj": "data",
+        }
+    ]
+
+    FeatureGenerator(
+        db_engine=test_engine,
+        features_schema_name="features",
+    ).create_all_tables(
+        feature_dates=["2013-09-30", "2014-09-30"],
+        feature_aggregation_config=aggregate_config,
+        state_table="states",
+    )
+
+    # entity 1 has no events before 2013-09-30; every other entity-date has some
+    null_counts = {
+        column_name: null_count
+        for column_name, null_count in test_engine.execute(
+            'select column_name, null_count from features."aprefix_aggregation_null_counts"'
+        )
+    }
+    assert null_counts == {"aprefix_entity_id_all_quantity_one_sum": 1}
+    records = pandas.read_sql(
+        "select * from features.aprefix_aggregation_imputed order by as_of_date, entity_id",
+        test_engine,
+    ).to_dict("records")
+    assert records[0]["aprefix_entity_id_all_quantity_one_sum"] == 0
+    assert records[0]["aprefix_entity_id_all_quantity_one_imp"] == 1
@@ -169,3 +169,91 @@ def test_generate_all_labels_noreplace():
             (4, date(2014, 9, 30), timedelta(90), "outcome", "binary", False),
         ]
         assert records == expected
+
+
+def test_generate_all_labels_batches():
+    # labels built a few as-of-date/label timespan pairs at a time should
+    # match labels built all at once, and the table should be indexed
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        create_binary_outcome_events(engine, "events", events_data)
+
+        records = {}
+        for batch_size in (1, 3, 50):
+            label_generator = LabelGenerator(
+                db_engine=engine,
+                query=LABEL_GENERATE_QUERY,
+                replace=True,
+                batch_size=batch_size,
+            )
+            label_generator.generate_all_labels(
+                labels_table=LABELS_TABLE_NAME,
+                as_of_dates=["2014-09-30", "2015-03-30"],
+                label_timespans=["6month", "3month"],
+            )
+            records[batch_size] = [
+                row for row in engine.execute(
+                    "select * from {} order by entity_id, as_of_date, label_timespan desc".format(
+                        LABELS_TABLE_NAME
+                    )
+                )
+            ]
+        assert len(records[1]) == 8
+        assert records[1] == records[3] == records[50]
+
+        indexes = [
+            row[0] for row in engine.execute(
+                "select indexdef from pg_indexes where tablename = %s", LABELS_TABLE_NAME
+            )
+        ]
+        assert len(indexes) == 1
+        assert "(entity_id, as_of_date)" in indexes[0]
+
+
+def test_generate_all_labels_indexes_long_table_names():
+    # index names made from table names this long would be cut short by postgres,
+    # but each table should still get its own index
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        create_binary_outcome_events(engine, "events", events_data)
+
+        labels_tables = ["labels_{}_{}".format("x" * 54, suffix) for suffix in "ab"]
+        for labels_table in labels_tables:
+            label_generator = LabelGenerator(
+                db_engine=engine,
+                query=LABEL_GENERATE_QUERY,
+                replace=False,
+            )
+            for _ in range(2):
+                label_generator.generate_all_labels(
+                    labels_table=labels_table,
+                    as_of_dates=["2014-09-30"],
+                    label_timespans=["6month"],
+                )
+
+        for labels_table in labels_tables:
+            indexes = [
+                row[0] for row in engine.execute(
+                    "select indexdef from pg_indexes where tablename = %s", labels_table
+                )
+            ]
+            assert len(indexes) == 1
+            assert "(entity_id, as_of_date)" in indexes[0]
+
+
+def test_existing_label_pairs():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        create_binary_outcome_events(engine, "events", events_data)
+
+        label_generator = LabelGenerator(db_engine=engine, query=LABEL_GENERATE_QUERY)
+        label_generator.generate_all_labels(
+            labels_table=LABELS_TABLE_NAME,
+            as_of_dates=["2014-09-30"],
+            label_timespans=["6month"],
+        )
+        assert label_generator.existing_label_pairs(
+            LABELS_TABLE_NAME,
+            as_of_dates=["2014-09-30", "2015-03-30"],
+            label_timespans=["6month", "3month"],
+        ) == {("2014-09-30", "6month")}
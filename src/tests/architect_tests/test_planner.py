@@ -132,3 +132,67 @@ def test_Planner():
         )
         == 8
     )
+
+    # the two feature dicts share rows, so each matrix pairs up with one other
+    superset_tasks = planner.superset_build_tasks(
+        dict((task["matrix_uuid"], task) for task in build_tasks)
+    )
+    assert len(superset_tasks) == 4  # 2 splits * 2 matrices per split
+    for superset_task in superset_tasks.values():
+        assert len(superset_task["build_tasks"]) == 2
+        assert set(
+            task["feature_dictionary"].names[0] for task in superset_task["build_tasks"]
+        ) == set(["first_features", "second_features"])
+
+
+def test_Planner_negative_downsampling():
+    matrix_set_definitions = [
+        {
+            "feature_start_time": datetime.datetime(1990, 1, 1, 0, 0),
+            "modeling_start_time": datetime.datetime(2010, 1, 1, 0, 0),
+            "modeling_end_time": datetime.datetime(2010, 1, 11, 0, 0),
+            "train_matrix": {
+                "first_as_of_time": datetime.datetime(2010, 1, 1, 0, 0),
+                "matrix_info_end_time": datetime.datetime(2010, 1, 6, 0, 0),
+                "as_of_times": [datetime.datetime(2010, 1, 1, 0, 0)],
+            },
+            "test_matrices": [
+                {
+                    "first_as_of_time": datetime.datetime(2010, 1, 6, 0, 0),
+                    "matrix_info_end_time": datetime.datetime(2010, 1, 11, 0, 0),
+                    "as_of_times": [datetime.datetime(2010, 1, 6, 0, 0)],
+                }
+            ],
+        }
+    ]
+    feature_dicts = [
+        FeatureGroup(name="first_features", features_by_table={"features0": ["f1"]})
+    ]
+
+    def plan(**kwargs):
+        planner = Planner(
+            feature_start_time=datetime.datetime(2010, 1, 1, 0, 0),
+            label_names=["booking"],
+            label_types=["binary"],
+            cohort_names=["prior_bookings"],
+            user_metadata={},
+            **kwargs
+        )
+        updated_matrix_definitions, build_tasks = planner.generate_plans(
+            matrix_set_definitions, feature_dicts
+        )
+        return updated_matrix_definitions[0], build_tasks
+
+    full_definition, _ = plan()
+    sampled_definition, sampled_build_tasks = plan(
+        negative_sample_rate=0.25, negative_sample_seed=3
+    )
+    # the rows of train matrices change, so they get new uuids; test matrices don't
+    assert sampled_definition["train_uuid"] != full_definition["train_uuid"]
+    assert sampled_definition["test_uuids"] == full_definition["test_uuids"]
+
+    train_metadata = sampled_build_tasks[sampled_definition["train_uuid"]]["matrix_metadata"]
+    assert train_metadata["negative_sample_rate"] == 0.25
+    assert train_metadata["negative_sample_seed"] == 3
+    test_metadata = sampled_build_tasks[sampled_definition["test_uuids"][0]]["matrix_metadata"]
+    assert "negative_sample_rate" not in test_metadata
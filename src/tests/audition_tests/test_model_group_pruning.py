@@ -0,0 +1,93 @@
+from datetime import datetime
+
+import pytest
+
+from triage.component.audition.model_group_pruning import ModelGroupPruner
+from triage.component.results_schema import PrunedModelGroup
+from triage.util.db import scoped_session
+
+from tests.results_tests.factories import (
+    EvaluationFactory,
+    ExperimentFactory,
+    ModelFactory,
+    ModelGroupFactory,
+    session,
+)
+
+
+def test_ModelGroupPruner(db_engine_with_results_schema):
+    db_engine = db_engine_with_results_schema
+    experiment = ExperimentFactory()
+    model_groups = {
+        "good": ModelGroupFactory(model_type="myGoodClassifier"),
+        "okay": ModelGroupFactory(model_type="myOkayClassifier"),
+        "bad": ModelGroupFactory(model_type="myBadClassifier"),
+        "broken": ModelGroupFactory(model_type="myBrokenClassifier"),
+        "baseline": ModelGroupFactory(model_type="myBaseline"),
+    }
+    values = {
+        "good": [0.8, 0.7],
+        "okay": [0.6, 0.7],
+        "bad": [0.3, 0.2],
+        "baseline": [0.1, 0.1],
+    }
+    model_hashes = []
+    for name, model_group in model_groups.items():
+        for train_end_time, value in zip(
+            [datetime(2014, 1, 1), datetime(2015, 1, 1)], values.get(name, [None, None])
+        ):
+            model = ModelFactory(model_group_rel=model_group, train_end_time=train_end_time)
+            model_hashes.append(model.model_hash)
+            if value is not None:
+                EvaluationFactory(
+                    model_rel=model,
+                    metric="precision@",
+                    parameter="100_abs",
+                    stochastic_value=value,
+                )
+    session.commit()
+
+    pruner = ModelGroupPruner(
+        db_engine, metric="precision@", parameter="100_abs", keep_fraction=0.5
+    )
+    ranked = pruner.rank(model_hashes)
+    assert ranked.index.tolist() == [
+        model_groups[name].model_group_id for name in ["good", "okay", "bad", "baseline"]
+    ]
+    # the okay classifier is 0.2 behind the best in the first year and tied in the second
+    assert ranked.loc[model_groups["okay"].model_group_id, "mean_dist_from_best"] == \
+        pytest.approx(0.1)
+
+    kept = pruner.prune(
+        model_group_ids=[model_group.model_group_id for model_group in model_groups.values()],
+        model_hashes=model_hashes,
+        experiment_hash=experiment.experiment_hash,
+        protected_model_group_ids=[model_groups["baseline"].model_group_id],
+    )
+    # half of the three unprotected, ranked model groups, rounded up, plus the baseline
+    assert kept == set(
+        model_groups[name].model_group_id for name in ["good", "okay", "baseline"]
+    )
+    with scoped_session(db_engine) as db_session:
+        pruned = {
+            row.model_group_id: row
+            for row in db_session.query(PrunedModelGroup).filter_by(
+                experiment_hash=experiment.experiment_hash
+            )
+        }
+        assert set(pruned) == set(
+            model_groups[name].model_group_id for name in ["bad", "broken"]
+        )
+        bad = pruned[model_groups["bad"].model_group_id]
+        assert bad.rank == 3
+        assert bad.num_model_groups_ranked == 3
+        assert bad.last_train_end_time == datetime(2015, 1, 1)
+        assert bad.reason.startswith("Ranked 3 of 3")
+        broken = pruned[model_groups["broken"].model_group_id]
+        assert broken.rank is None
+        assert "No precision@100_abs test evaluations" in broken.reason
+
+
+def test_ModelGroupPruner_keep_fraction_bounds(db_engine):
+    with pytest.raises(ValueError):
+        ModelGroupPruner(db_engine, metric="precision@", parameter="100_abs", keep_fraction=0)
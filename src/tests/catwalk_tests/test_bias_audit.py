@@ -0,0 +1,102 @@
+import numpy
+import pandas
+import pytest
+
+from triage.component.catwalk.bias_audit import (
+    MISSING_ATTRIBUTE_VALUE,
+    audit_groups,
+    audit_thresholds,
+    discretize_attributes,
+)
+
+
+def test_audit_thresholds():
+    assert audit_thresholds({"top_n": [2, 10], "percentiles": [50]}, 4) == [
+        ("2_abs", 2),
+        ("10_abs", 4),
+        ("0.5_pct", 2),
+    ]
+    assert audit_thresholds({}, 4) == []
+
+
+def test_discretize_attributes():
+    protected_df = pandas.DataFrame({
+        "entity_id": [1, 2, 3, 4],
+        "race": ["a", None, "b", "a"],
+        "age": [10.0, 20.0, 30.0, 40.0],
+        "flag": [1, 1, 1, 1],
+    })
+    attributes = discretize_attributes(protected_df)
+    assert attributes.columns.tolist() == ["race", "age", "flag"]
+    assert attributes["race"].tolist() == ["a", MISSING_ATTRIBUTE_VALUE, "b", "a"]
+    assert attributes["age"].tolist() == [
+        "10.00-17.50", "17.50-25.00", "25.00-32.50", "32.50-40.00"
+    ]
+    assert attributes["flag"].tolist() == ["1", "1", "1", "1"]
+
+    categorical = discretize_attributes(protected_df[["race", "age"]].astype("category"))
+    assert categorical["race"].tolist() == attributes["race"].tolist()
+    # numeric categories are binned like numbers
+    assert categorical["age"].tolist() == attributes["age"].tolist()
+
+
+def _audit(**kwargs):
+    # rows sorted by score; the top two are in group a
+    protected_df = pandas.DataFrame({"group": ["a", "a", "b", "b"]})
+    labels = numpy.array([1, 0, 1, 0])
+    audit = audit_groups(protected_df, labels, [("2_abs", 2)], **kwargs)
+    return audit.set_index("attribute_value")
+
+
+def test_audit_groups_crosstabs():
+    audit = _audit()
+    assert audit.loc["a", ["pp", "pn", "tp", "fp", "tn", "fn"]].tolist() == [2, 0, 1, 1, 0, 0]
+    assert audit.loc["b", ["pp", "pn", "tp", "fp", "tn", "fn"]].tolist() == [0, 2, 0, 0, 1, 1]
+    assert audit.loc["a", "group_size"] == 2
+    assert audit.loc["a", "group_size_pct"] == 0.5
+    assert audit.loc["a", "total_entities"] == 4
+    assert audit.loc["a", "prev"] == 0.5
+    assert audit.loc["a", "ppr"] == 1.0
+    assert audit.loc["a", "precision"] == 0.5
+    assert audit.loc["a", "tpr"] == 1.0
+    assert numpy.isnan(audit.loc["a", "for_"])
+    assert audit.loc["b", "for_"] == 0.5
+    assert numpy.isnan(audit.loc["b", "precision"])
+
+
+def test_audit_groups_min_metric():
+    audit = _audit()
+    # group b predicts no positives, so is the reference for ppr
+    assert audit.loc["a", "ppr_ref_group_value"] == "b"
+    assert audit.loc["a", "ppr_disparity"] == 10.0
+    assert numpy.isnan(audit.loc["b", "ppr_disparity"])
+    assert audit.loc["a", "Statistical_Parity"] is False
+    assert audit.loc["b", "Statistical_Parity"] is None
+    # group a has no false omission rate, so b is the only candidate
+    assert audit.loc["b", "for_ref_group_value"] == "b"
+    assert audit.loc["b", "for_disparity"] == 1.0
+    assert audit.loc["b", "FOR_Parity"] is True
+
+
+def test_audit_groups_majority():
+    audit = _audit(ref_groups_method="majority")
+    # the groups are the same size, so the first is the majority
+    assert (audit["ppr_ref_group_value"] == "a").all()
+    assert audit.loc["a", "ppr_disparity"] == 1.0
+    assert audit.loc["b", "ppr_disparity"] == 0.0
+    assert audit.loc["a", "Statistical_Parity"] is True
+    assert audit.loc["b", "Statistical_Parity"] is False
+    assert audit.loc["a", "Unsupervised_Fairness"] is True
+    assert audit.loc["b", "Unsupervised_Fairness"] is False
+
+
+def test_audit_groups_predefined():
+    audit = _audit(ref_groups_method="predefined", ref_groups={"group": "b"})
+    assert (audit["tnr_ref_group_value"] == "b").all()
+    assert audit.loc["a", "tnr_disparity"] == 0.0
+    assert audit.loc["b", "tnr_disparity"] == 1.0
+
+    with pytest.raises(ValueError):
+        _audit(ref_groups_method="predefined", ref_groups={"group": "c"})
+    with pytest.raises(ValueError):
+        _audit(ref_groups_method="predefined", ref_groups={"other": "a"})
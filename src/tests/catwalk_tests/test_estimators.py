@@ -3,7 +3,10 @@ import numpy as np
 import pytest
 
 from triage.component.catwalk.estimators.transformers import CutOff
-from triage.component.catwalk.estimators.classifiers import ScaledLogisticRegression
+from triage.component.catwalk.estimators.classifiers import (
+    ChunkedScaledLogisticRegression,
+    ScaledLogisticRegression,
+)
 
 from sklearn import linear_model
 
@@ -78,3 +81,31 @@ def test_dsapp_lr(data):
     pipeline.fit(data["X_train"], data["y_train"])
 
     assert np.all(dsapp_lr.predict(data["X_test"]) == pipeline.predict(data["X_test"]))
+
+
+def test_chunked_dsapp_lr(data):
+    def chunks():
+        for start in range(0, len(data["X_train"]), 100):
+            yield (
+                data["X_train"][start:(start + 100)],
+                data["y_train"][start:(start + 100)],
+                None,
+            )
+
+    chunked_lr = ChunkedScaledLogisticRegression(random_state=0)
+    chunked_lr.fit_chunks(chunks)
+
+    # the scaling statistics come from every chunk, so are the same as for the whole matrix
+    mms = preprocessing.MinMaxScaler().fit(data["X_train"])
+    np.testing.assert_array_almost_equal(chunked_lr.data_min_, mms.data_min_)
+    np.testing.assert_array_almost_equal(chunked_lr.data_max_, mms.data_max_)
+    np.testing.assert_array_equal(
+        chunked_lr.coef_,
+        ChunkedScaledLogisticRegression(random_state=0).fit_chunks(chunks).coef_,
+    )
+
+    dsapp_lr = ScaledLogisticRegression().fit(data["X_train"], data["y_train"])
+    assert chunked_lr.score(data["X_test"], data["y_test"]) > 0.9
+    assert np.mean(
+        chunked_lr.predict(data["X_test"]) == dsapp_lr.predict(data["X_test"])
+    ) > 0.9
@@ -524,6 +524,65 @@ def test_evaluation_with_sort_ties(db_engine_with_results_schema):
         assert record["standard_deviation"]
 
 
+def test_evaluation_buffered(db_engine_with_results_schema):
+    model_evaluator = ModelEvaluator(
+        testing_metric_groups=[
+            {
+                "metrics": ["precision@", "recall@"],
+                "thresholds": {"top_n": [3]},
+            },
+        ],
+        training_metric_groups=[{"metrics": ["precision@"], "thresholds": {"top_n": [3]}}],
+        db_engine=db_engine_with_results_schema,
+        evaluation_buffer_size=7,
+    )
+    labels = numpy.array([1, 0, 1, 0, 0])
+    prediction_probas = numpy.array([0.56, 0.55, 0.5, 0.4, 0.3])
+    test_matrix_store = MockMatrixStore("test", "1234", 5, db_engine_with_results_schema, labels)
+    train_matrix_store = MockMatrixStore("train", "2345", 5, db_engine_with_results_schema, labels)
+    models = [ModelFactory() for _ in range(3)]
+    session.commit()
+    model_ids = [model.model_id for model in models]
+
+    def saved_evaluations():
+        return sorted(db_engine_with_results_schema.execute(
+            """select model_id, metric, 'test' from test_results.evaluations
+            union all
+            select model_id, metric, 'train' from train_results.evaluations"""
+        ))
+
+    # an earlier evaluation of the first model is replaced
+    EvaluationFactory(
+        model_rel=models[0],
+        evaluation_start_time=test_matrix_store.as_of_dates[0],
+        evaluation_end_time=test_matrix_store.as_of_dates[-1],
+        as_of_date_frequency=test_matrix_store.metadata["as_of_date_frequency"],
+        metric="f1",
+        parameter="",
+    )
+    session.commit()
+
+    for model_id in model_ids[:2]:
+        model_evaluator.evaluate(prediction_probas, test_matrix_store, model_id)
+        model_evaluator.evaluate(prediction_probas, train_matrix_store, model_id)
+    # evaluating a model again replaces its buffered evaluations
+    model_evaluator.evaluate(prediction_probas, test_matrix_store, model_ids[0])
+    assert len(saved_evaluations()) == 1
+
+    # the buffer is written once it holds enough evaluations
+    model_evaluator.evaluate(prediction_probas, test_matrix_store, model_ids[2])
+    expected = sorted(
+        [(model_id, metric, "test") for model_id in model_ids for metric in ("precision@", "recall@")]
+        + [(model_id, "precision@", "train") for model_id in model_ids[:2]]
+    )
+    assert saved_evaluations() == expected
+
+    model_evaluator.evaluate(prediction_probas, train_matrix_store, model_ids[2])
+    assert saved_evaluations() == expected
+    model_evaluator.flush()
+    assert saved_evaluations() == sorted(expected + [(model_ids[2], "precision@", "train")])
+
+
 def test_ModelEvaluator_needs_evaluation_no_bias_audit(db_engine_with_results_schema):
     # TEST SETUP:
 
@@ -645,6 +704,29 @@ def test_ModelEvaluator_needs_evaluation_no_bias_audit(db_engine_with_results_sc
             model_id=model_with_evaluations.model_id,
             subset_hash=subset_hash,
         )
+
+    # all subsets are checked at once, and only those missing evaluations are returned
+    subset_hashes = [""] + [filename_friendly_hash(subset) for subset in SUBSETS]
+    assert ModelEvaluator(
+        testing_metric_groups=[{
+            "metrics": ["precision@", "recall@"],
+            "thresholds": {"top_n": [100]},
+        }],
+        training_metric_groups=[],
+        db_engine=db_engine_with_results_schema,
+    ).subsets_needing_evaluations(
+        test_matrix_store, model_with_evaluations.model_id, subset_hashes + ["other"]
+    ) == set(subset_hashes + ["other"])
+    assert ModelEvaluator(
+        testing_metric_groups=[{
+            "metrics": ["precision@"],
+            "thresholds": {"top_n": [100]},
+        }],
+        training_metric_groups=[],
+        db_engine=db_engine_with_results_schema,
+    ).subsets_needing_evaluations(
+        test_matrix_store, model_with_evaluations.model_id, subset_hashes + ["other"]
+    ) == {"other"}
     session.close()
     session.remove()
 
@@ -744,6 +826,69 @@ def test_evaluation_with_protected_df(db_engine_with_results_schema):
         assert record['attribute_value'] == 'value1'
 
 
+def test_evaluation_bias_audit_replaced(db_engine_with_results_schema):
+    # Test that the audit lines the protected attributes up with the sorted predictions,
+    # and that evaluating again replaces the audit rather than adding to it
+    model_evaluator = ModelEvaluator(
+        testing_metric_groups=[
+            {
+                "metrics": ["precision@"],
+                "thresholds": {"top_n": [2]},
+            },
+        ],
+        training_metric_groups=[],
+        bias_config={
+            'thresholds': {'top_n': [2], 'percentiles': [50]}
+        },
+        db_engine=db_engine_with_results_schema,
+    )
+    testing_labels = numpy.array([0, 0, 1, 1])
+    testing_prediction_probas = numpy.array([0.9, 0.1, 0.8, 0.2])
+    fake_test_matrix_store = MockMatrixStore(
+        "test", "1234", 4, db_engine_with_results_schema, testing_labels
+    )
+    trained_model, model_id = fake_trained_model(
+        db_engine_with_results_schema,
+        train_end_time=TRAIN_END_TIME,
+    )
+    protected_df = pandas.DataFrame({"score_group": ["high", "low", "high", "low"]})
+
+    def audit_rows():
+        return [
+            dict(row)
+            for row in db_engine_with_results_schema.execute(
+                """select * from test_results.aequitas
+                where model_id = %s
+                order by tie_breaker, parameter, attribute_value""",
+                model_id,
+            )
+        ]
+
+    model_evaluator.evaluate(
+        testing_prediction_probas, fake_test_matrix_store, model_id, protected_df
+    )
+    records = audit_rows()
+    # 2 tie breakers x 2 thresholds x 2 groups
+    assert len(records) == 8
+    for record in records:
+        assert record['subset_hash'] == ''
+        assert record['matrix_uuid'] == '1234'
+        if record['attribute_value'] == 'high':
+            assert record['pp'] == 2
+            assert record['tp'] == 1
+            assert record['Statistical_Parity'] is False
+        else:
+            assert record['pp'] == 0
+            assert record['for'] == 0.5
+            assert record['Statistical_Parity'] is None
+    assert {record['tie_breaker'] for record in records} == {'best', 'worst'}
+
+    model_evaluator.evaluate(
+        testing_prediction_probas, fake_test_matrix_store, model_id, protected_df
+    )
+    assert audit_rows() == records
+
+
 def test_generate_binary_at_x():
     input_array = numpy.array([0.9, 0.8, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.6])
 
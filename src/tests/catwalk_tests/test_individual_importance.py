@@ -1,6 +1,10 @@
+import pandas
+import pytest
+
 from triage.component.catwalk.individual_importance import (
     IndividualImportanceCalculator,
 )
+from triage.component.catwalk.utils import save_db_objects
 from tests.utils import (
     rig_engines,
     fake_trained_model,
@@ -77,3 +81,75 @@ def test_calculate_and_save():
         ]
         assert len(records) == len(new_records)
         assert records == new_records
+
+
+def test_calculate_and_save_all_dates_single_copy():
+    with rig_engines() as (db_engine, project_storage):
+        train_store = get_matrix_store(
+            project_storage,
+            matrix_creator(),
+            matrix_metadata_creator(matrix_type="train"),
+        )
+        test_store = get_matrix_store(
+            project_storage,
+            pandas.DataFrame.from_dict({
+                "entity_id": [1, 2, 1],
+                "as_of_date": ["2016-01-01", "2016-01-01", "2017-01-01"],
+                "feature_one": [3, 4, 5],
+                "feature_two": [5, 6, 7],
+                "label": [0, 1, 0],
+            }),
+            matrix_metadata_creator(matrix_type="test"),
+        )
+        _, model_id = fake_trained_model(db_engine, train_matrix_uuid=train_store.uuid)
+        for feature, importance in [("feature_one", 0.75), ("feature_two", 0.25)]:
+            db_engine.execute(
+                """insert into train_results.feature_importances
+                (model_id, feature, feature_importance) values (%s, %s, %s)""",
+                model_id,
+                feature,
+                importance,
+            )
+        calculator = IndividualImportanceCalculator(db_engine, methods=["uniform"])
+
+        def saved_records():
+            return [
+                tuple(row)
+                for row in db_engine.execute(
+                    """select entity_id, as_of_date, feature, feature_value,
+                    method, importance_score
+                    from test_results.individual_importances
+                    where model_id = %s
+                    order by as_of_date, entity_id, feature""",
+                    model_id,
+                )
+            ]
+
+        # the records saved one date at a time
+        for as_of_date in test_store.as_of_dates:
+            calculator.calculate_and_save(model_id, test_store, "uniform", as_of_date)
+        per_date_records = saved_records()
+        assert len(per_date_records) == 6  # 2 features x 3 rows
+
+        # are replaced by the same records, saved with one COPY for all dates
+        with patch(
+            "triage.component.catwalk.individual_importance.save_db_objects",
+            wraps=save_db_objects,
+        ) as save_mock:
+            calculator.calculate_and_save_all_methods_and_dates(model_id, test_store)
+        assert save_mock.call_count == 1
+        assert saved_records() == per_date_records
+
+
+def test_calculate_and_save_model_strategy_needs_storage():
+    with rig_engines() as (db_engine, project_storage):
+        test_store = get_matrix_store(
+            project_storage,
+            matrix_creator(),
+            matrix_metadata_creator(matrix_type="test"),
+        )
+        calculator = IndividualImportanceCalculator(
+            db_engine, methods=["tree_contributions"]
+        )
+        with pytest.raises(ValueError):
+            calculator.calculate_and_save_all_methods_and_dates(1, test_store)
@@ -0,0 +1,131 @@
+import datetime
+
+import numpy
+import pandas
+import pytest
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.tree import DecisionTreeClassifier
+
+from triage.component.catwalk.individual_importance.tree_contributions import (
+    tree_contributions,
+    tree_contributions_all_dates,
+)
+from tests.utils import rig_engines, get_matrix_store, matrix_metadata_creator
+
+from tests.results_tests.factories import ModelFactory, session
+
+
+def _test_matrix():
+    random = numpy.random.RandomState(5)
+    num_rows = 60
+    features = random.rand(num_rows, 4)
+    data_dict = {
+        "entity_id": list(range(num_rows)),
+        "as_of_date": ["2016-01-01"] * 40 + ["2017-01-01"] * 20,
+        "label": (features[:, 0] + 0.5 * features[:, 1] > 0.75).astype(int),
+    }
+    for i in range(features.shape[1]):
+        data_dict["feature_{}".format(i)] = features[:, i]
+    return pandas.DataFrame.from_dict(data_dict)
+
+
+@pytest.mark.parametrize(
+    "model,predict",
+    [
+        (
+            DecisionTreeClassifier(max_depth=4, random_state=0),
+            lambda model, X: model.predict_proba(X)[:, 1],
+        ),
+        (
+            RandomForestClassifier(n_estimators=10, max_depth=4, random_state=0),
+            lambda model, X: model.predict_proba(X)[:, 1],
+        ),
+        (
+            GradientBoostingClassifier(n_estimators=10, max_depth=2, random_state=0),
+            lambda model, X: model.decision_function(X),
+        ),
+    ],
+    ids=["tree", "forest", "boosting"],
+)
+def test_tree_contributions(model, predict):
+    with rig_engines() as (db_engine, project_storage):
+        test_store = get_matrix_store(
+            project_storage, _test_matrix(), matrix_metadata_creator()
+        )
+        model.fit(test_store.design_matrix.values, test_store.labels.values)
+        model_row = ModelFactory()
+        session.commit()
+        model_storage_engine = project_storage.model_storage_engine()
+        model_storage_engine.write(model, model_row.model_hash)
+
+        as_of_dates = [datetime.date(2016, 1, 1), datetime.date(2017, 1, 1)]
+        results = tree_contributions_all_dates(
+            db_engine,
+            model_id=model_row.model_id,
+            as_of_dates=as_of_dates,
+            test_matrix_store=test_store,
+            n_ranks=4,
+            model_storage_engine=model_storage_engine,
+            n_jobs=2,
+            batch_size=7,
+        )
+        assert len(results[as_of_dates[0]]) == 40 * 4
+        assert len(results[as_of_dates[1]]) == 20 * 4
+
+        # the contributions of all features sum to the prediction, less the prediction
+        # at the root of the trees, which is the same for every entity
+        records = pandas.DataFrame.from_records(
+            results[as_of_dates[0]] + results[as_of_dates[1]]
+        )
+        summed = records.groupby("entity_id")["score"].sum().sort_index()
+        predictions = predict(model, test_store.design_matrix.values)
+        assert numpy.allclose(
+            predictions - summed.values, predictions[0] - summed.values[0]
+        )
+
+        # each entity's features are ordered by the size of their contribution
+        for _, entity_records in records.groupby("entity_id", sort=False):
+            sizes = entity_records["score"].abs().tolist()
+            assert sizes == sorted(sizes, reverse=True)
+            assert set(entity_records["feature_name"]) == set(test_store.columns())
+
+        # and the feature values are those of the matrix
+        first = records.iloc[0]
+        assert first["feature_value"] == test_store.design_matrix.loc[
+            (first["entity_id"], pandas.Timestamp(2016, 1, 1)), first["feature_name"]
+        ]
+
+        # calculating one date with fewer ranks keeps the top features
+        top_records = tree_contributions(
+            db_engine,
+            model_id=model_row.model_id,
+            as_of_date=as_of_dates[1],
+            test_matrix_store=test_store,
+            n_ranks=2,
+            model_storage_engine=model_storage_engine,
+        )
+        assert len(top_records) == 20 * 2
+        assert top_records[:2] == results[as_of_dates[1]][:2]
+
+
+def test_tree_contributions_unsupported_model():
+    with rig_engines() as (db_engine, project_storage):
+        test_store = get_matrix_store(
+            project_storage, _test_matrix(), matrix_metadata_creator()
+        )
+        model = LogisticRegression(solver="liblinear")
+        model.fit(test_store.design_matrix.values, test_store.labels.values)
+        model_row = ModelFactory()
+        session.commit()
+        model_storage_engine = project_storage.model_storage_engine()
+        model_storage_engine.write(model, model_row.model_hash)
+
+        assert tree_contributions(
+            db_engine,
+            model_id=model_row.model_id,
+            as_of_date=datetime.date(2016, 1, 1),
+            test_matrix_store=test_store,
+            n_ranks=5,
+            model_storage_engine=model_storage_engine,
+        ) == []
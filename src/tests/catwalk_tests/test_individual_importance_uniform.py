@@ -1,6 +1,10 @@
 import pandas
+import pytest
 
-from triage.component.catwalk.individual_importance.uniform import uniform_distribution
+from triage.component.catwalk.individual_importance.uniform import (
+    uniform_distribution,
+    uniform_distribution_all_dates,
+)
 from tests.utils import rig_engines, get_matrix_store, matrix_metadata_creator
 import datetime
 
@@ -45,3 +49,62 @@ def test_uniform_distribution():
             assert result["score"] <= 1
             assert isinstance(result["feature_name"], str)
             assert result["entity_id"] in [1, 2]
+
+
+def test_uniform_distribution_all_dates():
+    with rig_engines() as (db_engine, project_storage):
+        model = ModelFactory()
+        feature_importances = [
+            FeatureImportanceFactory(model_rel=model, feature="feature_{}".format(i))
+            for i in range(0, 10)
+        ]
+        data_dict = {
+            "entity_id": [1, 2, 1, 3],
+            "as_of_date": ["2016-01-01", "2016-01-01", "2017-01-01", "2016-01-01"],
+            "label": [0, 1, 1, 0],
+        }
+        for i, imp in enumerate(feature_importances):
+            data_dict[imp.feature] = [i, i + 0.25, i + 0.5, i + 0.75]
+        test_store = get_matrix_store(
+            project_storage,
+            pandas.DataFrame.from_dict(data_dict),
+            matrix_metadata_creator(),
+        )
+        as_of_dates = [datetime.date(2016, 1, 1), datetime.date(2017, 1, 1)]
+        results = uniform_distribution_all_dates(
+            db_engine,
+            model_id=model.model_id,
+            as_of_dates=as_of_dates,
+            test_matrix_store=test_store,
+            n_ranks=5,
+        )
+
+        assert set(results.keys()) == set(as_of_dates)
+        assert len(results[datetime.date(2016, 1, 1)]) == 15  # 5 features x 3 entities
+        assert len(results[datetime.date(2017, 1, 1)]) == 5
+        # the same records, in the same order, as calculating one date at a time
+        for as_of_date in as_of_dates:
+            assert results[as_of_date] == uniform_distribution(
+                db_engine,
+                model_id=model.model_id,
+                as_of_date=as_of_date,
+                test_matrix_store=test_store,
+                n_ranks=5,
+            )
+        assert [
+            result["entity_id"] for result in results[datetime.date(2016, 1, 1)][:3]
+        ] == [1, 2, 3]
+
+
+def test_uniform_distribution_date_type():
+    with rig_engines() as (db_engine, project_storage):
+        model = ModelFactory()
+        test_store = get_matrix_store(project_storage)
+        with pytest.raises(TypeError):
+            uniform_distribution(
+                db_engine,
+                model_id=model.model_id,
+                as_of_date="2016-01-01",
+                test_matrix_store=test_store,
+                n_ranks=5,
+            )
@@ -11,6 +11,8 @@ from tests.utils import (
     matrix_metadata_creator,
 )
 
+from tests.results_tests.factories import MatrixFactory, ModelFactory, session as factory_session
+
 from unittest.mock import patch, create_autospec, MagicMock
 
 
@@ -51,7 +53,123 @@ def test_ModelTrainTester_generate_tasks(db_engine_with_results_schema, project_
                 train_tester.process_task(**task)
 
 
-def setup_model_train_tester(project_storage, replace):
+def test_ModelTrainTester_order_tasks_by_expected_runtime(db_engine_with_results_schema):
+    db_engine = db_engine_with_results_schema
+    feature_dictionary = {'features.table': ['f1', 'f2']}
+    small_matrix = MatrixFactory(num_observations=10, feature_dictionary=feature_dictionary)
+    big_matrix = MatrixFactory(num_observations=1000, feature_dictionary=feature_dictionary)
+    # a fast tree and a slow forest, both trained on the small matrix before
+    ModelFactory(
+        model_type='sklearn.tree.DecisionTreeClassifier',
+        hyperparameters={'max_depth': 3},
+        matrix_rel=small_matrix,
+        training_time=1.0,
+    )
+    ModelFactory(
+        model_type='sklearn.ensemble.RandomForestClassifier',
+        hyperparameters={'n_estimators': 1000},
+        matrix_rel=small_matrix,
+        training_time=60.0,
+    )
+    factory_session.commit()
+    trainer = ModelTrainer(
+        experiment_hash=save_experiment_and_get_hash({}, db_engine),
+        model_storage_engine=None,
+        db_engine=db_engine,
+    )
+    train_tester = ModelTrainTester(
+        matrix_storage_engine=None,
+        model_trainer=trainer,
+        model_evaluator=None,
+        individual_importance_calculator=None,
+        predictor=None,
+        subsets=None,
+        protected_groups_generator=None,
+        n_processes=2,
+    )
+
+    def task(class_path, parameters, matrix):
+        return {
+            'train_store': MagicMock(uuid=matrix.matrix_uuid),
+            'test_store': MagicMock(),
+            'train_kwargs': {'class_path': class_path, 'parameters': parameters},
+        }
+
+    small_tree = task('sklearn.tree.DecisionTreeClassifier', {'max_depth': 3}, small_matrix)
+    big_tree = task('sklearn.tree.DecisionTreeClassifier', {'max_depth': 3}, big_matrix)
+    small_forest = task(
+        'sklearn.ensemble.RandomForestClassifier', {'n_estimators': 1000, 'n_jobs': 2}, small_matrix
+    )
+    whole_machine_forest = task(
+        'sklearn.ensemble.RandomForestClassifier', {'n_estimators': 1000, 'n_jobs': -1}, small_matrix
+    )
+    never_trained = task('sklearn.svm.SVC', {}, small_matrix)
+    tasks = [small_tree, big_tree, small_forest, whole_machine_forest, never_trained]
+
+    # the big tree scales with its matrix, and the unknown class is assumed to be
+    # as slow as the slowest known task
+    assert train_tester.expected_runtimes(tasks) == [1.0, 100.0, 60.0, 60.0, 100.0]
+
+    batches = train_tester.order_and_batch_tasks(tasks)
+    assert len(batches) == 3
+    # the forest uses both cores, so it runs by itself
+    assert batches[0].parallelizable
+    assert batches[0].tasks == [small_forest]
+    assert batches[0].n_processes == 1
+    assert batches[1].parallelizable
+    assert batches[1].tasks == [big_tree, never_trained, small_tree]
+    assert batches[1].n_processes is None
+    assert not batches[2].parallelizable
+    assert batches[2].tasks == [whole_machine_forest]
+
+
+def test_ModelTrainTester_order_tasks_without_history(db_engine_with_results_schema):
+    trainer = ModelTrainer(
+        experiment_hash=save_experiment_and_get_hash({}, db_engine_with_results_schema),
+        model_storage_engine=None,
+        db_engine=db_engine_with_results_schema,
+    )
+    train_tester = ModelTrainTester(
+        matrix_storage_engine=None,
+        model_trainer=trainer,
+        model_evaluator=None,
+        individual_importance_calculator=None,
+        predictor=None,
+        subsets=None,
+        protected_groups_generator=None,
+    )
+    tasks = [
+        {
+            'train_store': MagicMock(uuid='abcd'),
+            'test_store': MagicMock(),
+            'train_kwargs': {'class_path': 'sklearn.tree.DecisionTreeClassifier', 'parameters': {}},
+        }
+    ]
+    assert train_tester.expected_runtimes(tasks) is None
+    # with nothing to go on, tasks are batched by class path
+    batches = train_tester.order_and_batch_tasks(tasks)
+    assert len(batches) == 3
+    assert batches[0].tasks == tasks
+
+
+def test_ModelTrainTester_order_warm_start_chains():
+    def task(model_hash, warm_start_model_hashes=None):
+        train_kwargs = {'model_hash': model_hash}
+        if warm_start_model_hashes:
+            train_kwargs['warm_start_model_hashes'] = warm_start_model_hashes
+        return {'train_kwargs': train_kwargs}
+
+    big_forest = task('big', ['medium', 'small'])
+    medium_forest = task('medium', ['small'])
+    small_forest = task('small')
+    tree = task('tree')
+    tasks = [big_forest, tree, medium_forest, small_forest]
+    ModelTrainTester.order_warm_start_chains(tasks)
+    # the forests keep their positions, but the smallest goes first
+    assert tasks == [small_forest, tree, medium_forest, big_forest]
+
+
+def setup_model_train_tester(project_storage, replace, out_of_core_chunk_size=None):
     matrix_storage_engine = MatrixStorageEngine(project_storage)
     train_matrix_store = get_matrix_store(
         project_storage,
@@ -89,38 +207,55 @@ def setup_model_train_tester(project_storage, replace):
         predictor=predictor,
         subsets=[None],
         replace=replace,
-        protected_groups_generator=protected_groups_generator
+        protected_groups_generator=protected_groups_generator,
+        out_of_core_chunk_size=out_of_core_chunk_size,
     )
     return train_tester, train_test_task
 
 
 def test_ModelTrainTester_process_task_replace_False_needs_evaluations(project_storage):
     train_tester, train_test_task = setup_model_train_tester(project_storage, replace=False)
-    train_tester.model_evaluator.needs_evaluations.return_value = True
+    train_tester.model_evaluator.subsets_needing_evaluations.return_value = {""}
     train_tester.process_task(**train_test_task)
-    assert train_tester.model_evaluator.needs_evaluations.call_count == 2
+    assert train_tester.model_evaluator.subsets_needing_evaluations.call_count == 2
     assert train_tester.predictor.predict.call_count == 2
     assert train_tester.model_evaluator.evaluate.call_count == 2
-    assert train_tester.protected_groups_generator.as_dataframe.call_count == 2
+    assert train_tester.protected_groups_generator.as_matrix_dataframe.call_count == 2
 
 
 def test_ModelTrainTester_process_task_replace_False_no_evaluations(project_storage):
     train_tester, train_test_task = setup_model_train_tester(project_storage, replace=False)
-    train_tester.model_evaluator.needs_evaluations.return_value = False
+    train_tester.model_evaluator.subsets_needing_evaluations.return_value = set()
     train_tester.process_task(**train_test_task)
-    assert train_tester.model_evaluator.needs_evaluations.call_count == 2
+    assert train_tester.model_evaluator.subsets_needing_evaluations.call_count == 2
     assert train_tester.predictor.predict.call_count == 0
     assert train_tester.model_evaluator.evaluate.call_count == 0
-    assert train_tester.protected_groups_generator.as_dataframe.call_count == 0
+    assert train_tester.protected_groups_generator.as_matrix_dataframe.call_count == 0
 
 
 def test_ModelTrainTester_process_task_replace_True(project_storage):
     train_tester, train_test_task = setup_model_train_tester(project_storage, replace=True)
     train_tester.process_task(**train_test_task)
-    assert train_tester.model_evaluator.needs_evaluations.call_count == 0
+    assert train_tester.model_evaluator.subsets_needing_evaluations.call_count == 0
     assert train_tester.predictor.predict.call_count == 2
     assert train_tester.model_evaluator.evaluate.call_count == 2
-    assert train_tester.protected_groups_generator.as_dataframe.call_count == 2
+    assert train_tester.protected_groups_generator.as_matrix_dataframe.call_count == 2
+
+
+def test_ModelTrainTester_process_task_out_of_core(project_storage):
+    train_tester, train_test_task = setup_model_train_tester(
+        project_storage, replace=True, out_of_core_chunk_size=1
+    )
+    train_store = train_test_task['train_store']
+    with patch.object(train_store, '_load', wraps=train_store._load) as load_mock:
+        train_tester.process_task(**train_test_task)
+        # the train matrix is only read in chunks
+        assert not load_mock.called
+    assert train_tester.model_trainer.process_train_task.call_count == 1
+    # only the test matrix gets predictions and evaluations
+    assert train_tester.predictor.predict.call_count == 1
+    assert train_tester.model_evaluator.evaluate.call_count == 1
+    assert train_tester.predictor.predict.call_args[0][1] is train_test_task['test_store']
 
 
 def test_ModelTrainTester_process_task_empty_train(project_storage):
@@ -131,7 +266,7 @@ def test_ModelTrainTester_process_task_empty_train(project_storage):
     train_tester.process_task(**train_test_task)
 
     assert train_tester.model_trainer.process_train_task.call_count == 0
-    assert train_tester.model_evaluator.needs_evaluations.call_count == 0
+    assert train_tester.model_evaluator.subsets_needing_evaluations.call_count == 0
     assert train_tester.predictor.predict.call_count == 0
     assert train_tester.model_evaluator.evaluate.call_count == 0
-    assert train_tester.protected_groups_generator.as_dataframe.call_count == 0
+    assert train_tester.protected_groups_generator.as_matrix_dataframe.call_count == 0
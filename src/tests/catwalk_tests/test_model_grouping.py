@@ -1,6 +1,7 @@
 import testing.postgresql
 import datetime
 from copy import copy
+from unittest.mock import patch
 
 from sqlalchemy import create_engine
 from triage.component.catwalk.db import ensure_db
@@ -97,3 +98,24 @@ def test_model_grouping_custom_config():
             )
             == 3
         )
+
+
+def test_model_grouping_cached():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        ensure_db(engine)
+        model_grouper = ModelGrouper()
+        with patch.object(engine, "raw_connection", wraps=engine.raw_connection) as connect_mock:
+            model_group_id = model_grouper.get_model_group_id(
+                "module.Classifier", {"param1": "val1"}, sample_metadata(), engine
+            )
+            # the same group is only looked up in the database once
+            assert model_grouper.get_model_group_id(
+                "module.Classifier", {"param1": "val1"}, sample_metadata(), engine
+            ) == model_group_id
+            assert connect_mock.call_count == 1
+            # but other groups are still looked up
+            assert model_grouper.get_model_group_id(
+                "module.Classifier", {"param1": "val2"}, sample_metadata(), engine
+            ) != model_group_id
+            assert connect_mock.call_count == 2
@@ -1,11 +1,13 @@
+import numpy
 import pandas
 import random
 import pytest
+from unittest.mock import patch
 
 
 from triage.component.catwalk.model_grouping import ModelGrouper
 from triage.component.catwalk.model_trainers import ModelTrainer
-from tests.utils import get_matrix_store
+from tests.utils import get_matrix_store, matrix_metadata_creator
 
 
 @pytest.fixture
@@ -84,12 +86,20 @@ def test_model_trainer(grid_config, default_model_trainer):
     # 3. that the model sizes are saved in the table and all are < 1 kB
     records = [
         row
-        for row in db_engine.execute("select model_size from model_metadata.models")
+        for row in db_engine.execute("select model_size, model_hash from model_metadata.models")
     ]
     assert len(records) == 4
     for i in records:
         size = i[0]
         assert size < 1
+        # the size of the stored model file
+        assert size == model_storage_engine.size(i[1]) / 1024.0
+
+    # and that the training times are saved too
+    ((num_timed,),) = db_engine.execute(
+        "select count(*) from model_metadata.models where training_time >= 0"
+    )
+    assert num_timed == 4
 
     # 4. that all four models are cached
     model_pickles = [model_storage_engine.load(model_hash) for model_hash in hashes]
@@ -279,8 +289,143 @@ def test_n_jobs_not_new_model(default_model_trainer):
     assert hashes == set(task['model_hash'] for task in new_train_tasks)
 
 
+def test_warm_start_grid(default_model_trainer):
+    grid_config = {
+        "sklearn.ensemble.RandomForestClassifier": {
+            "n_estimators": [3, 12, 6],
+            "max_depth": [2, 4],
+            "random_state": [7],
+        },
+    }
+    trainer = default_model_trainer
+    project_storage = trainer.model_storage_engine.project_storage
+    matrix_store = get_matrix_store(project_storage)
+    train_tasks = trainer.generate_train_tasks(grid_config, dict(), matrix_store)
+
+    # each forest can grow from the smaller ones with the same max_depth, largest first
+    hashes = {
+        (task["parameters"]["max_depth"], task["parameters"]["n_estimators"]): task["model_hash"]
+        for task in train_tasks
+    }
+    for task in train_tasks:
+        depth, size = task["parameters"]["max_depth"], task["parameters"]["n_estimators"]
+        expected = [
+            hashes[depth, smaller] for smaller in sorted([3, 6, 12], reverse=True) if smaller < size
+        ]
+        assert task.get("warm_start_model_hashes", []) == expected
+
+    for train_task in sorted(train_tasks, key=lambda task: task["parameters"]["n_estimators"]):
+        with patch.object(trainer, "_train", wraps=trainer._train) as train_mock:
+            trainer.process_train_task(**train_task)
+            warm_start_model = train_mock.call_args[0][3]
+        if train_task["parameters"]["n_estimators"] == 3:
+            assert warm_start_model is None
+        else:
+            # grown from the next smallest forest
+            assert len(warm_start_model.estimators_) == train_task["parameters"]["n_estimators"]
+
+    # the grown forests are the same as forests fit from scratch
+    for (depth, size), model_hash in hashes.items():
+        grown = trainer.model_storage_engine.load(model_hash)
+        assert not grown.warm_start
+        from_scratch = trainer._train(
+            matrix_store,
+            "sklearn.ensemble.RandomForestClassifier",
+            {"n_estimators": size, "max_depth": depth, "random_state": 7},
+        )
+        numpy.testing.assert_array_equal(
+            grown.predict_proba(matrix_store.design_matrix),
+            from_scratch.predict_proba(matrix_store.design_matrix),
+        )
+
+
+def test_negative_downsampling_sample_weight(default_model_trainer):
+    trainer = default_model_trainer
+    project_storage = trainer.model_storage_engine.project_storage
+    matrix_store = get_matrix_store(
+        project_storage,
+        metadata=matrix_metadata_creator(matrix_type="train", negative_sample_rate=0.25),
+    )
+    with patch("sklearn.tree.DecisionTreeClassifier.fit", autospec=True) as fit_mock:
+        trainer._train(matrix_store, "sklearn.tree.DecisionTreeClassifier", {})
+    # negative rows stand in for the ones that were sampled away
+    numpy.testing.assert_array_equal(
+        fit_mock.call_args[1]["sample_weight"],
+        numpy.where(matrix_store.labels == 0, 4.0, 1.0),
+    )
+
+    # estimators that don't take sample weights are trained without them
+    model = trainer._train(
+        matrix_store, "sklearn.neighbors.KNeighborsClassifier", {"n_neighbors": 1}
+    )
+    assert model.predict(matrix_store.design_matrix) is not None
+
+
+def test_out_of_core_training(db_engine_with_results_schema, project_storage):
+    trainer = ModelTrainer(
+        experiment_hash=None,
+        model_storage_engine=project_storage.model_storage_engine(),
+        db_engine=db_engine_with_results_schema,
+        out_of_core_chunk_size=1,
+    )
+    matrix_store = get_matrix_store(
+        project_storage,
+        metadata=matrix_metadata_creator(matrix_type="train", negative_sample_rate=0.5),
+    )
+
+    # the matrix is read one row at a time, never all at once
+    with patch.object(matrix_store, "_load") as load_mock, \
+            patch("sklearn.naive_bayes.BernoulliNB.partial_fit", autospec=True) as partial_fit_mock:
+        trainer._train(matrix_store, "sklearn.naive_bayes.BernoulliNB", {})
+        assert not load_mock.called
+    assert partial_fit_mock.call_count == 2
+    for call, label, weight in zip(partial_fit_mock.call_args_list, [0, 1], [2.0, 1.0]):
+        _, design_matrix, labels = call[0]
+        assert len(design_matrix) == 1
+        assert labels.tolist() == [label]
+        numpy.testing.assert_array_equal(call[1]["classes"], [0, 1])
+        numpy.testing.assert_array_equal(call[1]["sample_weight"], [weight])
+
+    with patch.object(matrix_store, "_load") as load_mock:
+        model = trainer._train(
+            matrix_store,
+            "triage.component.catwalk.estimators.classifiers.ChunkedScaledLogisticRegression",
+            {"random_state": 0},
+        )
+        assert not load_mock.called
+    assert model.predict_proba(matrix_store.design_matrix).shape == (2, 2)
+
+    # estimators without partial_fit are trained on the whole matrix
+    model = trainer._train(matrix_store, "sklearn.tree.DecisionTreeClassifier", {})
+    assert model.predict(matrix_store.design_matrix).tolist() == [0, 1]
+
+
 def test_cache_models(default_model_trainer):
     assert not default_model_trainer.model_storage_engine.should_cache
     with default_model_trainer.cache_models():
         assert default_model_trainer.model_storage_engine.should_cache
     assert not default_model_trainer.model_storage_engine.should_cache
+
+
+def test_model_and_feature_importances_saved_together(grid_config, default_model_trainer):
+    trainer = default_model_trainer
+    db_engine = trainer.db_engine
+    project_storage = trainer.model_storage_engine.project_storage
+    train_task = trainer.generate_train_tasks(
+        grid_config, dict(), get_matrix_store(project_storage)
+    )[0]
+
+    # if the feature importances can't be saved, neither is the model
+    with patch(
+        "triage.component.catwalk.model_trainers.copy_db_objects",
+        side_effect=ValueError("copy failed"),
+    ):
+        assert trainer.process_train_task(**train_task) is None
+    assert list(db_engine.execute("select * from model_metadata.models")) == []
+
+    model_id = trainer.process_train_task(**train_task)
+    ((num_importances,),) = db_engine.execute(
+        "select count(*) from train_results.feature_importances where model_id = %s",
+        model_id,
+    )
+    assert num_importances == 2
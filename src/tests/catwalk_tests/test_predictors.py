@@ -2,12 +2,12 @@ from contextlib import contextmanager
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import make_transient
 import datetime
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 from numpy.testing import assert_array_almost_equal
 import pandas
 
 from triage.component.results_schema import TestPrediction, Matrix, Model
-from triage.component.catwalk.storage import TestMatrixType
+from triage.component.catwalk.storage import MODEL_CACHE, TestMatrixType
 from triage.component.catwalk.db import ensure_db
 from tests.results_tests.factories import (
     MatrixFactory,
@@ -565,3 +565,27 @@ def test_predictor_retrieve(predict_setup_args):
     )
     assert_array_almost_equal(new_predict_proba, predict_proba, decimal=5)
     assert not predictor.load_model.called
+
+
+def test_predictor_load_model_cached(predict_setup_args):
+    (project_storage, db_engine, model_id) = predict_setup_args
+    model_storage_engine = project_storage.model_storage_engine()
+    predictor = Predictor(model_storage_engine, db_engine, rank_order='worst')
+    MODEL_CACHE.resize(10 * 1024 * 1024)
+    try:
+        model = predictor.load_model(model_id)
+        assert MODEL_CACHE.stats()["misses"] == 1
+        # loading it again touches neither the database nor the project storage
+        with patch(
+            "triage.component.catwalk.predictors.retrieve_model_hash_from_id"
+        ) as retrieve_mock, patch.object(model_storage_engine, "_get_store") as store_mock:
+            assert predictor.load_model(model_id) is model
+            assert not retrieve_mock.called
+            assert not store_mock.called
+        stats = MODEL_CACHE.stats()
+        assert stats["hits"] == 1
+        assert stats["model_hash_hits"] == 1
+        assert stats["num_models"] == 1
+    finally:
+        MODEL_CACHE.resize(0)
+        MODEL_CACHE.clear()
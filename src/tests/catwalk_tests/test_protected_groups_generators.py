@@ -1,10 +1,14 @@
 from datetime import datetime, date
+from tempfile import TemporaryDirectory
 
+import pandas
 import testing.postgresql
 from sqlalchemy.engine import create_engine
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
+from triage.component.catwalk.bias_audit import discretize_attributes
 from triage.component.catwalk.protected_groups_generators import ProtectedGroupsGenerator
+from triage.component.catwalk.storage import ProjectStorage
 
 
 def create_demographics_table(db_engine, data):
@@ -164,3 +168,200 @@ def test_protected_groups_generator_noreplace():
         )
         table_generator.generate.assert_not_called()
         assert_data(table_generator)
+
+
+def test_protected_groups_generator_as_matrix_dataframe():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        create_demographics_table(engine, default_demographics())
+        create_cohort_table(engine, default_cohort())
+        table_generator = ProtectedGroupsGenerator(
+            from_obj="demographics",
+            attribute_columns=['race', 'sex'],
+            entity_id_column="person_id",
+            knowledge_date_column="event_date",
+            db_engine=engine,
+            protected_groups_table_name="protected_groups_abcdef",
+        )
+        as_of_dates = [datetime(2016, 1, 1), datetime(2016, 3, 1)]
+        table_generator.generate_all_dates(
+            as_of_dates,
+            cohort_table_name='cohort_abcdef',
+            cohort_hash='abcdef'
+        )
+        # the matrix rows are in a different order than the protected groups table
+        matrix_store = MagicMock()
+        matrix_store.uuid = "matrix_uuid"
+        matrix_store.as_of_dates = as_of_dates
+        matrix_store.labels = pandas.Series(
+            [0, 1, 0],
+            index=pandas.MultiIndex.from_tuples(
+                [(5, datetime(2016, 3, 1)), (1, datetime(2016, 1, 1)), (5, datetime(2016, 1, 1))],
+                names=["entity_id", "as_of_date"],
+            ),
+        )
+        with patch.object(
+            pandas.DataFrame, "pg_copy_from", wraps=pandas.DataFrame.pg_copy_from
+        ) as copy_mock:
+            protected_df = table_generator.as_matrix_dataframe(matrix_store, "abcdef")
+            assert protected_df.index.equals(matrix_store.labels.index)
+            assert protected_df["race"].dtype.name == "category"
+            assert protected_df["race"].tolist()[:2] == ["wh", "aa"]
+            assert pandas.isnull(protected_df["race"].iloc[2])
+
+            # the protected groups are only queried once for the matrix and its dates
+            assert table_generator.as_matrix_dataframe(matrix_store, "abcdef") is protected_df
+            assert table_generator.as_dataframe(as_of_dates, "abcdef") is \
+                table_generator.as_dataframe(list(reversed(as_of_dates)), "abcdef")
+            assert copy_mock.call_count == 1
+
+            # until they are generated again
+            table_generator.generate_all_dates(
+                as_of_dates,
+                cohort_table_name='cohort_abcdef',
+                cohort_hash='abcdef'
+            )
+            table_generator.as_matrix_dataframe(matrix_store, "abcdef")
+            assert copy_mock.call_count == 2
+
+
+def test_protected_groups_generator_as_matrix_dataframe_storage():
+    with testing.postgresql.Postgresql() as postgresql:
+        with TemporaryDirectory() as temp_dir:
+            engine = create_engine(postgresql.url())
+            create_demographics_table(engine, default_demographics())
+            create_cohort_table(engine, default_cohort())
+            storage_engine = ProjectStorage(temp_dir).protected_groups_storage_engine(
+                "protected_groups_abcdef"
+            )
+
+            def generator():
+                return ProtectedGroupsGenerator(
+                    from_obj="demographics",
+                    attribute_columns=['race', 'sex'],
+                    entity_id_column="person_id",
+                    knowledge_date_column="event_date",
+                    db_engine=engine,
+                    protected_groups_table_name="protected_groups_abcdef",
+                    storage_engine=storage_engine,
+                )
+
+            as_of_dates = [datetime(2016, 1, 1), datetime(2016, 3, 1)]
+            generator().generate_all_dates(
+                as_of_dates,
+                cohort_table_name='cohort_abcdef',
+                cohort_hash='abcdef'
+            )
+            matrix_store = MagicMock()
+            matrix_store.uuid = "matrix_uuid"
+            matrix_store.as_of_dates = as_of_dates
+            matrix_store.labels = pandas.Series(
+                [0, 1],
+                index=pandas.MultiIndex.from_tuples(
+                    [(5, datetime(2016, 3, 1)), (1, datetime(2016, 1, 1))],
+                    names=["entity_id", "as_of_date"],
+                ),
+            )
+            with patch.object(
+                pandas.DataFrame, "pg_copy_from", wraps=pandas.DataFrame.pg_copy_from
+            ) as copy_mock:
+                protected_df = generator().as_matrix_dataframe(matrix_store, "abcdef")
+                assert copy_mock.call_count == 1
+
+                # other generators, e.g. in other processes, load the saved ones
+                pandas.testing.assert_frame_equal(
+                    generator().as_matrix_dataframe(matrix_store, "abcdef"),
+                    protected_df,
+                )
+                assert copy_mock.call_count == 1
+
+                # until they are generated again
+                generator().generate_all_dates(
+                    as_of_dates,
+                    cohort_table_name='cohort_abcdef',
+                    cohort_hash='abcdef'
+                )
+                generator().as_matrix_dataframe(matrix_store, "abcdef")
+                assert copy_mock.call_count == 2
+
+
+def test_protected_groups_generator_as_matrix_dataframe_numeric():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        engine.execute(
+            "create table demographics (person_id int, event_date date, race text, age int)"
+        )
+        for person_id, race, age in [(1, 'aa', 10), (2, 'wh', 20), (3, 'aa', 30), (5, 'wh', 40)]:
+            engine.execute(
+                "insert into demographics values (%s, %s, %s, %s)",
+                (person_id, datetime(2015, 12, 30), race, age)
+            )
+        create_cohort_table(engine, default_cohort())
+        table_generator = ProtectedGroupsGenerator(
+            from_obj="demographics",
+            attribute_columns=['race', 'age'],
+            entity_id_column="person_id",
+            knowledge_date_column="event_date",
+            db_engine=engine,
+            protected_groups_table_name="protected_groups_abcdef",
+        )
+        as_of_dates = [datetime(2016, 1, 1)]
+        table_generator.generate_all_dates(
+            as_of_dates,
+            cohort_table_name='cohort_abcdef',
+            cohort_hash='abcdef'
+        )
+        matrix_store = MagicMock()
+        matrix_store.uuid = "matrix_uuid"
+        matrix_store.as_of_dates = as_of_dates
+        matrix_store.labels = pandas.Series(
+            [0, 1, 0, 1],
+            index=pandas.MultiIndex.from_tuples(
+                [(entity_id, datetime(2016, 1, 1)) for entity_id in [1, 2, 3, 5]],
+                names=["entity_id", "as_of_date"],
+            ),
+        )
+        protected_df = table_generator.as_matrix_dataframe(matrix_store, "abcdef")
+        # only string attributes are stored as categories
+        assert protected_df["race"].dtype.name == "category"
+        assert protected_df["age"].dtype.name != "category"
+        # so numeric attributes are still audited in quartiles
+        assert discretize_attributes(protected_df)["age"].tolist() == [
+            "10.00-17.50", "17.50-25.00", "25.00-32.50", "32.50-40.00"
+        ]
+
+
+def test_protected_groups_generator_noreplace_missing_dates():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        create_demographics_table(engine, default_demographics())
+        create_cohort_table(engine, default_cohort())
+        table_generator = ProtectedGroupsGenerator(
+            from_obj="demographics",
+            attribute_columns=['race', 'sex'],
+            entity_id_column="person_id",
+            knowledge_date_column="event_date",
+            db_engine=engine,
+            protected_groups_table_name="protected_groups_abcdef",
+            replace=False
+        )
+        table_generator.generate_all_dates(
+            [datetime(2016, 1, 1), datetime(2016, 3, 1)],
+            cohort_table_name='cohort_abcdef',
+            cohort_hash='abcdef'
+        )
+        # only the date without protected groups is generated
+        with patch.object(
+            table_generator, "generate", wraps=table_generator.generate
+        ) as generate_mock:
+            table_generator.generate_all_dates(
+                [datetime(2016, 1, 1), datetime(2016, 3, 1), datetime(2016, 4, 1)],
+                cohort_table_name='cohort_abcdef',
+                cohort_hash='abcdef'
+            )
+            generate_mock.assert_called_once_with(
+                as_of_dates=[datetime(2016, 4, 1)],
+                cohort_table_name='cohort_abcdef',
+                cohort_hash='abcdef'
+            )
+        assert_data(table_generator)
@@ -1,9 +1,11 @@
 import datetime
+import gzip
 import os
 import tempfile
 from collections import OrderedDict
 
 import boto3
+import numpy as np
 import pandas as pd
 import pytest
 import yaml
@@ -13,12 +15,17 @@ from pandas.testing import assert_frame_equal
 from unittest import mock
 
 from triage.component.catwalk.storage import (
+    MODEL_CACHE,
+    ModelCache,
+    model_nbytes,
     MatrixStore,
     CSVMatrixStore,
     FSStore,
     S3Store,
     ProjectStorage,
     ModelStorageEngine,
+    FeatureSliceStorageEngine,
+    ProtectedGroupsStorageEngine,
 )
 
 from tests.utils import CallSpy
@@ -44,6 +51,22 @@ def test_S3Store():
         assert not store.exists()
 
 
+def test_S3Store_size():
+    with mock_s3():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket="test_bucket", ACL="public-read-write")
+        store = S3Store(f"s3://test_bucket/a_path")
+        store.write("val".encode("utf-8"))
+        assert store.size() == 3
+
+
+def test_FSStore_size():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = FSStore(tmpdir, "tmpfile")
+        store.write("val".encode("utf-8"))
+        assert store.size() == 3
+
+
 @mock_s3
 def test_S3Store_large():
     client = boto3.client('s3')
@@ -129,6 +152,109 @@ def test_ModelStorageEngine_nocaching(project_storage):
     assert 'myhash' not in mse.cache
 
 
+@pytest.mark.parametrize("serialization", ["compressed", "fast", "mmap"])
+def test_ModelStorageEngine_serialization(project_storage, serialization):
+    mse = ModelStorageEngine(project_storage, serialization=serialization)
+    model = SomeClass(np.arange(10000, dtype="float64"))
+    mse.write(model, 'myhash')
+    loaded = mse.load('myhash')
+    np.testing.assert_array_equal(loaded.val, model.val)
+    # the numpy array is only memory-mapped if it was saved uncompressed
+    assert isinstance(loaded.val, np.memmap) == (serialization == "mmap")
+    assert mse.size('myhash') == os.path.getsize(mse._get_store('myhash').path)
+    # models can be loaded whichever way they were saved
+    np.testing.assert_array_equal(ModelStorageEngine(project_storage).load('myhash').val, model.val)
+
+
+def test_ModelStorageEngine_serialization_sizes(project_storage):
+    model = SomeClass(np.zeros(10000))
+    sizes = {}
+    for serialization in ["compressed", "mmap"]:
+        mse = ModelStorageEngine(project_storage, serialization=serialization)
+        mse.write(model, serialization)
+        sizes[serialization] = mse.size(serialization)
+    assert sizes["compressed"] < sizes["mmap"]
+    assert sizes["mmap"] > model.val.nbytes
+
+
+def test_ModelStorageEngine_unknown_serialization(project_storage):
+    with pytest.raises(ValueError):
+        ModelStorageEngine(project_storage, serialization="pickle")
+
+
+def test_ModelCache():
+    cache = ModelCache()
+    # off by default
+    cache.put('a', 'model a')
+    assert cache.get('a') is None
+    assert cache.stats()["num_models"] == 0
+
+    models = {name: SomeClass(np.zeros(1000)) for name in ['a', 'b', 'c']}
+    nbytes = model_nbytes(models['a'])
+    assert nbytes > models['a'].val.nbytes
+    cache.resize(2 * nbytes)
+    cache.put('a', models['a'])
+    cache.put('b', models['b'])
+    assert cache.get('a') is models['a']
+    # b is now the least recently used, so makes way for c
+    cache.put('c', models['c'])
+    assert cache.get('b') is None
+    assert cache.get('a') is models['a']
+    assert cache.get('c') is models['c']
+    assert cache.stats() == {
+        "hits": 3,
+        "misses": 1,
+        "evictions": 1,
+        "model_hash_hits": 0,
+        "model_hash_misses": 0,
+        "num_models": 2,
+        "size_bytes": 2 * nbytes,
+        "max_bytes": 2 * nbytes,
+    }
+
+    # models bigger than the whole cache are not cached
+    cache.put('big', SomeClass(np.zeros(10000)))
+    assert 'big' not in cache
+    cache.resize(nbytes)
+    assert cache.stats()["num_models"] == 1
+
+    cache.remember_model_hash('postgresql://db', 1, 'a')
+    assert cache.model_hash('postgresql://db', 1) == 'a'
+    assert cache.model_hash('postgresql://other_db', 1) is None
+    cache.forget_model_hash('postgresql://db', 1)
+    assert cache.model_hash('postgresql://db', 1) is None
+
+
+def test_ModelStorageEngine_model_cache(project_storage):
+    mse = ModelStorageEngine(project_storage)
+    mse.write('testobject', 'myhash')
+    MODEL_CACHE.resize(1024 * 1024)
+    try:
+        assert mse.load('myhash') == 'testobject'
+        # any engine on the same storage can load it without going to storage
+        other_mse = ModelStorageEngine(project_storage)
+        with mock.patch.object(other_mse, "_get_store") as get_store_mock:
+            assert other_mse.load('myhash') == 'testobject'
+            assert not get_store_mock.called
+        # but engines on other storage don't see it
+        with tempfile.TemporaryDirectory() as other_project_path:
+            other_project_mse = ModelStorageEngine(ProjectStorage(other_project_path))
+            assert not other_project_mse.exists('myhash')
+            other_project_mse.write('otherobject', 'myhash')
+            assert other_project_mse.load('myhash') == 'otherobject'
+            assert mse.load('myhash') == 'testobject'
+        # a new version replaces the cached one
+        mse.write('newobject', 'myhash')
+        assert mse._cache_key('myhash') not in MODEL_CACHE
+        assert mse.load('myhash') == 'newobject'
+        mse.delete('myhash')
+        assert mse._cache_key('myhash') not in MODEL_CACHE
+        assert not mse.exists('myhash')
+    finally:
+        MODEL_CACHE.resize(0)
+        MODEL_CACHE.clear()
+
+
 def test_ModelStorageEngine_caching(project_storage):
     mse = ModelStorageEngine(project_storage)
     with mse.cache_models():
@@ -141,6 +267,70 @@ def test_ModelStorageEngine_caching(project_storage):
     assert 'myhash' not in mse.cache
 
 
+def test_FeatureSliceStorageEngine(project_storage):
+    slice_df = pd.DataFrame(
+        {"entity_id": [1, 2], "as_of_date": [pd.Timestamp(2017, 1, 1)] * 2, "f1": [0.5, 0.4]}
+    ).set_index(["entity_id", "as_of_date"])
+    engine = project_storage.feature_slice_storage_engine("mynamespace")
+    assert isinstance(engine, FeatureSliceStorageEngine)
+    assert not engine.exists("features0", datetime.datetime(2017, 1, 1))
+    engine.write(slice_df, "features0", datetime.datetime(2017, 1, 1))
+    assert engine.exists("features0", datetime.datetime(2017, 1, 1))
+    assert_frame_equal(engine.load("features0", datetime.datetime(2017, 1, 1)), slice_df)
+    # slices are scoped to their table, date and namespace
+    assert not engine.exists("features1", datetime.datetime(2017, 1, 1))
+    assert not engine.exists("features0", datetime.datetime(2017, 2, 1))
+    assert not project_storage.feature_slice_storage_engine("other").exists(
+        "features0", datetime.datetime(2017, 1, 1)
+    )
+
+    # writes go through a temporary file, so a failed write leaves nothing behind
+    slice_directory = os.path.join(
+        project_storage.project_path, "feature_slices", "mynamespace", "features0"
+    )
+    assert os.listdir(slice_directory) == ["2017-01-01T000000.pkl"]
+    with mock.patch("triage.component.catwalk.storage.joblib.dump", side_effect=IOError):
+        with pytest.raises(IOError):
+            engine.write(slice_df, "features0", datetime.datetime(2017, 2, 1))
+    assert not engine.exists("features0", datetime.datetime(2017, 2, 1))
+    assert os.listdir(slice_directory) == ["2017-01-01T000000.pkl"]
+
+    # deleting the namespace deletes all of its slices
+    engine.delete_all()
+    assert not os.path.exists(
+        os.path.join(project_storage.project_path, "feature_slices", "mynamespace")
+    )
+    assert not engine.exists("features0", datetime.datetime(2017, 1, 1))
+
+
+def test_ProtectedGroupsStorageEngine(project_storage):
+    protected_df = pd.DataFrame(
+        {
+            "entity_id": [1, 2],
+            "as_of_date": [pd.Timestamp(2017, 1, 1)] * 2,
+            "race": pd.Categorical(["aa", "wh"]),
+        }
+    ).set_index(["entity_id", "as_of_date"])
+    engine = project_storage.protected_groups_storage_engine("protected_groups_abcd")
+    assert isinstance(engine, ProtectedGroupsStorageEngine)
+    assert not engine.exists("cohort1", "matrix1")
+    engine.write(protected_df, "cohort1", "matrix1")
+    assert engine.exists("cohort1", "matrix1")
+    assert_frame_equal(engine.load("cohort1", "matrix1"), protected_df)
+    # protected groups are scoped to their matrix, cohort and table
+    assert not engine.exists("cohort1", "matrix2")
+    assert not engine.exists("cohort2", "matrix1")
+    assert not project_storage.protected_groups_storage_engine("other").exists(
+        "cohort1", "matrix1"
+    )
+
+    # deleting a cohort deletes the protected groups of all of its matrices
+    engine.write(protected_df, "cohort2", "matrix1")
+    engine.delete_cohort("cohort1")
+    assert not engine.exists("cohort1", "matrix1")
+    assert engine.exists("cohort2", "matrix1")
+
+
 DATA_DICT = OrderedDict(
     [
         ("entity_id", [1, 2]),
@@ -256,6 +446,51 @@ def test_MatrixStore_save():
         )
 
 
+def test_MatrixStore_save_chunks():
+    df = pd.DataFrame.from_dict({
+        "entity_id": [1, 2, 3],
+        "as_of_date": [pd.Timestamp(2017, 1, 1)] * 3,
+        "feature_one": [0.5, 0.6, 0.7],
+        "label": [1, 0, 1]
+    }).set_index(MatrixStore.indices)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        project_storage = ProjectStorage(tmpdir)
+        whole = CSVMatrixStore(project_storage, [], "whole")
+        whole.metadata = METADATA
+        whole.matrix_label_tuple = df.drop(columns="label"), df["label"]
+        whole.save()
+
+        chunked = CSVMatrixStore(project_storage, [], "chunked")
+        chunked.metadata = METADATA
+        chunked.save_chunks(iter([df.iloc[:2], df.iloc[2:]]))
+        assert chunked.metadata_base_store.exists()
+        with whole.matrix_base_store.open("rb") as whole_fd, \
+                chunked.matrix_base_store.open("rb") as chunked_fd:
+            assert gzip.decompress(chunked_fd.read()) == gzip.decompress(whole_fd.read())
+
+
+def test_MatrixStore_matrix_label_chunks():
+    for matrix_store in matrix_stores():
+        chunks = list(matrix_store.matrix_label_chunks(1))
+        assert len(chunks) == 2
+        assert_frame_equal(
+            pd.concat([design_matrix for design_matrix, _ in chunks]),
+            matrix_store.design_matrix,
+        )
+        assert [label for _, labels in chunks for label in labels] == [0, 1]
+
+
+def test_MatrixStore_matrix_label_chunks_does_not_load_matrix():
+    for matrix_store in matrix_stores():
+        if matrix_store._matrix_label_tuple:
+            continue
+        with mock.patch.object(matrix_store, "_load") as load_mock:
+            for design_matrix, labels in matrix_store.matrix_label_chunks(1):
+                assert len(design_matrix) == len(labels) == 1
+            assert not load_mock.called
+
+
 def test_MatrixStore_caching():
     for matrix_store in matrix_stores():
         with matrix_store.cache():
@@ -6,9 +6,14 @@ from triage.component.catwalk.utils import (
     missing_model_hashes,
     missing_matrix_uuids,
     sort_predictions_and_labels,
+    balanced_batches,
+    matrix_footprints,
+    previous_training_times,
+    retrieve_model_id_from_hash,
+    retrieve_model_hash_from_id,
 )
 from triage.component.results_schema.schema import Matrix, Model
-from triage.component.catwalk.db import ensure_db
+from triage.component.catwalk.db import DB_STATS, ensure_db, track_engine
 from sqlalchemy import create_engine
 import testing.postgresql
 import datetime
@@ -70,6 +75,35 @@ def test_save_experiment_and_get_hash():
         assert new_hash == exp_hash
 
 
+def test_retrieve_model_id_and_hash():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        db_engine.execute(
+            f"insert into {Model.__table__.fullname} (model_hash) values (%s)",
+            "abcd"
+        )
+
+        # only tracked engines are counted
+        DB_STATS.clear()
+        model_id = retrieve_model_id_from_hash(db_engine, "abcd")
+        assert DB_STATS.stats()["queries"] == 0
+
+        track_engine(db_engine)
+        track_engine(db_engine)
+        assert retrieve_model_id_from_hash(db_engine, "abcd") == model_id
+        assert retrieve_model_hash_from_id(db_engine, model_id) == "abcd"
+        assert retrieve_model_id_from_hash(db_engine, "bcde") is None
+        assert retrieve_model_hash_from_id(db_engine, model_id + 1) is None
+
+        # each lookup is one query on a pooled connection
+        stats = DB_STATS.stats()
+        assert stats["queries"] == 4
+        assert stats["connections_checked_out"] == 4
+        assert stats["connections_opened"] <= 1
+        assert stats["query_seconds"] > 0
+
+
 def test_missing_model_hashes():
     with testing.postgresql.Postgresql() as postgresql:
         db_engine = create_engine(postgresql.url())
@@ -112,6 +146,50 @@ def test_missing_matrix_uuids():
         assert missing_matrix_uuids(experiment_hash, db_engine) == matrix_uuids[1:]
 
 
+def test_matrix_footprints():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        db_engine.execute(
+            f"insert into {Matrix.__table__.fullname} "
+            "(matrix_uuid, num_observations, feature_dictionary) values (%s, %s, %s)",
+            'abcd', 10, '{"features.table_one": ["f1", "f2"], "features.table_two": ["f3"]}'
+        )
+        # three features and the label, in 32-bit floats, for ten rows
+        assert matrix_footprints(['abcd', 'bcde'], db_engine) == {'abcd': 160.0}
+
+
+def test_previous_training_times():
+    with testing.postgresql.Postgresql() as postgresql:
+        db_engine = create_engine(postgresql.url())
+        ensure_db(db_engine)
+        db_engine.execute(
+            f"insert into {Matrix.__table__.fullname} "
+            "(matrix_uuid, num_observations, feature_dictionary) values (%s, %s, %s)",
+            'abcd', 10, '{"features.table_one": ["f1", "f2"]}'
+        )
+        for training_time in [1.0, 2.0, 3.0]:
+            db_engine.execute(
+                f"insert into {Model.__table__.fullname} "
+                "(model_type, training_time, train_matrix_uuid) values (%s, %s, %s)",
+                'sklearn.tree.DecisionTreeClassifier', training_time, 'abcd'
+            )
+        db_engine.execute(
+            f"insert into {Model.__table__.fullname} (model_type, training_time) values (%s, %s)",
+            'sklearn.svm.SVC', 5.0
+        )
+        # only the latest models of each class are looked up
+        assert sorted(previous_training_times(
+            ['sklearn.tree.DecisionTreeClassifier', 'sklearn.svm.SVC'],
+            db_engine,
+            history_size=2
+        )) == [
+            ('sklearn.svm.SVC', {}, 5.0, 0, 0),
+            ('sklearn.tree.DecisionTreeClassifier', {}, 2.0, 10, 2),
+            ('sklearn.tree.DecisionTreeClassifier', {}, 3.0, 10, 2),
+        ]
+
+
 def test_sort_predictions_and_labels():
     predictions = numpy.array([0.5, 0.4, 0.6, 0.5])
 
@@ -153,3 +231,21 @@ def test_sort_predictions_and_labels():
     )
     assert_array_equal(sorted_predictions, numpy.array([0.6, 0.5, 0.5, 0.4]))
     assert_array_equal(sorted_labels, numpy.array([1, 0, 1, 0]))
+
+
+def test_balanced_batches():
+    items = ['a', 'b', 'c', 'd', 'e']
+    costs = [10, 1, 2, 3, 3]
+    batches = balanced_batches(items, costs, 2)
+    # the most expensive item is alone in the first batch and the rest share the other,
+    # most expensive first
+    assert batches == [['a'], ['d', 'e', 'c', 'b']]
+
+
+def test_balanced_batches_more_batches_than_items():
+    assert balanced_batches(['a', 'b'], [1, 2], 5) == [['b'], ['a']]
+
+
+def test_balanced_batches_mismatched_costs():
+    with pytest.raises(ValueError):
+        balanced_batches(['a', 'b'], [1], 2)
@@ -2,7 +2,7 @@ from datetime import date
 from itertools import product
 import sqlalchemy
 import testing.postgresql
-from triage.component.collate import FromObj
+from triage.component.collate import FromObj, CohortFilteredFromObj
 from triage.database_reflection import table_exists
 import pytest
 
@@ -145,3 +145,60 @@ def test_materialized_from_obj_maybe_materialize(db_engine_with_events_table):
     from_obj.should_materialize = lambda: True
     from_obj.maybe_materialize(db_engine_with_events_table)
     assert table_exists(from_obj.table, db_engine_with_events_table)
+
+
+def test_cohort_filtered_from_obj_materialize(db_engine_with_events_table):
+    db_engine = db_engine_with_events_table
+    db_engine.execute("create table cohort (entity_id int, as_of_date date)")
+    db_engine.execute(
+        "insert into cohort values (1, '2015-01-01'), (3, '2016-01-01'), (3, '2015-01-01')"
+    )
+    from_obj = CohortFilteredFromObj(
+        from_obj="(select * from events) events",
+        schema="public",
+        knowledge_date_column="event_date",
+        cohort_table="cohort",
+        max_date="2016-01-01",
+        min_date="2014-02-01",
+    )
+    from_obj.maybe_materialize(db_engine)
+    assert from_obj.table.startswith("public.from_obj_")
+    rows = [
+        tuple(row) for row in
+        db_engine.execute(f"select entity_id, event_date from {from_obj.table}")
+    ]
+    assert rows == [
+        (1, date(2014, 11, 10)),
+        (1, date(2015, 1, 1)),
+        (1, date(2015, 11, 10)),
+        (3, date(2014, 3, 3)),
+        (3, date(2014, 7, 24)),
+        (3, date(2015, 3, 3)),
+        (3, date(2015, 7, 24)),
+    ]
+    indexes = [
+        row[0] for row in db_engine.execute(
+            "select indexdef from pg_indexes where tablename = %s",
+            from_obj.table.split(".")[1]
+        )
+    ]
+    assert len(indexes) == 1
+    assert "(entity_id, event_date)" in indexes[0]
+
+    # without replace, an existing table with the same hash is reused
+    db_engine.execute(f"delete from {from_obj.table} where entity_id = 3")
+    from_obj.maybe_materialize(db_engine, replace=False)
+    assert db_engine.execute(f"select count(*) from {from_obj.table}").scalar() == 3
+
+
+def test_cohort_filtered_from_obj_name_depends_on_cohort():
+    kwargs = dict(
+        from_obj="events",
+        schema="features",
+        knowledge_date_column="event_date",
+        max_date="2016-01-01",
+    )
+    first = CohortFilteredFromObj(cohort_table="cohort_a", **kwargs)
+    assert first.table == CohortFilteredFromObj(cohort_table="cohort_a", **kwargs).table
+    assert first.table != CohortFilteredFromObj(cohort_table="cohort_b", **kwargs).table
+
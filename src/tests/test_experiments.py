@@ -15,13 +15,16 @@ from sqlalchemy.orm import sessionmaker
 from tests.utils import sample_config, populate_source_data
 from triage.component.catwalk.storage import CSVMatrixStore
 from triage.component.results_schema.schema import Experiment
+from triage.component.catwalk.utils import missing_model_hashes
 
 from triage.experiments import (
+    ExperimentBase,
     MultiCoreExperiment,
     SingleThreadedExperiment,
     CONFIG_VERSION,
 )
 
+from triage.experiments.multicore import run_train_test_task_and_record_memory
 from triage.experiments.rq import RQExperiment
 
 
@@ -420,6 +423,173 @@ def test_profiling(db_engine):
         assert len(os.listdir(os.path.join(project_path, "profiling_stats"))) == 1
 
 
+def test_extract_feature_supersets(db_engine):
+    populate_source_data(db_engine)
+    config = sample_config()
+    config["feature_group_definition"] = {
+        "prefix": ["entity_features", "zip_code_features"]
+    }
+    config["feature_group_strategies"] = ["all", "leave-one-out"]
+    with TemporaryDirectory() as temp_dir:
+        experiment = SingleThreadedExperiment(
+            config=config,
+            db_engine=db_engine,
+            project_path=os.path.join(temp_dir, "inspections"),
+            extract_feature_supersets=True,
+        )
+        experiment.matrix_builder.load_features_data = mock.Mock(
+            wraps=experiment.matrix_builder.load_features_data
+        )
+        experiment.run()
+        superset_tasks = experiment.planner.superset_build_tasks(
+            experiment.matrix_build_tasks
+        )
+        # three feature groups per split, but only one extraction per set of rows
+        assert len(experiment.matrix_build_tasks) == 3 * len(superset_tasks)
+        assert (
+            experiment.matrix_builder.load_features_data.call_count
+            == len(superset_tasks)
+        )
+        ((num_matrices,),) = db_engine.execute(
+            "select count(*) from model_metadata.matrices"
+        )
+        assert num_matrices == len(experiment.matrix_build_tasks)
+
+
+def test_cache_feature_slices_deleted_with_feature_tables(db_engine):
+    populate_source_data(db_engine)
+    with TemporaryDirectory() as temp_dir:
+        project_path = os.path.join(temp_dir, "inspections")
+
+        def experiment(replace):
+            return SingleThreadedExperiment(
+                config=sample_config(),
+                db_engine=db_engine,
+                project_path=project_path,
+                cache_feature_slices=True,
+                replace=replace,
+            )
+
+        experiment(replace=True).run()
+        slice_path = os.path.join(
+            project_path, "feature_slices", experiment(replace=True).experiment_hash
+        )
+        assert os.listdir(slice_path)
+        marker = os.path.join(slice_path, "marker")
+        open(marker, "w").close()
+
+        # feature tables are reused, so are their slices
+        experiment(replace=False).generate_preimputation_features()
+        assert os.path.exists(marker)
+
+        # feature tables are rebuilt, so slices cut from the old ones are deleted
+        experiment(replace=True).generate_preimputation_features()
+        assert not os.path.exists(slice_path)
+
+
+def test_experiment_without_superset_processing(db_engine):
+    # experiment classes written before supersets existed can still be instantiated,
+    # and build supersets in the experiment's process
+    class OlderExperiment(ExperimentBase):
+        def process_query_tasks(self, query_tasks):
+            pass
+
+        def process_matrix_build_tasks(self, matrix_build_tasks):
+            pass
+
+        def process_train_test_batches(self, batches):
+            pass
+
+        def process_subset_tasks(self, subset_tasks):
+            pass
+
+    with TemporaryDirectory() as temp_dir:
+        experiment = OlderExperiment(
+            config=sample_config(),
+            db_engine=db_engine,
+            project_path=os.path.join(temp_dir, "inspections"),
+        )
+        experiment.matrix_builder.build_all_superset_matrices = mock.Mock()
+        experiment.process_superset_build_tasks({})
+        experiment.matrix_builder.build_all_superset_matrices.assert_called_once_with({})
+
+
+def test_memory_budget(db_engine):
+    populate_source_data(db_engine)
+    with TemporaryDirectory() as temp_dir:
+        experiment = MultiCoreExperiment(
+            config=sample_config(),
+            db_engine=db_engine,
+            project_path=os.path.join(temp_dir, "inspections"),
+            n_processes=2,
+            memory_budget_mb=1024,
+        )
+        experiment.run()
+        ((num_models, num_measured),) = db_engine.execute(
+            """
+            select count(distinct m.model_hash), count(distinct u.model_hash)
+            from model_metadata.models m
+            left join model_metadata.task_memory_usage u using (model_hash)
+            """
+        )
+        # the sample config's models all train in parallelizable batches
+        assert num_models > 0
+        assert num_measured == num_models
+        ((min_peak_rss,),) = db_engine.execute(
+            "select min(peak_rss) from model_metadata.task_memory_usage"
+        )
+        assert min_peak_rss > 0
+
+
+def test_failed_memory_recorded_task_raises():
+    # failures reach the pool, which counts them
+    model_train_tester = mock.Mock()
+    model_train_tester.process_task.side_effect = ValueError
+    with mock.patch("triage.experiments.multicore.record_task_memory") as record_mock:
+        with pytest.raises(ValueError):
+            run_train_test_task_and_record_memory(
+                model_train_tester, {}, matrix_bytes=1, estimated_memory=5
+            )
+        assert not record_mock.called
+
+
+def test_model_group_pruning(db_engine):
+    populate_source_data(db_engine)
+    config = sample_config()
+    # the sample model group keys put every model in one model group
+    del config["model_group_keys"]
+    config["model_group_pruning"] = {
+        "metric": "precision@",
+        "parameter": "2_abs",
+        "keep_fraction": 0.5,
+    }
+    with TemporaryDirectory() as temp_dir:
+        experiment = SingleThreadedExperiment(
+            config=config,
+            db_engine=db_engine,
+            project_path=os.path.join(temp_dir, "inspections"),
+        )
+        experiment.run()
+        # all four model groups are trained on the first split, and half on the second
+        ((num_models,),) = db_engine.execute("select count(*) from model_metadata.models")
+        assert num_models == 6
+        pruned = list(
+            db_engine.execute(
+                "select model_group_id, reason from model_metadata.pruned_model_groups"
+            )
+        )
+        assert len(pruned) == 2
+        ((num_trained_after_pruning,),) = db_engine.execute(
+            """
+            select count(*) from model_metadata.models
+            join model_metadata.pruned_model_groups using (model_group_id)
+            """
+        )
+        assert num_trained_after_pruning == 2
+        # pruned models aren't needed by the experiment, so none are missing
+        assert missing_model_hashes(experiment.experiment_hash, db_engine) == []
+
+
 @parametrize_experiment_classes
 def test_baselines_with_missing_features(experiment_class):
     with testing.postgresql.Postgresql() as postgresql:
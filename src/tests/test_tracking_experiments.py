@@ -6,10 +6,16 @@ from tests.results_tests.factories import ExperimentFactory, ExperimentRunFactor
 from sqlalchemy.orm import Session
 import pytest
 import datetime
+import pickle
 from triage.tracking import (
     initialize_tracking_and_get_run_id,
     get_run_for_update,
-    increment_field
+    increment_field,
+    BufferedIncrements,
+    record_query_runtimes,
+    previous_query_runtimes,
+    record_task_memory,
+    previous_memory_multipliers,
 )
 
 
@@ -138,3 +144,95 @@ def test_increment_field(db_engine_with_results_schema):
     with scoped_session(db_engine_with_results_schema) as session:
         experiment_run_from_db = session.query(ExperimentRun).get(experiment_run.run_id)
         assert experiment_run_from_db.matrices_made == 2
+
+
+def test_buffered_increments(db_engine_with_results_schema):
+    experiment_run = ExperimentRunFactory()
+    factory_session.commit()
+    increments = BufferedIncrements(
+        experiment_run.run_id, db_engine_with_results_schema, max_increments=3, max_seconds=3600
+    )
+
+    def saved_counts():
+        with scoped_session(db_engine_with_results_schema) as session:
+            run = session.query(ExperimentRun).get(experiment_run.run_id)
+            return (run.models_made, run.models_skipped, run.models_errored)
+
+    increments.increment('models_made')
+    increments.increment('models_skipped')
+    assert saved_counts() == (0, 0, 0)
+    # the third increment saves all of them at once
+    increments.increment('models_made')
+    assert saved_counts() == (2, 1, 0)
+
+    # pending increments are saved on flush, but not by pickled copies
+    increments.increment('models_errored')
+    pickle.loads(pickle.dumps(increments)).flush()
+    assert saved_counts() == (2, 1, 0)
+    increments.flush()
+    increments.flush()
+    assert saved_counts() == (2, 1, 1)
+
+
+def test_record_and_retrieve_query_runtimes(db_engine_with_results_schema):
+    experiment_run = ExperimentRunFactory()
+    factory_session.commit()
+    record_query_runtimes(
+        {'hash_one': 1.5, 'hash_two': 20.0},
+        'features.my_table',
+        experiment_run.run_id,
+        db_engine_with_results_schema
+    )
+    # a later observation of the same query should replace the earlier one
+    record_query_runtimes(
+        {'hash_two': 10.0},
+        'features.my_table',
+        experiment_run.run_id,
+        db_engine_with_results_schema
+    )
+    assert previous_query_runtimes(
+        ['hash_one', 'hash_two', 'hash_three'],
+        db_engine_with_results_schema
+    ) == {'hash_one': 1.5, 'hash_two': 10.0}
+
+
+def test_record_task_memory_and_retrieve_multipliers(db_engine_with_results_schema):
+    experiment_run = ExperimentRunFactory()
+    factory_session.commit()
+    for model_hash, class_path, peak_rss in [
+        ('model_one', 'sklearn.tree.DecisionTreeClassifier', 300.0),
+        ('model_two', 'sklearn.tree.DecisionTreeClassifier', 500.0),
+        ('model_three', 'sklearn.ensemble.RandomForestClassifier', 1000.0),
+    ]:
+        record_task_memory(
+            model_hash=model_hash,
+            test_matrix_uuid='test_uuid',
+            class_path=class_path,
+            matrix_bytes=100.0,
+            estimated_memory=500.0,
+            peak_rss=peak_rss,
+            run_id=experiment_run.run_id,
+            db_engine=db_engine_with_results_schema,
+        )
+    # a later observation of the same task should replace the earlier one
+    record_task_memory(
+        model_hash='model_three',
+        test_matrix_uuid='test_uuid',
+        class_path='sklearn.ensemble.RandomForestClassifier',
+        matrix_bytes=100.0,
+        estimated_memory=500.0,
+        peak_rss=800.0,
+        run_id=experiment_run.run_id,
+        db_engine=db_engine_with_results_schema,
+    )
+    assert previous_memory_multipliers(
+        [
+            'sklearn.tree.DecisionTreeClassifier',
+            'sklearn.ensemble.RandomForestClassifier',
+            'sklearn.linear_model.LogisticRegression',
+        ],
+        db_engine_with_results_schema
+    ) == {
+        'sklearn.tree.DecisionTreeClassifier': 4.0,
+        'sklearn.ensemble.RandomForestClassifier': 8.0,
+    }
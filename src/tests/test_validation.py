@@ -1,10 +1,15 @@
 from sqlalchemy import create_engine
+import pytest
 import testing.postgresql
 
 from triage.component.catwalk.db import ensure_db
 
 from tests.utils import sample_config, populate_source_data
-from triage.experiments.validate import ExperimentValidator
+from triage.experiments.validate import (
+    ExperimentValidator,
+    ModelGroupPruningValidator,
+    NegativeDownsamplingValidator,
+)
 
 
 def test_experiment_validator():
@@ -13,3 +18,34 @@ def test_experiment_validator():
         ensure_db(db_engine)
         populate_source_data(db_engine)
         ExperimentValidator(db_engine).run(sample_config())
+
+
+def test_model_group_pruning_validator():
+    scoring_config = sample_config()["scoring"]
+    validator = ModelGroupPruningValidator()
+    validator.run({}, scoring_config)
+    validator.run({"metric": "precision@", "parameter": "5_abs"}, scoring_config)
+    for bad_config in [
+        {"metric": "precision@"},
+        {"metric": "roc_auc", "parameter": ""},
+        {"metric": "precision@", "parameter": "5_abs", "keep_fraction": 1.5},
+        {"metric": "precision@", "parameter": "5_abs", "initial_splits": 0},
+    ]:
+        with pytest.raises(ValueError):
+            validator.run(bad_config, scoring_config)
+
+
+def test_negative_downsampling_validator():
+    validator = NegativeDownsamplingValidator()
+    validator.run({})
+    validator.run({"rate": 0.1})
+    validator.run({"rate": 1, "random_seed": 5})
+    for bad_config in [
+        {"random_seed": 5},
+        {"rate": 0},
+        {"rate": 1.5},
+        {"rate": "0.1"},
+        {"rate": 0.1, "random_seed": 0.5},
+    ]:
+        with pytest.raises(ValueError):
+            validator.run(bad_config)
@@ -15,7 +15,12 @@ from triage.component.architect.entity_date_table_generators import EntityDateTa
 from triage.component.audition import AuditionRunner
 from triage.component.results_schema import upgrade_db, stamp_db, db_history, downgrade_db
 from triage.component.timechop.plotting import visualize_chops
-from triage.component.catwalk.storage import CSVMatrixStore, Store, ProjectStorage
+from triage.component.catwalk.storage import (
+    CSVMatrixStore,
+    MODEL_SERIALIZATIONS,
+    Store,
+    ProjectStorage,
+)
 from triage.experiments import (
     CONFIG_VERSION,
     MultiCoreExperiment,
@@ -181,6 +186,13 @@ class Experiment(Command):
             default=1,
             help="number of cores to use",
         )
+        parser.add_argument(
+            "--memory-budget-mb",
+            type=natural_number,
+            default=None,
+            help="with more than one process, only start train/test tasks while their "
+            "estimated memory usage fits within this many megabytes",
+        )
         parser.add_argument(
             "--matrix-format",
             choices=self.matrix_storage_map.keys(),
@@ -219,6 +231,70 @@ class Experiment(Command):
             help="do not attempt to create tables out of any feature 'from obj' subqueries."
         )
 
+        parser.add_argument(
+            "--prefilter-fromobjs",
+            action="store_true",
+            default=False,
+            dest="prefilter_fromobjs",
+            help="create tables out of all feature 'from objs', restricted to cohort " +
+            "entities and the feature date window and indexed by entity and knowledge date"
+        )
+
+        parser.add_argument(
+            "--extract-feature-supersets",
+            action="store_true",
+            default=False,
+            dest="extract_feature_supersets",
+            help="extract features once for all matrices that share rows and build " +
+            "each feature group's matrix as a projection of that extraction"
+        )
+
+        parser.add_argument(
+            "--cache-feature-slices",
+            action="store_true",
+            default=False,
+            dest="cache_feature_slices",
+            help="cache the rows of each feature table for each as-of-date in project " +
+            "storage and assemble matrices out of these slices"
+        )
+
+        parser.add_argument(
+            "--matrix-stream-chunk-size",
+            type=natural_number,
+            default=None,
+            dest="matrix_stream_chunk_size",
+            help="stream matrices from the database into storage this many rows at a time " +
+            "instead of building them in memory"
+        )
+
+        parser.add_argument(
+            "--out-of-core-chunk-size",
+            type=natural_number,
+            default=None,
+            dest="out_of_core_chunk_size",
+            help="train estimators that implement partial_fit on their train matrix this " +
+            "many rows at a time instead of loading it into memory"
+        )
+
+        parser.add_argument(
+            "--model-serialization",
+            choices=MODEL_SERIALIZATIONS,
+            default="compressed",
+            dest="model_serialization",
+            help="how to save trained models: compressed (smallest), fast (quicker to save " +
+            "and load) or mmap (uncompressed, and memory-mapped when loaded) " +
+            "[default: compressed]"
+        )
+
+        parser.add_argument(
+            "--model-cache-mb",
+            type=natural_number,
+            default=None,
+            dest="model_cache_mb",
+            help="keep up to this many megabytes of loaded models in memory, so models " +
+            "loaded again are not read from storage"
+        )
+
         parser.add_argument(
             "--save-predictions",
             action="store_true",
@@ -270,6 +346,13 @@ class Experiment(Command):
             "config": config,
             "replace": self.args.replace,
             "materialize_subquery_fromobjs": self.args.materialize_fromobjs,
+            "prefilter_fromobjs": self.args.prefilter_fromobjs,
+            "extract_feature_supersets": self.args.extract_feature_supersets,
+            "cache_feature_slices": self.args.cache_feature_slices,
+            "matrix_stream_chunk_size": self.args.matrix_stream_chunk_size,
+            "out_of_core_chunk_size": self.args.out_of_core_chunk_size,
+            "model_serialization": self.args.model_serialization,
+            "model_cache_mb": self.args.model_cache_mb,
             "features_ignore_cohort": self.args.features_ignore_cohort,
             "matrix_storage_class": self.matrix_storage_map[self.args.matrix_format],
             "profile": self.args.profile,
@@ -280,6 +363,7 @@ class Experiment(Command):
             experiment = MultiCoreExperiment(
                 n_db_processes=self.args.n_db_processes,
                 n_processes=self.args.n_processes,
+                memory_budget_mb=self.args.memory_budget_mb,
                 **common_kwargs,
             )
         else:
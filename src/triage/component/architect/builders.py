@@ -3,8 +3,10 @@ import json
 import logging
 import pandas
 
+from collections import OrderedDict
 from sqlalchemy.orm import sessionmaker
 
+from triage.component.catwalk.utils import filename_friendly_hash
 from triage.component.results_schema import Matrix
 from triage.database_reflection import table_has_data
 from triage.tracking import built_matrix, skipped_matrix, errored_matrix
@@ -21,6 +23,11 @@ class BuilderBase(object):
         replace=True,
         include_missing_labels_in_train_as=None,
         run_id=None,
+        check_feature_nulls=True,
+        feature_slice_storage_engine=None,
+        stream_chunk_size=None,
+        negative_sample_rate=None,
+        negative_sample_seed=0,
     ):
         self.db_config = db_config
         self.matrix_storage_engine = matrix_storage_engine
@@ -29,6 +36,11 @@ class BuilderBase(object):
         self.replace = replace
         self.include_missing_labels_in_train_as = include_missing_labels_in_train_as
         self.run_id = run_id
+        self.check_feature_nulls = check_feature_nulls
+        self.feature_slice_storage_engine = feature_slice_storage_engine
+        self.stream_chunk_size = stream_chunk_size
+        self.negative_sample_rate = negative_sample_rate
+        self.negative_sample_seed = negative_sample_seed
 
     @property
     def sessionmaker(self):
@@ -56,6 +68,16 @@ class BuilderBase(object):
             self.build_matrix(**task_arguments)
             logging.debug(f"Matrix {matrix_uuid} built")
 
+    def build_all_superset_matrices(self, superset_build_tasks):
+        logging.info("Building %s feature supersets", len(superset_build_tasks.keys()))
+
+        for i, (superset_key, task_arguments) in enumerate(superset_build_tasks.items()):
+            logging.info(
+                f"Building superset {superset_key} ({i}/{len(superset_build_tasks.keys())})"
+            )
+            self.build_superset_matrices(**task_arguments)
+            logging.debug(f"Superset {superset_key} built")
+
     def _outer_join_query(
         self,
         right_table_name,
@@ -101,6 +123,56 @@ class BuilderBase(object):
         )
         return query
 
+    def entity_date_table_name(
+        self,
+        as_of_times,
+        label_name,
+        label_type,
+        state,
+        matrix_type,
+        label_timespan,
+    ):
+        """ The name of the entity date table for a set of matrix rows.
+
+        Every matrix with the same as-of-times, cohort, state, label and matrix
+        type (e.g. the matrices of different feature groups) has the same rows, so
+        the table is named after a hash of these and shared by all such matrices.
+
+        :param as_of_times: the times to be used for the matrix
+        :param label_name: name of the label to be used
+        :param label_type: the type of label to be used
+        :param state: the entity state to be used in the matrix
+        :param matrix_type: the type (train/test) of matrix
+        :param label_timespan: the time timespan that labels in matrix will include
+        :type as_of_times: list
+        :type label_name: str
+        :type label_type: str
+        :type state: str
+        :type matrix_type: str
+        :type label_timespan: str
+
+        :return: table name
+        :rtype: str
+        """
+        rows = {
+            "as_of_times": [str(as_of_time) for as_of_time in as_of_times],
+            "cohort_table_name": self.db_config["cohort_table_name"],
+            "state": state,
+            "labels_table_name": "{}.{}".format(
+                self.db_config["labels_schema_name"],
+                self.db_config["labels_table_name"],
+            ),
+            "label_name": label_name,
+            "label_type": label_type,
+            "label_timespan": label_timespan,
+            "matrix_type": matrix_type,
+            "include_missing_labels_in_train_as": self.include_missing_labels_in_train_as,
+        }
+        if matrix_type == "train" and self.negative_sample_rate is not None:
+            rows["negative_sample_rate"] = self.negative_sample_rate
+            rows["negative_sample_seed"] = self.negative_sample_seed
+        return "matrix_entity_date_{}".format(filename_friendly_hash(rows))
+
     def make_entity_date_table(
         self,
         as_of_times,
@@ -112,7 +184,7 @@ class BuilderBase(object):
         label_timespan,
     ):
         """ Make a table containing the entity_ids and as_of_dates required for
-        the current matrix.
+        the current matrix, unless a matrix with the same rows already made it.
 
         :param as_of_times: the times to be used for the current matrix
         :param label_name: name of the label to be used
@@ -148,26 +220,67 @@ class BuilderBase(object):
             )
         else:
             raise ValueError("Unknown matrix type passed: {}".format(matrix_type))
+        if matrix_type == "train" and self.negative_sample_rate is not None:
+            indices_query = self._negative_downsampled_query(
+                indices_query, label_name, label_type, label_timespan
+            )
 
-        table_name = "_".join([matrix_uuid, "matrix_entity_date"])
+        table_name = self.entity_date_table_name(
+            as_of_times, label_name, label_type, state, matrix_type, label_timespan
+        )
+        # matrices sharing the table may be built concurrently, so only one of them
+        # creates it while the others wait on the lock and then reuse it
         query = """
-            DROP TABLE IF EXISTS {features_schema_name}."{table_name}";
-            CREATE TABLE {features_schema_name}."{table_name}"
-            AS ({index_query})
+            SELECT pg_advisory_xact_lock(hashtext('{features_schema_name}.{table_name}'));
+            CREATE TABLE IF NOT EXISTS {features_schema_name}."{table_name}"
+            AS ({index_query});
+            CREATE INDEX IF NOT EXISTS "{table_name}_entity_id_as_of_date_idx"
+            ON {features_schema_name}."{table_name}" (entity_id, as_of_date);
+            ANALYZE {features_schema_name}."{table_name}"
         """.format(
             features_schema_name=self.db_config["features_schema_name"],
             table_name=table_name,
             index_query=indices_query,
         )
         logging.debug(
-            "Creating matrix-specific entity-date table for matrix " "%s with query %s",
+            "Creating or reusing entity-date table %s for matrix %s with query %s",
+            table_name,
             matrix_uuid,
             query,
         )
-        self.db_engine.execute(query)
+        with self.db_engine.begin() as conn:
+            conn.execute(query)
 
         return table_name
 
+    def clean_up_entity_date_tables(self, build_tasks):
+        """ Drop the entity date tables made for a set of matrices.
+
+        :param build_tasks: kwargs for build_matrix, one per matrix
+        :type build_tasks: iterable
+
+        :return: none
+        :rtype: none
+        """
+        table_names = set(
+            self.entity_date_table_name(
+                build_task["as_of_times"],
+                build_task["label_name"],
+                build_task["label_type"],
+                build_task["matrix_metadata"]["state"],
+                build_task["matrix_type"],
+                build_task["matrix_metadata"]["label_timespan"],
+            )
+            for build_task in build_tasks
+        )
+        logging.info("Dropping %s entity date tables", len(table_names))
+        for table_name in table_names:
+            self.db_engine.execute(
+                'DROP TABLE IF EXISTS {}."{}"'.format(
+                    self.db_config["features_schema_name"], table_name
+                )
+            )
+
     def _all_labeled_entity_dates_query(
         self, as_of_time_strings, state, label_name, label_type, label_timespan
     ):
@@ -194,6 +307,55 @@ class BuilderBase(object):
         )
         return query
 
+    def _negative_downsampled_query(
+        self, indices_query, label_name, label_type, label_timespan
+    ):
+        """ Keep every positive row of a train matrix, and a sample of the others.
+
+        A row with a negative label is kept if a hash of its entity id, as-of-date
+        and the sampling seed, mapped to [0, 1), falls below the sample rate, so the
+        same rows are kept every time. Rows with missing labels count as having the
+        label they are given in train matrices.
+
+        :param indices_query: a query for all the entity ids and as-of-dates of the matrix
+        :param label_name: name of the label to be used
+        :param label_type: the type of label to be used
+        :param label_timespan: the time timespan that labels in matrix will include
+        :type indices_query: str
+        :type label_name: str
+        :type label_type: str
+        :type label_timespan: str
+
+        :return: a query for the sampled entity ids and as-of-dates
+        :rtype: str
+        """
+        missing_label = self.include_missing_labels_in_train_as
+        return """
+            SELECT all_rows.entity_id, all_rows.as_of_date
+            FROM ({indices_query}) all_rows
+            LEFT JOIN {labels_schema_name}.{labels_table_name} labels
+            ON labels.entity_id = all_rows.entity_id
+            AND labels.as_of_date = all_rows.as_of_date
+            AND labels.label_name = '{l_name}'
+            AND labels.label_type = '{l_type}'
+            AND labels.label_timespan = '{timespan}'
+            WHERE coalesce(labels.label, {missing_label}) <> 0
+            OR ('x' || substr(md5(
+                all_rows.entity_id::text || '_' || all_rows.as_of_date::date::text || '_{seed}'
+            ), 1, 8))::bit(32)::bigint / 4294967296.0 < {rate}
+            ORDER BY all_rows.entity_id, all_rows.as_of_date
+        """.format(
+            indices_query=indices_query,
+            labels_schema_name=self.db_config["labels_schema_name"],
+            labels_table_name=self.db_config["labels_table_name"],
+            l_name=label_name,
+            l_type=label_type,
+            timespan=label_timespan,
+            missing_label=0 if missing_label is None else int(missing_label),
+            seed=int(self.negative_sample_seed),
+            rate=float(self.negative_sample_rate),
+        )
+
     def _all_valid_entity_dates_query(self, state, as_of_time_strings):
         query = """
             SELECT entity_id, as_of_date
@@ -246,23 +408,7 @@ class MatrixBuilder(BuilderBase):
         :rtype: none
         """
         logging.info("popped matrix %s build off the queue", matrix_uuid)
-        if not table_has_data(
-            self.db_config["cohort_table_name"], self.db_engine
-        ):
-            logging.warning("cohort table is not populated, cannot build matrix")
-            if self.run_id:
-                errored_matrix(self.run_id, self.db_engine)
-            return
-        if not table_has_data(
-            "{}.{}".format(
-                self.db_config["labels_schema_name"],
-                self.db_config["labels_table_name"],
-            ),
-            self.db_engine,
-        ):
-            logging.warning("labels table is not populated, cannot build matrix")
-            if self.run_id:
-                errored_matrix(self.run_id, self.db_engine)
+        if not self._source_tables_populated():
             return
 
         matrix_store = self.matrix_storage_engine.get_store(matrix_uuid)
@@ -279,23 +425,39 @@ class MatrixBuilder(BuilderBase):
         )
         # make the entity time table and query the labels and features tables
         logging.info("Making entity date table for matrix %s", matrix_uuid)
-        try:
-            entity_date_table_name = self.make_entity_date_table(
-                as_of_times,
+        entity_date_table_name = self._make_entity_date_table_or_error(
+            as_of_times,
+            label_name,
+            label_type,
+            matrix_metadata,
+            matrix_type,
+            matrix_uuid,
+        )
+        if not entity_date_table_name:
+            return
+        if self.stream_chunk_size and not self.feature_slice_storage_engine:
+            logging.info(
+                "Streaming feature and label data into matrix %s in chunks of %s rows",
+                matrix_uuid,
+                self.stream_chunk_size,
+            )
+            matrix_store.metadata = matrix_metadata
+            num_observations = self.stream_matrix(
+                matrix_store,
                 label_name,
                 label_type,
-                matrix_metadata["state"],
-                matrix_type,
-                matrix_uuid,
+                feature_dictionary,
+                entity_date_table_name,
                 matrix_metadata["label_timespan"],
             )
-        except ValueError as e:
-            logging.warning(
-                "Not able to build entity-date table due to: %s - will not build matrix",
-                exc_info=True,
+            logging.info("Matrix %s saved", matrix_uuid)
+            self._record_matrix(
+                feature_dictionary,
+                matrix_metadata,
+                matrix_uuid,
+                matrix_type,
+                num_observations=num_observations,
             )
-            if self.run_id:
-                errored_matrix(self.run_id, self.db_engine)
             return
         logging.info(
             "Extracting feature group data from database into file " "for matrix %s",
@@ -324,12 +486,199 @@ class MatrixBuilder(BuilderBase):
         output = self.merge_feature_csvs(dataframes, matrix_uuid)
         logging.info(f"Features data merged for matrix {matrix_uuid}")
 
+        self._save_matrix(
+            matrix_store,
+            output,
+            feature_dictionary,
+            matrix_metadata,
+            matrix_uuid,
+            matrix_type,
+        )
+
+    def build_superset_matrices(self, build_tasks):
+        """ Write several design matrices that share the same rows to disk,
+        extracting their features from the database only once.
+
+        The entity-date table and labels are built once for the group, the
+        union of all of the matrices' features is extracted once, and each
+        matrix is saved as a projection of that superset onto its own
+        feature columns.
+
+        :param build_tasks: kwargs for build_matrix, one per matrix, which are
+            expected to only differ in their feature dictionaries (see
+            Planner.superset_build_tasks)
+        :type build_tasks: list
+
+        :return: none
+        :rtype: none
+        """
+        if len(build_tasks) == 1:
+            return self.build_matrix(**build_tasks[0])
+        if not self._source_tables_populated(n_matrices=len(build_tasks)):
+            return
+
+        pending_tasks = []
+        for build_task in build_tasks:
+            matrix_store = self.matrix_storage_engine.get_store(build_task["matrix_uuid"])
+            if not self.replace and matrix_store.exists:
+                logging.info(
+                    "Skipping %s because matrix already exists", build_task["matrix_uuid"]
+                )
+                if self.run_id:
+                    skipped_matrix(self.run_id, self.db_engine)
+            else:
+                pending_tasks.append((build_task, matrix_store))
+        if not pending_tasks:
+            return
+
+        first_task = pending_tasks[0][0]
+        superset_uuid = filename_friendly_hash(
+            [build_task["matrix_uuid"] for build_task, _ in pending_tasks]
+        )
+        superset_dictionary = OrderedDict()
+        for build_task, _ in pending_tasks:
+            for feature_table_name, feature_names in build_task["feature_dictionary"].items():
+                table_features = superset_dictionary.setdefault(feature_table_name, [])
+                table_features.extend(
+                    feature_name for feature_name in feature_names
+                    if feature_name not in table_features
+                )
+        logging.info(
+            "Building %s matrices from feature superset %s with %s features",
+            len(pending_tasks),
+            superset_uuid,
+            sum(len(feature_names) for feature_names in superset_dictionary.values()),
+        )
+
+        entity_date_table_name = self._make_entity_date_table_or_error(
+            first_task["as_of_times"],
+            first_task["label_name"],
+            first_task["label_type"],
+            first_task["matrix_metadata"],
+            first_task["matrix_type"],
+            superset_uuid,
+            n_matrices=len(pending_tasks),
+        )
+        if not entity_date_table_name:
+            return
+        superset_dfs = dict(zip(
+            superset_dictionary.keys(),
+            self.load_features_data(
+                first_task["as_of_times"],
+                superset_dictionary,
+                entity_date_table_name,
+                superset_uuid,
+            )
+        ))
+        labels_df = self.load_labels_data(
+            first_task["label_name"],
+            first_task["label_type"],
+            entity_date_table_name,
+            superset_uuid,
+            first_task["matrix_metadata"]["label_timespan"],
+        )
+        logging.info("Feature superset %s extracted", superset_uuid)
+
+        for build_task, matrix_store in pending_tasks:
+            matrix_uuid = build_task["matrix_uuid"]
+            feature_dictionary = build_task["feature_dictionary"]
+            dataframes = [labels_df] + [
+                superset_dfs[feature_table_name][list(feature_names)]
+                for feature_table_name, feature_names in feature_dictionary.items()
+            ]
+            output = self.merge_feature_csvs(dataframes, matrix_uuid)
+            self._save_matrix(
+                matrix_store,
+                output,
+                feature_dictionary,
+                build_task["matrix_metadata"],
+                matrix_uuid,
+                build_task["matrix_type"],
+            )
+
+    def _source_tables_populated(self, n_matrices=1):
+        if not table_has_data(
+            self.db_config["cohort_table_name"], self.db_engine
+        ):
+            logging.warning("cohort table is not populated, cannot build matrix")
+            self._record_errors(n_matrices)
+            return False
+        if not table_has_data(
+            "{}.{}".format(
+                self.db_config["labels_schema_name"],
+                self.db_config["labels_table_name"],
+            ),
+            self.db_engine,
+        ):
+            logging.warning("labels table is not populated, cannot build matrix")
+            self._record_errors(n_matrices)
+            return False
+        return True
+
+    def _record_errors(self, n_matrices):
+        if self.run_id:
+            for _ in range(n_matrices):
+                errored_matrix(self.run_id, self.db_engine)
+
+    def _make_entity_date_table_or_error(
+        self,
+        as_of_times,
+        label_name,
+        label_type,
+        matrix_metadata,
+        matrix_type,
+        matrix_uuid,
+        n_matrices=1,
+    ):
+        try:
+            return self.make_entity_date_table(
+                as_of_times,
+                label_name,
+                label_type,
+                matrix_metadata["state"],
+                matrix_type,
+                matrix_uuid,
+                matrix_metadata["label_timespan"],
+            )
+        except ValueError as e:
+            logging.warning(
+                "Not able to build entity-date table due to: %s - will not build matrix",
+                exc_info=True,
+            )
+            self._record_errors(n_matrices)
+            return None
+
+    def _save_matrix(
+        self,
+        matrix_store,
+        output,
+        feature_dictionary,
+        matrix_metadata,
+        matrix_uuid,
+        matrix_type,
+    ):
         matrix_store.metadata = matrix_metadata
         # store the matrix
         labels = output.pop(matrix_store.label_column_name)
         matrix_store.matrix_label_tuple = output, labels
         matrix_store.save()
         logging.info("Matrix %s saved", matrix_uuid)
+        self._record_matrix(
+            feature_dictionary,
+            matrix_metadata,
+            matrix_uuid,
+            matrix_type,
+            num_observations=len(output),
+        )
+
+    def _record_matrix(
+        self,
+        feature_dictionary,
+        matrix_metadata,
+        matrix_uuid,
+        matrix_type,
+        num_observations,
+    ):
         # If completely archived, save its information to matrices table
         # At this point, existence of matrix already tested, so no need to delete from db
         if matrix_type == "train":
@@ -342,7 +691,7 @@ class MatrixBuilder(BuilderBase):
             matrix_uuid=matrix_uuid,
             matrix_type=matrix_type,
             labeling_window=matrix_metadata["label_timespan"],
-            num_observations=len(output),
+            num_observations=num_observations,
             lookback_duration=lookback,
             feature_start_time=matrix_metadata["feature_start_time"],
             feature_dictionary=feature_dictionary,
@@ -356,7 +705,6 @@ class MatrixBuilder(BuilderBase):
         if self.run_id:
             built_matrix(self.run_id, self.db_engine)
 
-
     def load_labels_data(
         self,
         label_name,
@@ -382,6 +730,136 @@ class MatrixBuilder(BuilderBase):
         :return: name of csv containing labels
         :rtype: str
         """
+        labels_query = self._labels_query(
+            label_name, label_type, entity_date_table_name, label_timespan
+        )
+
+        return self.query_to_df(labels_query)
+
+    def load_features_data(
+        self, as_of_times, feature_dictionary, entity_date_table_name, matrix_uuid
+    ):
+        """ Loop over tables in features schema, writing the data from each to a
+        csv. Return the full list of feature csv names and the list of all
+        features.
+
+        :param as_of_times: the times to be included in the matrix
+        :param feature_dictionary: a dictionary of feature tables and features
+            to be included in the matrix
+        :param entity_date_table_name: the name of the entity date table
+            for the matrix
+        :param matrix_uuid: a human-readable id for the matrix
+        :type as_of_times: list
+        :type feature_dictionary: dict
+        :type entity_date_table_name: str
+        :type matrix_uuid: str
+
+        :return: list of csvs containing feature data
+        :rtype: tuple
+        """
+        if self.feature_slice_storage_engine:
+            return self._load_features_data_from_slices(
+                as_of_times, feature_dictionary, entity_date_table_name
+            )
+        # iterate! for each table, make query, write csv, save feature & file names
+        feature_dfs = []
+        for feature_table_name, feature_names in feature_dictionary.items():
+            logging.info("Retrieving feature data from %s", feature_table_name)
+            features_query = self._features_query(
+                feature_table_name, feature_names, entity_date_table_name
+            )
+            feature_dfs.append(self.query_to_df(features_query))
+
+        return feature_dfs
+
+    def stream_matrix(
+        self,
+        matrix_store,
+        label_name,
+        label_type,
+        feature_dictionary,
+        entity_date_table_name,
+        label_timespan,
+    ):
+        """ Write a matrix to its store in chunks, without ever holding all of
+        its rows in memory.
+
+        The labels and each feature table are read through their own server-side
+        cursor. Every query returns the rows of the entity date table in the same
+        order, so fetching the same number of rows from each cursor in lockstep
+        yields aligned chunks, which are merged and appended to the store.
+
+        :param matrix_store: the store to write the matrix to, with its metadata set
+        :param label_name: name of the label to be used
+        :param label_type: the type of label to be used
+        :param feature_dictionary: a dictionary of feature tables and features
+            to be included in the matrix
+        :param entity_date_table_name: the name of the entity date table
+        :param label_timespan: the time timespan that labels in matrix will include
+        :type matrix_store: triage.component.catwalk.storage.MatrixStore
+        :type label_name: str
+        :type label_type: str
+        :type feature_dictionary: dict
+        :type entity_date_table_name: str
+        :type label_timespan: str
+
+        :return: the number of rows written
+        :rtype: int
+        """
+        queries = [
+            self._labels_query(label_name, label_type, entity_date_table_name, label_timespan)
+        ] + [
+            self._features_query(feature_table_name, feature_names, entity_date_table_name)
+            for feature_table_name, feature_names in feature_dictionary.items()
+        ]
+        conn = self.db_engine.raw_connection()
+        try:
+            cursors = []
+            for i, query in enumerate(queries):
+                # named cursors are server-side, so rows are only sent as they're fetched
+                cursor = conn.cursor(name="matrix_chunks_{}".format(i))
+                cursor.itersize = self.stream_chunk_size
+                cursor.execute(query)
+                cursors.append(cursor)
+
+            num_rows = 0
+
+            def chunks():
+                nonlocal num_rows
+                while True:
+                    dataframes = [self._fetch_chunk(cursor) for cursor in cursors]
+                    # an empty first chunk still carries the columns of an empty matrix
+                    if len(dataframes[0]) == 0 and num_rows > 0:
+                        break
+                    for df in dataframes[1:]:
+                        if not df.index.equals(dataframes[0].index):
+                            raise ValueError(
+                                "Feature and label chunks for matrix %s are not aligned"
+                                % matrix_store.uuid
+                            )
+                    num_rows += len(dataframes[0])
+                    logging.debug("Streaming rows up to %s into matrix", num_rows)
+                    yield self.merge_feature_csvs(dataframes, matrix_store.uuid)
+                    if len(dataframes[0]) < self.stream_chunk_size:
+                        break
+
+            matrix_store.save_chunks(chunks())
+            return num_rows
+        finally:
+            conn.close()
+
+    def _fetch_chunk(self, cursor):
+        rows = cursor.fetchmany(self.stream_chunk_size)
+        df = pandas.DataFrame.from_records(
+            rows, columns=[column[0] for column in cursor.description]
+        )
+        df["as_of_date"] = pandas.to_datetime(df["as_of_date"])
+        df.set_index(["entity_id", "as_of_date"], inplace=True)
+        return downcast_matrix(df)
+
+    def _labels_query(
+        self, label_name, label_type, entity_date_table_name, label_timespan
+    ):
         if self.include_missing_labels_in_train_as is None:
             label_predicate = "r.label"
         elif self.include_missing_labels_in_train_as is False:
@@ -395,7 +873,7 @@ class MatrixBuilder(BuilderBase):
                 )
             )
 
-        labels_query = self._outer_join_query(
+        return self._outer_join_query(
             right_table_name="{schema}.{table}".format(
                 schema=self.db_config["labels_schema_name"],
                 table=self.db_config["labels_table_name"],
@@ -414,52 +892,94 @@ class MatrixBuilder(BuilderBase):
             ),
         )
 
-        return self.query_to_df(labels_query)
+    def _features_query(self, feature_table_name, feature_names, entity_date_table_name):
+        return self._outer_join_query(
+            right_table_name="{schema}.{table}".format(
+                schema=self.db_config["features_schema_name"],
+                table=feature_table_name,
+            ),
+            entity_date_table_name='{schema}."{table}"'.format(
+                schema=self.db_config["features_schema_name"],
+                table=entity_date_table_name,
+            ),
+            # collate imputation shouldn't leave any nulls and we double-check
+            # the imputed table in FeatureGenerator.create_all_tables() but as
+            # a final check, raise a divide by zero error on export if the
+            # database encounters any during the outer join
+            right_column_selections=[', "{0}"'.format(fn) for fn in feature_names],
+        )
 
-    def load_features_data(
-        self, as_of_times, feature_dictionary, entity_date_table_name, matrix_uuid
+    def _load_features_data_from_slices(
+        self, as_of_times, feature_dictionary, entity_date_table_name
     ):
-        """ Loop over tables in features schema, writing the data from each to a
-        csv. Return the full list of feature csv names and the list of all
-        features.
+        """ Assemble the feature data for a matrix out of per-as-of-date slices
+        of each feature table, extracting and caching any slice that isn't in
+        the feature slice storage yet.
+
+        The rows are those of the entity date table, in the same order as the
+        outer join in load_features_data would return them, so an entity-date
+        missing from a feature table has nulls for its features.
 
         :param as_of_times: the times to be included in the matrix
         :param feature_dictionary: a dictionary of feature tables and features
             to be included in the matrix
         :param entity_date_table_name: the name of the entity date table
             for the matrix
-        :param matrix_uuid: a human-readable id for the matrix
         :type as_of_times: list
         :type feature_dictionary: dict
         :type entity_date_table_name: str
-        :type matrix_uuid: str
 
-        :return: list of csvs containing feature data
-        :rtype: tuple
+        :return: list of dataframes containing feature data
+        :rtype: list
         """
-        # iterate! for each table, make query, write csv, save feature & file names
+        entity_dates = self.query_to_df(
+            """
+            SELECT entity_id, as_of_date
+            FROM {schema}."{table}"
+            ORDER BY entity_id, as_of_date
+            """.format(
+                schema=self.db_config["features_schema_name"],
+                table=entity_date_table_name,
+            )
+        ).index
         feature_dfs = []
         for feature_table_name, feature_names in feature_dictionary.items():
-            logging.info("Retrieving feature data from %s", feature_table_name)
-            features_query = self._outer_join_query(
-                right_table_name="{schema}.{table}".format(
-                    schema=self.db_config["features_schema_name"],
-                    table=feature_table_name,
-                ),
-                entity_date_table_name='{schema}."{table}"'.format(
-                    schema=self.db_config["features_schema_name"],
-                    table=entity_date_table_name,
-                ),
-                # collate imputation shouldn't leave any nulls and we double-check
-                # the imputed table in FeatureGenerator.create_all_tables() but as
-                # a final check, raise a divide by zero error on export if the
-                # database encounters any during the outer join
-                right_column_selections=[', "{0}"'.format(fn) for fn in feature_names],
-            )
-            feature_dfs.append(self.query_to_df(features_query))
-
+            logging.info("Retrieving feature slices from %s", feature_table_name)
+            table_df = pandas.concat([
+                self._feature_slice(feature_table_name, as_of_time)
+                for as_of_time in as_of_times
+            ])
+            feature_dfs.append(table_df.reindex(entity_dates)[list(feature_names)])
         return feature_dfs
 
+    def _feature_slice(self, feature_table_name, as_of_time):
+        storage = self.feature_slice_storage_engine
+        if storage.exists(feature_table_name, as_of_time):
+            try:
+                return storage.load(feature_table_name, as_of_time)
+            except Exception:
+                # another process may be writing the same slice; extract it again
+                logging.warning(
+                    "Could not load feature slice %s/%s, extracting it again",
+                    feature_table_name,
+                    as_of_time,
+                    exc_info=True,
+                )
+        logging.debug("Extracting feature slice %s/%s", feature_table_name, as_of_time)
+        slice_df = self.query_to_df(
+            """
+            SELECT *
+            FROM {schema}.{table}
+            WHERE as_of_date = '{as_of_time}'
+            """.format(
+                schema=self.db_config["features_schema_name"],
+                table=feature_table_name,
+                as_of_time=as_of_time,
+            )
+        )
+        storage.write(slice_df, feature_table_name, as_of_time)
+        return slice_df
+
     def query_to_df(self, query_string, header="HEADER"):
         """ Given a query, write the requested data to csv.
 
@@ -479,9 +999,12 @@ class MatrixBuilder(BuilderBase):
             query=query_string, head=header
         )
         conn = self.db_engine.raw_connection()
-        cur = conn.cursor()
-        out = io.StringIO()
-        cur.copy_expert(copy_sql, out)
+        try:
+            out = io.StringIO()
+            conn.cursor().copy_expert(copy_sql, out)
+        finally:
+            # return the connection to the pool, as a matrix may run many queries
+            conn.close()
         out.seek(0)
         df = pandas.read_csv(out, parse_dates=["as_of_date"])
         df.set_index(["entity_id", "as_of_date"], inplace=True)
@@ -517,8 +1040,10 @@ class MatrixBuilder(BuilderBase):
                     f"index must be entity_id and as_of_date, value was {df.index}"
                 )
             # check for any nulls. the labels, understood to be the first file,
-            # can have nulls but no features should. therefore, skip the first dataframe
-            if i > 0:
+            # can have nulls but no features should. therefore, skip the first dataframe.
+            # the feature tables are imputed in the database, so this check can be
+            # turned off; when on, look for the offending columns only if there are nulls
+            if i > 0 and self.check_feature_nulls and df.isnull().values.any():
                 columns_with_nulls = [
                     column for column in df.columns if df[column].isnull().values.any()
                 ]
@@ -1,7 +1,16 @@
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from triage.component.architect.database_reflection import table_has_data
-from triage.database_reflection import table_row_count, table_exists
+from triage.component.catwalk.utils import filename_friendly_hash
+from triage.database_reflection import (
+    table_row_count,
+    table_exists,
+    table_has_index,
+    split_table,
+)
+from triage.tracking import record_query_runtimes
 
 
 DEFAULT_ACTIVE_STATE = "active"
@@ -22,15 +31,29 @@ class EntityDateTableGenerator(object):
         query (string) SQL query string to select entities for a given as_of_date
             The as_of_date should be parameterized with brackets: {as_of_date}
         replace (boolean) Whether or not to overwrite old rows.
-            If false, each as-of-date will query to see if there are existing rows
-                and not run the query if so.
+            If false, the as-of-dates that already have rows are looked up
+                and the query is not run for them.
             If true, the existing table will be dropped and recreated.
+        n_db_processes (int) The number of as-of-dates to run the query for at once,
+            each on its own database connection
+        run_id (int) The identifier of the experiment run. If given, the runtime
+            of the query for each as-of-date is recorded
     """
-    def __init__(self, query, db_engine, entity_date_table_name, replace=True):
+    def __init__(
+        self,
+        query,
+        db_engine,
+        entity_date_table_name,
+        replace=True,
+        n_db_processes=1,
+        run_id=None,
+    ):
         self.db_engine = db_engine
         self.query = query
         self.entity_date_table_name = entity_date_table_name
         self.replace = replace
+        self.n_db_processes = n_db_processes
+        self.run_id = run_id
 
     def generate_entity_date_table(self, as_of_dates):
         """Convert the object's input table
@@ -46,9 +69,17 @@ class EntityDateTableGenerator(object):
             as_of_dates,
         )
         self._create_and_populate_entity_date_table(as_of_dates)
-        self.db_engine.execute(
-            "create index on {} (entity_id, as_of_date)".format(self.entity_date_table_name)
-        )
+        # left unnamed, as names built from long table names are cut short by postgres
+        # and could clash with the index of another cohort table
+        if not table_has_index(
+            self.entity_date_table_name, ["entity_id", "as_of_date"], self.db_engine
+        ):
+            self.db_engine.execute(
+                "create index on {} (entity_id, as_of_date)".format(
+                    self.entity_date_table_name
+                )
+            )
+        self.db_engine.execute("analyze {}".format(self.entity_date_table_name))
         logging.info(
             "Indices created on entity_id and as_of_date for entity_date table %s",
             self.entity_date_table_name,
@@ -83,35 +114,113 @@ class EntityDateTableGenerator(object):
                 self.entity_date_table_name,
             )
 
+    @property
+    def staging_table_name(self):
+        # named after a hash, as a long entity_date table name with a suffix would be
+        # cut short by postgres, back to the name of the entity_date table itself
+        schema, _ = split_table(self.entity_date_table_name)
+        staging_table = "staging_{}".format(
+            filename_friendly_hash(self.entity_date_table_name)
+        )
+        return f"{schema}.{staging_table}" if schema else staging_table
+
+    def _dates_without_rows(self, as_of_dates):
+        """Find the given as-of-dates that have no rows in the entity_date table
+
+        Args:
+        as_of_dates (list of datetime.date): Dates to look for
+
+        Returns: (list) of the given as-of-dates that have no rows, in the given order
+        """
+        if not as_of_dates:
+            return []
+        existing_indices = set(
+            row[0]
+            for row in self.db_engine.execute(
+                f"""select requested.date_index
+                from unnest(%(as_of_dates)s::timestamp[])
+                    with ordinality as requested(as_of_date, date_index)
+                join (
+                    select distinct as_of_date from {self.entity_date_table_name}
+                ) existing using (as_of_date)
+                """,
+                {"as_of_dates": [as_of_date.isoformat() for as_of_date in as_of_dates]},
+            )
+        )
+        return [
+            as_of_date
+            for date_index, as_of_date in enumerate(as_of_dates, 1)
+            if date_index not in existing_indices
+        ]
+
+    def _insert_date(self, as_of_date):
+        """Run the query for one as-of-date, inserting its rows into the staging table
+
+        Args:
+        as_of_date (datetime.date): Date to calculate entity states as of
+
+        Returns: (tuple) of the hash of the query that was run and its runtime in seconds
+        """
+        formatted_date = f"{as_of_date.isoformat()}"
+        dated_query = self.query.format(as_of_date=formatted_date)
+        full_query = f"""insert into {self.staging_table_name}
+            select q.entity_id, '{formatted_date}'::timestamp, true
+            from ({dated_query}) q
+            group by 1, 2, 3
+        """
+        logging.info("Running entity_date query for date: %s, %s", as_of_date, full_query)
+        start = time.time()
+        self.db_engine.execute(full_query)
+        runtime = time.time() - start
+        logging.info(
+            "Ran entity_date query for date %s in %.2f seconds", as_of_date, runtime
+        )
+        return filename_friendly_hash(full_query), runtime
+
     def _create_and_populate_entity_date_table(self, as_of_dates):
-        """Create an entity_date table by sequentially running a
-            given date-parameterized query for all known dates.
+        """Create an entity_date table by running a given date-parameterized query
+            for all known dates that do not have rows yet.
+
+        The query for each date inserts into an unlogged staging table, using up to
+        n_db_processes connections at once, and the staging table is then loaded into
+        the entity_date table in one statement.
 
         Args:
         as_of_dates (list of datetime.date): Dates to calculate entity states as of
         """
         self._maybe_create_entity_date_table()
-        logging.info("Inserting rows into entity_date table %s", self.entity_date_table_name)
-        for as_of_date in as_of_dates:
-            formatted_date = f"{as_of_date.isoformat()}"
-            logging.info("Looking for existing entity_date rows for as of date %s", as_of_date)
-            any_existing = list(self.db_engine.execute(
-                f"""select 1 from {self.entity_date_table_name}
-                where as_of_date = '{formatted_date}'
-                limit 1
-                """
-            ))
-            if len(any_existing) == 1:
-                logging.info("Since >0 entity_date rows found for date %s, skipping", as_of_date)
-                continue
-            dated_query = self.query.format(as_of_date=formatted_date)
-            full_query = f"""insert into {self.entity_date_table_name}
-                select q.entity_id, '{formatted_date}'::timestamp, true
-                from ({dated_query}) q
-                group by 1, 2, 3
+        logging.info("Looking for existing entity_date rows in %s", self.entity_date_table_name)
+        dates_to_insert = self._dates_without_rows(as_of_dates)
+        logging.info(
+            "%s of %s as of dates have no entity_date rows, running query for them",
+            len(dates_to_insert),
+            len(as_of_dates),
+        )
+        if not dates_to_insert:
+            return
+        self.db_engine.execute(f"drop table if exists {self.staging_table_name}")
+        self.db_engine.execute(
+            f"create unlogged table {self.staging_table_name} "
+            f"(like {self.entity_date_table_name})"
+        )
+        logging.info(
+            "Inserting rows into staging table %s with %s processes",
+            self.staging_table_name,
+            self.n_db_processes,
+        )
+        with ThreadPoolExecutor(max_workers=self.n_db_processes) as executor:
+            runtimes = dict(executor.map(self._insert_date, dates_to_insert))
+        if self.run_id:
+            record_query_runtimes(
+                runtimes, self.entity_date_table_name, self.run_id, self.db_engine
+            )
+        self.db_engine.execute(
+            f"""insert into {self.entity_date_table_name}
+            select * from {self.staging_table_name}
+            order by entity_id, as_of_date
             """
-            logging.info("Running entity_date query for date: %s, %s", as_of_date, full_query)
-            self.db_engine.execute(full_query)
+        )
+        self.db_engine.execute(f"drop table {self.staging_table_name}")
 
     def _empty_table_message(self, as_of_dates):
         return """Query does not return any rows for the given as_of_dates:
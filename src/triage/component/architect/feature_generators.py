@@ -1,4 +1,6 @@
 import logging
+import math
+import time
 from collections import OrderedDict
 
 import sqlalchemy
@@ -6,13 +8,16 @@ import sqlparse
 
 from triage.util.conf import convert_str_to_relativedelta
 from triage.database_reflection import table_exists
+from triage.tracking import record_query_runtimes, previous_query_runtimes
+from triage.component.catwalk.utils import balanced_batches, filename_friendly_hash
 
 from triage.component.collate import (
     Aggregate,
     Categorical,
     Compare,
     SpacetimeAggregation,
-    FromObj
+    FromObj,
+    CohortFilteredFromObj,
 )
 
 
@@ -25,6 +30,8 @@ class FeatureGenerator(object):
         feature_start_time=None,
         materialize_subquery_fromobjs=True,
         features_ignore_cohort=False,
+        run_id=None,
+        prefilter_fromobjs=False,
     ):
         """Generates aggregate features using collate
 
@@ -39,6 +46,14 @@ class FeatureGenerator(object):
             features_ignore_cohort (boolean, optional) Whether or not features should be built
                 independently of the cohort. Takes longer but means that features can be reused
                 for different cohorts.
+            run_id (int, optional) The identifier of the experiment run. If given,
+                the runtime of each insert query is recorded, and runtimes recorded
+                by previous runs are used to balance insert batches
+            prefilter_fromobjs (boolean, optional) Whether or not to materialize every
+                from_obj as a table restricted to cohort entities and the feature date
+                window, indexed on (entity_id, knowledge date). Tables are shared between
+                aggregations with the same from_obj, and reused across runs if replace
+                is False. Has no effect if features ignore the cohort.
         """
         self.db_engine = db_engine
         self.features_schema_name = features_schema_name
@@ -49,6 +64,8 @@ class FeatureGenerator(object):
         self.features_ignore_cohort = features_ignore_cohort
         self.entity_id_column = "entity_id"
         self.from_objs = {}
+        self.run_id = run_id
+        self.prefilter_fromobjs = prefilter_fromobjs
 
     def _validate_keys(self, aggregation_config):
         for key in [
@@ -348,7 +365,20 @@ class FeatureGenerator(object):
             with self.db_engine.begin() as conn:
                 conn.execute(create_schema)
 
-        if self.materialize_subquery_fromobjs:
+        if self.prefilter_fromobjs and not self.features_ignore_cohort:
+            from_obj = CohortFilteredFromObj(
+                from_obj=aggregation.from_obj.text,
+                schema=aggregation.schema,
+                knowledge_date_column=aggregation.date_column,
+                cohort_table=aggregation.state_table,
+                max_date=max(aggregation.dates),
+                min_date=aggregation.input_min_date,
+            )
+            if from_obj.materialized_table not in self.from_objs:
+                from_obj.maybe_materialize(self.db_engine, replace=self.replace)
+                self.from_objs[from_obj.materialized_table] = from_obj
+            aggregation.from_obj = from_obj.table
+        elif self.materialize_subquery_fromobjs:
             # materialize from obj
             from_obj = FromObj(
                 from_obj=aggregation.from_obj.text,
@@ -482,33 +512,22 @@ class FeatureGenerator(object):
         table_tasks_impute = self.generate_all_table_tasks(aggs, task_type="imputation")
         impute_keys = self.process_table_tasks(table_tasks_impute)
 
-        # double-check that the imputation worked and no nulls remain
-        # in the data:
-        nullcols = []
-        with self.db_engine.begin() as conn:
-            for agg in aggs:
-                results = conn.execute(agg.find_nulls(imputed=True))
-                null_counts = results.first().items()
-                nullcols += [col for (col, val) in null_counts if val > 0]
-
-        if len(nullcols) > 0:
-            raise ValueError(
-                "Imputation failed for {} columns. Null values remain in: {}".format(
-                    len(nullcols), nullcols
-                )
-            )
+        # no need to scan the imputed tables for remaining nulls: every column
+        # either had no nulls before imputation, or is filled by its imputation rule
+        # (collate refuses to build the imputation query if any column is unaccounted
+        # for, and every imputation coalesces to a non-null value or raises an error)
 
         return impute_keys
 
-    def process_table_task(self, task):
+    def process_table_task(self, task, table_name=None):
         self.run_commands(task.get("prepare", []))
-        self.run_commands(task.get("inserts", []))
+        self.run_insert_batch(task.get("inserts", []), table_name=table_name)
         self.run_commands(task.get("finalize", []))
 
     def process_table_tasks(self, table_tasks):
         for table_name, task in table_tasks.items():
             logging.info("Running feature table queries for %s", table_name)
-            self.process_table_task(task)
+            self.process_table_task(task, table_name=table_name)
         return table_tasks.keys()
 
     def _explain_selects(self, aggregations):
@@ -521,6 +540,108 @@ class FeatureGenerator(object):
                         logging.debug(str(select))
                         logging.debug(results)
 
+    def _query_hash(self, query):
+        return filename_friendly_hash(str(query))
+
+    def _explain_costs(self, queries):
+        """Ask the query planner for the estimated total cost of each query
+
+        Args:
+            queries (list) SQL statements or collate objects that compile to SQL
+
+        Returns: (list) of floats, in the same order as the given queries
+        """
+        costs = []
+        with self.db_engine.begin() as conn:
+            for query in queries:
+                (plan,) = conn.execute("explain (format json) " + str(query)).first()
+                costs.append(float(plan[0]["Plan"]["Total Cost"]))
+        return costs
+
+    def insert_costs(self, inserts):
+        """Estimate the relative cost of each insert query
+
+        If every query has been timed by a previous run, the observed runtimes
+        are used. Otherwise, the planner's cost estimates are used for all queries,
+        so that the costs are in the same units. If neither is available,
+        all queries are assumed to be equally expensive.
+
+        Args:
+            inserts (list) insert queries, whose target tables must already exist
+
+        Returns: (list) of costs, in the same order as the given queries
+        """
+        if self.run_id:
+            query_hashes = [self._query_hash(insert) for insert in inserts]
+            runtimes = previous_query_runtimes(query_hashes, self.db_engine)
+            if all(query_hash in runtimes for query_hash in query_hashes):
+                logging.info("Using runtimes from previous runs as insert costs")
+                return [runtimes[query_hash] for query_hash in query_hashes]
+        try:
+            return self._explain_costs(inserts)
+        except Exception:
+            logging.warning(
+                "Unable to estimate insert costs with the query planner, "
+                "assuming all inserts are equally expensive",
+                exc_info=True
+            )
+            return [1] * len(inserts)
+
+    def batch_inserts(self, inserts, n_processes=1, batch_size=25):
+        """Split insert queries into batches of roughly equal estimated cost
+
+        The number of batches is what splitting the queries into batches of
+        batch_size would produce, but no less than the number of processes.
+
+        Args:
+            inserts (list) insert queries, whose target tables must already exist
+            n_processes (int) The number of processes that will run the batches
+            batch_size (int) The average number of queries in each batch
+
+        Returns: (list) of lists of insert queries, most expensive batch first
+        """
+        if not inserts:
+            return []
+        n_batches = max(n_processes, math.ceil(len(inserts) / batch_size))
+        costs = self.insert_costs(inserts)
+        batches = balanced_batches(inserts, costs, n_batches)
+        logging.info(
+            "Split %s inserts into %s batches by estimated cost",
+            len(inserts),
+            len(batches),
+        )
+        return batches
+
+    def run_insert_batch(self, insert_statements, table_name=None):
+        """Run a batch of insert queries, timing each of them
+
+        The runtimes are logged, and recorded for use by later runs if
+        this generator has a run_id.
+
+        Args:
+            insert_statements (list) insert queries
+            table_name (string, optional) The name of the table being populated
+        """
+        if not insert_statements:
+            return
+        runtimes = {}
+        batch_start = time.time()
+        with self.db_engine.begin() as conn:
+            for insert_statement in insert_statements:
+                logging.debug("Executing feature generation query: %s", insert_statement)
+                query_start = time.time()
+                conn.execute(insert_statement)
+                runtimes[self._query_hash(insert_statement)] = time.time() - query_start
+        logging.info(
+            "Ran batch of %s inserts into %s in %.2f seconds (slowest insert: %.2f seconds)",
+            len(insert_statements),
+            table_name,
+            time.time() - batch_start,
+            max(runtimes.values()),
+        )
+        if self.run_id:
+            record_query_runtimes(runtimes, table_name, self.run_id, self.db_engine)
+
     def _clean_table_name(self, table_name):
         # remove the schema and quotes from the name
         return table_name.split(".")[1].replace('"', "")
@@ -628,7 +749,11 @@ class FeatureGenerator(object):
             table_tasks[self._clean_table_name(aggregation.get_table_name())] = {
                 "prepare": [aggregation.get_drop(), aggregation.get_create()],
                 "inserts": [],
-                "finalize": [self._aggregation_index_query(aggregation)],
+                "finalize": [
+                    self._aggregation_index_query(aggregation),
+                    aggregation.get_null_counts_drop(),
+                    aggregation.get_null_counts_create(),
+                ],
             }
         else:
             table_tasks[self._clean_table_name(aggregation.get_table_name())] = {}
@@ -680,11 +805,15 @@ class FeatureGenerator(object):
             table_tasks[imp_tbl_name] = {}
             return table_tasks
 
-        # excute query to find columns with null values and create lists of columns
-        # that do and do not need imputation when creating the imputation table
+        # read the null counts gathered when the aggregation table was finalized
+        # and create lists of columns that do and do not need imputation when
+        # creating the imputation table
         with self.db_engine.begin() as conn:
-            results = conn.execute(aggregation.find_nulls())
-            null_counts = results.first().items()
+            null_counts = conn.execute(
+                "select column_name, null_count from {}".format(
+                    aggregation.get_null_counts_table_name()
+                )
+            ).fetchall()
         impute_cols = [col for (col, val) in null_counts if val > 0]
         nonimpute_cols = [col for (col, val) in null_counts if val == 0]
 
@@ -1,6 +1,7 @@
 import logging
 import textwrap
-from triage.database_reflection import table_exists
+from triage.database_reflection import table_exists, table_has_index
+from triage.component.catwalk.utils import Batch
 
 
 DEFAULT_LABEL_NAME = "outcome"
@@ -22,13 +23,25 @@ class LabelGeneratorNoOp(object):
 
 
 class LabelGenerator(object):
-    def __init__(self, db_engine, query, label_name=None, replace=True):
+    def __init__(self, db_engine, query, label_name=None, replace=True, batch_size=50):
+        """Generates labels using a query
+
+        Args:
+            db_engine (sqlalchemy.engine)
+            query (string) A query that selects an entity_id and an outcome for
+                a given as-of-date and label timespan
+            label_name (string, optional) The name to give the labels
+            replace (boolean, optional) Whether or not existing labels should be replaced
+            batch_size (int, optional) The number of (as-of-date, label timespan) pairs
+                to label in each insert statement
+        """
         self.db_engine = db_engine
         self.replace = replace
         # query is expected to select a number of entity ids
         # and an outcome for each given an as-of-date
         self.query = query
         self.label_name = label_name or DEFAULT_LABEL_NAME
+        self.batch_size = batch_size
 
     def _create_labels_table(self, labels_table_name):
         if self.replace or not table_exists(labels_table_name, self.db_engine):
@@ -50,6 +63,53 @@ class LabelGenerator(object):
             logging.info("Not dropping and recreating table because "
                          "replace flag was set to False and table was found to exist")
 
+    def _index_labels_table(self, labels_table_name):
+        # left unnamed, as names built from long table names are cut short by postgres
+        # and could clash with the index of another labels table
+        if not table_has_index(
+            labels_table_name, ["entity_id", "as_of_date"], self.db_engine
+        ):
+            self.db_engine.execute(
+                "create index on {} (entity_id, as_of_date)".format(labels_table_name)
+            )
+        self.db_engine.execute("analyze {}".format(labels_table_name))
+
+    def existing_label_pairs(self, labels_table, as_of_dates, label_timespans):
+        """Find the (as-of-date, label timespan) pairs that already have labels
+
+        Args:
+            labels_table (string) The name of the labels table
+            as_of_dates (list) The as-of-dates to look for
+            label_timespans (list) The label timespans to look for
+
+        Returns: (set) of (as_of_date, label_timespan) pairs from the given lists
+            that have at least one label
+        """
+        pairs = [
+            (as_of_date, label_timespan)
+            for as_of_date in as_of_dates
+            for label_timespan in label_timespans
+        ]
+        if not pairs:
+            return set()
+        existing_indices = self.db_engine.execute(
+            """select requested.pair_index
+            from unnest(%(as_of_dates)s::date[], %(label_timespans)s::interval[])
+                with ordinality as requested(as_of_date, label_timespan, pair_index)
+            join (
+                select distinct as_of_date, label_timespan
+                from {labels_table}
+                where label_name = %(label_name)s
+            ) existing using (as_of_date, label_timespan)
+            """.format(labels_table=labels_table),
+            {
+                "as_of_dates": [str(as_of_date) for as_of_date, _ in pairs],
+                "label_timespans": [label_timespan for _, label_timespan in pairs],
+                "label_name": self.label_name,
+            },
+        )
+        return set(pairs[row[0] - 1] for row in existing_indices)
+
     def generate_all_labels(self, labels_table, as_of_dates, label_timespans):
         self._create_labels_table(labels_table)
         logging.info(
@@ -57,41 +117,31 @@ class LabelGenerator(object):
             len(as_of_dates),
             len(label_timespans),
         )
-        for as_of_date in as_of_dates:
-            for label_timespan in label_timespans:
-                if not self.replace:
-                    logging.info(
-                        "Looking for existing labels for as of date %s and label timespan %s",
-                        as_of_date,
-                        label_timespan,
-                    )
-                    any_existing_labels = list(self.db_engine.execute(
-                        """select 1 from {labels_table}
-                        where as_of_date = '{as_of_date}'
-                        and label_timespan = '{label_timespan}'::interval
-                        and label_name = '{label_name}'
-                        limit 1
-                        """.format(
-                            labels_table=labels_table,
-                            as_of_date=as_of_date,
-                            label_timespan=label_timespan,
-                            label_name=self.label_name
-                        )
-                    ))
-                    if len(any_existing_labels) == 1:
-                        logging.info("Since nonzero existing labels found, skipping")
-                        continue
-
-                logging.info(
-                    "Generating labels for as of date %s and label timespan %s",
-                    as_of_date,
-                    label_timespan,
-                )
-                self.generate(
-                    start_date=as_of_date,
-                    label_timespan=label_timespan,
-                    labels_table=labels_table,
-                )
+        existing_pairs = set()
+        if not self.replace:
+            logging.info("Looking for existing labels")
+            existing_pairs = self.existing_label_pairs(
+                labels_table, as_of_dates, label_timespans
+            )
+            logging.info(
+                "Found existing labels for %s as of date/label timespan pairs, skipping them",
+                len(existing_pairs),
+            )
+        pairs = [
+            (as_of_date, label_timespan)
+            for as_of_date in as_of_dates
+            for label_timespan in label_timespans
+            if (as_of_date, label_timespan) not in existing_pairs
+        ]
+        for batch_num, batch in enumerate(Batch(pairs, self.batch_size), 1):
+            batch = list(batch)
+            logging.info(
+                "Generating labels for batch %s of %s as of date/label timespan pairs",
+                batch_num,
+                len(batch),
+            )
+            self._insert_labels(labels_table, batch)
+        self._index_labels_table(labels_table)
         nrows = [
             row[0]
             for row in self.db_engine.execute(
@@ -103,18 +153,7 @@ class LabelGenerator(object):
         else:
             logging.info("Done creating labels table %s: rows: %s", labels_table, nrows)
 
-    def generate(self, start_date, label_timespan, labels_table):
-        """Generate labels table using a query
-
-        Parameters
-        ----------
-        start_date: str
-            as of date
-        label_timespan: str
-            postgresql readable time interval
-        labels_table: str
-            name of labels table
-        """
+    def _labels_select(self, start_date, label_timespan):
         # we want to apply the as-of-date and label in the database driver,
         # so replace the user {as_of_date} with the SQL %(as_of_date)
 
@@ -122,12 +161,11 @@ class LabelGenerator(object):
             as_of_date=start_date, label_timespan=label_timespan
         )
 
-        full_insert_query = textwrap.dedent(
+        return textwrap.dedent(
             """
-            insert into {labels_table}
             select
                 entities_and_outcomes.entity_id,
-                '{as_of_date}' as as_of_date,
+                '{as_of_date}'::date as as_of_date,
                 '{label_timespan}'::interval as label_timespan,
                 '{label_name}' as label_name,
                 'binary' as label_type,
@@ -136,15 +174,36 @@ class LabelGenerator(object):
         """
         ).format(
             user_query=query_with_db_variables,
-            labels_table=labels_table,
             as_of_date=start_date,
             label_timespan=label_timespan,
             label_name=self.label_name,
         )
 
+    def _insert_labels(self, labels_table, pairs):
+        full_insert_query = "insert into {labels_table} {selects}".format(
+            labels_table=labels_table,
+            selects="union all".join(
+                self._labels_select(start_date, label_timespan)
+                for start_date, label_timespan in pairs
+            ),
+        )
         logging.debug("Running label creation query")
         logging.debug(full_insert_query)
         self.db_engine.execute(full_insert_query)
 
+    def generate(self, start_date, label_timespan, labels_table):
+        """Generate labels table using a query
+
+        Parameters
+        ----------
+        start_date: str
+            as of date
+        label_timespan: str
+            postgresql readable time interval
+        labels_table: str
+            name of labels table
+        """
+        self._insert_labels(labels_table, [(start_date, label_timespan)])
+
     def clean_up(self, labels_table_name):
         self.db_engine.execute("drop table if exists {}".format(labels_table_name))
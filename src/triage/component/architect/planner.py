@@ -14,6 +14,8 @@ class Planner(object):
         label_types,
         cohort_names,
         user_metadata,
+        negative_sample_rate=None,
+        negative_sample_seed=0,
     ):
         self.feature_start_time = (
             feature_start_time
@@ -22,6 +24,8 @@ class Planner(object):
         self.label_types = label_types
         self.cohort_names = cohort_names
         self.user_metadata = user_metadata
+        self.negative_sample_rate = negative_sample_rate
+        self.negative_sample_seed = negative_sample_seed
 
     def _generate_build_task(
         self, matrix_metadata, matrix_uuid, train_matrix, feature_dictionary
@@ -97,6 +101,10 @@ class Planner(object):
             "matrix_id": matrix_id,
             "matrix_type": matrix_type,
         }
+        if matrix_type == "train" and self.negative_sample_rate is not None:
+            # the rows of train matrices depend on the sampling, so it is part of their uuid
+            matrix_metadata["negative_sample_rate"] = self.negative_sample_rate
+            matrix_metadata["negative_sample_seed"] = self.negative_sample_seed
         matrix_metadata.update(matrix_definition)
         matrix_metadata.update(self.user_metadata)
 
@@ -205,3 +213,41 @@ class Planner(object):
         )
         logging.info("Associated all tasks with experiment in database")
         return updated_definitions, build_tasks
+
+    def superset_build_tasks(self, build_tasks):
+        """Group build tasks whose matrices have the same rows
+
+        Matrices that share as-of-times, label, cohort, state and matrix type
+        differ only in their feature columns (e.g. the matrices produced by
+        feature group strategies like leave-one-out), so their features can be
+        extracted once and each matrix built as a projection of that extraction.
+
+        :param build_tasks: build tasks as returned by generate_plans
+        :type build_tasks: dict
+
+        :return: kwargs for MatrixBuilder.build_superset_matrices, keyed on a
+            hash of the metadata the grouped matrices share
+        :rtype: dict
+        """
+        superset_tasks = dict()
+        for build_task in build_tasks.values():
+            matrix_metadata = build_task["matrix_metadata"]
+            superset_key = filename_friendly_hash({
+                "as_of_times": build_task["as_of_times"],
+                "label_name": build_task["label_name"],
+                "label_type": build_task["label_type"],
+                "matrix_type": build_task["matrix_type"],
+                "label_timespan": matrix_metadata["label_timespan"],
+                "state": matrix_metadata["state"],
+                "cohort_name": matrix_metadata.get("cohort_name"),
+                "negative_sample_rate": matrix_metadata.get("negative_sample_rate"),
+                "negative_sample_seed": matrix_metadata.get("negative_sample_seed"),
+            })
+            superset_tasks.setdefault(superset_key, {"build_tasks": []})
+            superset_tasks[superset_key]["build_tasks"].append(build_task)
+        logging.info(
+            "Grouped %s build tasks into %s feature superset extractions",
+            len(build_tasks),
+            len(superset_tasks),
+        )
+        return superset_tasks
@@ -0,0 +1,214 @@
+import logging
+import math
+
+import pandas as pd
+
+from triage.component.results_schema import PrunedModelGroup
+from triage.util.db import scoped_session
+
+from .metric_directionality import greater_is_better
+
+
+class ModelGroupPruner(object):
+    def __init__(
+        self,
+        db_engine,
+        metric,
+        parameter,
+        keep_fraction=0.5,
+        min_model_groups=1,
+    ):
+        """Rank model groups on the splits they have been tested on so far, and
+        pick which of them are worth training on later splits
+
+        Model groups are ranked by their average distance from the best model group
+        at each train end time, using the first test evaluation of each model,
+        like the distance-from-best table in Audition.
+
+        Args:
+            db_engine (sqlalchemy.engine)
+            metric (string) The metric to rank model groups by, e.g. 'precision@'
+            parameter (string) The metric parameter, e.g. '100_abs'
+            keep_fraction (float) The fraction of the ranked model groups to keep
+                each time model groups are pruned
+            min_model_groups (int) The fewest model groups to keep
+        """
+        if not 0 < keep_fraction <= 1:
+            raise ValueError("keep_fraction must be greater than 0 and at most 1")
+        if min_model_groups < 1:
+            raise ValueError("min_model_groups must be 1 or greater")
+        self.db_engine = db_engine
+        self.metric = metric
+        self.parameter = parameter
+        self.keep_fraction = keep_fraction
+        self.min_model_groups = min_model_groups
+
+    def _evaluations(self, model_hashes):
+        """Fetch the first test evaluation of each model for the metric and parameter
+
+        Args:
+            model_hashes (iterable) The hashes of the models to look up
+
+        Returns: (pandas.DataFrame) with columns model_group_id, train_end_time and raw_value
+        """
+        return pd.read_sql(
+            """
+            WITH first_evals AS (
+                SELECT
+                    m.model_group_id,
+                    m.train_end_time,
+                    ev.stochastic_value AS raw_value,
+                    row_number() OVER (
+                        PARTITION BY ev.model_id
+                        ORDER BY ev.evaluation_start_time ASC, ev.evaluation_end_time ASC
+                    ) AS eval_rn
+                FROM model_metadata.models m
+                JOIN test_results.evaluations ev USING (model_id)
+                WHERE m.model_hash = ANY(%(model_hashes)s)
+                AND ev.metric = %(metric)s
+                AND ev.parameter = %(parameter)s
+                AND ev.subset_hash = ''
+            )
+            SELECT model_group_id, train_end_time, raw_value::float
+            FROM first_evals
+            WHERE eval_rn = 1
+            """,
+            self.db_engine,
+            params={
+                "model_hashes": list(model_hashes),
+                "metric": self.metric,
+                "parameter": self.parameter,
+            },
+        )
+
+    def rank(self, model_hashes):
+        """Rank the model groups of the given models by average distance from the best
+
+        Args:
+            model_hashes (iterable) The hashes of the models to rank by
+
+        Returns: (pandas.DataFrame) indexed by model group id, best first, with columns
+            mean_dist_from_best and rank (starting at 1)
+        """
+        evaluations = self._evaluations(model_hashes)
+        if evaluations.empty:
+            return pd.DataFrame(
+                {"mean_dist_from_best": [], "rank": []},
+                index=pd.Index([], name="model_group_id"),
+            )
+        # a model group may have several models for a train end time, e.g. one per test matrix
+        values = (
+            evaluations.groupby(["model_group_id", "train_end_time"])["raw_value"]
+            .mean()
+            .reset_index()
+        )
+        best = values.groupby("train_end_time")["raw_value"].transform(
+            "max" if greater_is_better(self.metric) else "min"
+        )
+        values["dist_from_best"] = (best - values["raw_value"]).abs()
+        ranked = (
+            values.groupby("model_group_id")["dist_from_best"]
+            .mean()
+            .rename("mean_dist_from_best")
+            .reset_index()
+            .sort_values(["mean_dist_from_best", "model_group_id"])
+            .set_index("model_group_id")
+        )
+        ranked["rank"] = range(1, len(ranked) + 1)
+        return ranked
+
+    def prune(
+        self,
+        model_group_ids,
+        model_hashes,
+        experiment_hash,
+        run_id=None,
+        protected_model_group_ids=(),
+    ):
+        """Pick the model groups to keep training, and record the others as pruned
+
+        Model groups that have no evaluations for the metric, e.g. because their models
+        failed to train, are pruned as well.
+
+        Args:
+            model_group_ids (iterable) The model groups still being trained
+            model_hashes (iterable) The hashes of every model trained for these model
+                groups so far
+            experiment_hash (string) The experiment doing the pruning
+            run_id (int, optional) The experiment run doing the pruning
+            protected_model_group_ids (iterable) Model groups to keep regardless of rank,
+                e.g. baselines
+
+        Returns: (set) the model group ids to keep
+        """
+        model_group_ids = set(model_group_ids)
+        protected_model_group_ids = set(protected_model_group_ids) & model_group_ids
+        ranked = self.rank(model_hashes)
+        ranked = ranked[
+            ranked.index.isin(model_group_ids - protected_model_group_ids)
+        ].copy()
+        ranked["rank"] = range(1, len(ranked) + 1)
+        num_to_keep = max(
+            self.min_model_groups, int(math.ceil(self.keep_fraction * len(ranked)))
+        )
+        kept = set(ranked.index[:num_to_keep]) | protected_model_group_ids
+        last_train_end_time = self._last_train_end_time(model_hashes)
+
+        pruned = []
+        for model_group_id in sorted(model_group_ids - kept):
+            if model_group_id in ranked.index:
+                row = ranked.loc[model_group_id]
+                reason = (
+                    "Ranked {rank} of {total} by mean distance from best {metric}{parameter} "
+                    "({dist:.4f}); only the top {keep} were kept".format(
+                        rank=int(row["rank"]),
+                        total=len(ranked),
+                        metric=self.metric,
+                        parameter=self.parameter,
+                        dist=row["mean_dist_from_best"],
+                        keep=num_to_keep,
+                    )
+                )
+                mean_dist_from_best = float(row["mean_dist_from_best"])
+                rank = int(row["rank"])
+            else:
+                reason = "No {metric}{parameter} test evaluations found".format(
+                    metric=self.metric, parameter=self.parameter
+                )
+                mean_dist_from_best = None
+                rank = None
+            pruned.append(
+                PrunedModelGroup(
+                    experiment_hash=experiment_hash,
+                    model_group_id=int(model_group_id),
+                    run_id=run_id,
+                    last_train_end_time=last_train_end_time,
+                    metric=self.metric,
+                    parameter=self.parameter,
+                    mean_dist_from_best=mean_dist_from_best,
+                    rank=rank,
+                    num_model_groups_ranked=len(ranked),
+                    reason=reason,
+                )
+            )
+        with scoped_session(self.db_engine) as session:
+            for pruned_model_group in pruned:
+                session.merge(pruned_model_group)
+
+        logging.info(
+            "Pruned %s of %s model groups by %s%s, keeping %s",
+            len(pruned),
+            len(model_group_ids),
+            self.metric,
+            self.parameter,
+            len(kept),
+        )
+        return kept
+
+    def _last_train_end_time(self, model_hashes):
+        ((last_train_end_time,),) = self.db_engine.execute(
+            "select max(train_end_time) from model_metadata.models "
+            "where model_hash = any(%(model_hashes)s)",
+            model_hashes=list(model_hashes),
+        )
+        return last_train_end_time
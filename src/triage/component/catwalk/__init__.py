@@ -6,14 +6,35 @@ from .individual_importance import IndividualImportanceCalculator
 from .model_grouping import ModelGrouper
 from .subsetters import Subsetter
 from .protected_groups_generators import ProtectedGroupsGenerator, ProtectedGroupsGeneratorNoOp
-from .utils import filename_friendly_hash
+from .utils import (
+    filename_friendly_hash,
+    balanced_batches,
+    matrix_dimensions,
+    previous_training_times,
+)
+import json
 import logging
-from collections import namedtuple
+import statistics
+from collections import defaultdict, namedtuple
+from contextlib import ExitStack
 
 import numpy
 import pandas
 
-TaskBatch = namedtuple('TaskBatch', ['parallelizable', 'tasks', 'description'])
+class TaskBatch(namedtuple('TaskBatch', ['parallelizable', 'tasks', 'description', 'n_processes'])):
+    """Train/test tasks to run together
+
+    Args:
+        parallelizable (bool) Whether the tasks can run in parallel with each other
+        tasks (list) of train/test task dictionaries
+        description (str) What the tasks have in common, for logging
+        n_processes (int, optional) The most tasks to run at once, if fewer than the
+            processes available, e.g. because each task uses several cores through n_jobs
+    """
+    __slots__ = ()
+
+    def __new__(cls, parallelizable, tasks, description, n_processes=None):
+        return super().__new__(cls, parallelizable, tasks, description, n_processes)
 
 
 class ModelTrainTester(object):
@@ -27,7 +48,9 @@ class ModelTrainTester(object):
         subsets,
         protected_groups_generator,
         cohort_hash=None,
-        replace=True
+        replace=True,
+        n_processes=1,
+        out_of_core_chunk_size=None,
     ):
         self.matrix_storage_engine = matrix_storage_engine
         self.model_trainer = model_trainer
@@ -38,6 +61,8 @@ class ModelTrainTester(object):
         self.replace = replace
         self.protected_groups_generator = protected_groups_generator or ProtectedGroupsGeneratorNoOp()
         self.cohort_hash = cohort_hash
+        self.n_processes = n_processes
+        self.out_of_core_chunk_size = out_of_core_chunk_size
 
     def generate_task_batches(self, splits, grid_config, model_comment=None):
         train_test_tasks = []
@@ -67,6 +92,207 @@ class ModelTrainTester(object):
 
 
     def order_and_batch_tasks(self, tasks):
+        """Split train/test tasks into batches, ordered to keep the processes busy
+
+        If models of the same classes have been trained before, tasks are ordered
+        by their expected training time. Otherwise they are batched by class path.
+
+        Args:
+            tasks (list) of train/test task dictionaries
+
+        Returns: (tuple) of TaskBatch objects
+        """
+        expected_runtimes = self.expected_runtimes(tasks)
+        if expected_runtimes is None:
+            batches = self.batch_tasks_by_class_path(tasks)
+        else:
+            batches = self.batch_tasks_by_expected_runtime(tasks, expected_runtimes)
+        for batch in batches:
+            self.order_warm_start_chains(batch.tasks)
+        return batches
+
+    @staticmethod
+    def order_warm_start_chains(tasks):
+        """Reorder tasks so models that can be warm-started come after the models they grow from
+
+        The tasks of each warm-start chain (see ModelTrainer.generate_train_tasks) keep
+        the positions they were given, but are reordered among those positions from
+        smallest to largest model, so the larger models are more likely to find a
+        smaller one already trained.
+
+        Args:
+            tasks (list) of train/test task dictionaries, reordered in place
+        """
+        chain_roots = {}
+        for task in tasks:
+            warm_start_model_hashes = task['train_kwargs'].get('warm_start_model_hashes')
+            if warm_start_model_hashes:
+                # the smallest model in the chain identifies it
+                root = warm_start_model_hashes[-1]
+                chain_roots[task['train_kwargs']['model_hash']] = root
+                chain_roots[root] = root
+        if not chain_roots:
+            return
+
+        chain_positions = defaultdict(list)
+        for position, task in enumerate(tasks):
+            root = chain_roots.get(task['train_kwargs']['model_hash'])
+            if root:
+                chain_positions[root].append(position)
+
+        for positions in chain_positions.values():
+            chain_tasks = sorted(
+                (tasks[position] for position in positions),
+                key=lambda task: len(task['train_kwargs'].get('warm_start_model_hashes', []))
+            )
+            for position, task in zip(positions, chain_tasks):
+                tasks[position] = task
+
+    def expected_runtimes(self, tasks):
+        """Predict how long each task's model will take to train from earlier models
+
+        Earlier models of the same class and hyperparameters (other than n_jobs) are
+        preferred, falling back to all earlier models of the same class. Training
+        time is assumed to scale with the number of rows times the number of features
+        in the train matrix. Tasks with no earlier model of their class are assumed
+        to take as long as the longest of the other tasks.
+
+        Args:
+            tasks (list) of train/test task dictionaries
+
+        Returns: (list) the expected training time of each task in seconds,
+            or None if no task has an earlier model of its class
+        """
+        history = previous_training_times(
+            set(task['train_kwargs']['class_path'] for task in tasks),
+            self.model_trainer.db_engine
+        )
+        if not history:
+            return None
+
+        def parameters_key(parameters):
+            unique_parameters = self.model_trainer.unique_parameters(parameters)
+            return json.dumps(unique_parameters, sort_keys=True, default=str)
+
+        by_parameters = defaultdict(list)
+        by_class_path = defaultdict(list)
+        for class_path, hyperparameters, training_time, num_rows, num_features in history:
+            observation = (training_time, num_rows * num_features)
+            by_parameters[class_path, parameters_key(hyperparameters)].append(observation)
+            by_class_path[class_path].append(observation)
+
+        dimensions = matrix_dimensions(
+            set(task['train_store'].uuid for task in tasks),
+            self.model_trainer.db_engine
+        )
+
+        def scaled_runtime(observations, cells):
+            if cells and all(observed_cells for _, observed_cells in observations):
+                return statistics.mean(
+                    training_time / observed_cells for training_time, observed_cells in observations
+                ) * cells
+            return statistics.mean(training_time for training_time, _ in observations)
+
+        runtimes = []
+        for task in tasks:
+            class_path = task['train_kwargs']['class_path']
+            num_rows, num_features = dimensions.get(task['train_store'].uuid, (0, 0))
+            observations = (
+                by_parameters.get((class_path, parameters_key(task['train_kwargs']['parameters'])))
+                or by_class_path.get(class_path)
+            )
+            runtimes.append(
+                scaled_runtime(observations, num_rows * num_features) if observations else None
+            )
+        known_runtimes = [runtime for runtime in runtimes if runtime is not None]
+        unknown_runtime = max(known_runtimes) if known_runtimes else 0
+        return [unknown_runtime if runtime is None else runtime for runtime in runtimes]
+
+    def batch_tasks_by_expected_runtime(self, tasks, expected_runtimes):
+        """Split tasks into parallel batches by the cores they use and a serial batch,
+        longest expected task first
+
+        Tasks with n_jobs set to -1 use the whole machine, so they go in the serial batch.
+        The rest are batched by the number of cores they use through n_jobs, and each
+        batch runs only as many tasks at once as fit in the processes available, so
+        tasks using several cores don't oversubscribe the machine. Batches of tasks using
+        more cores come first. Within a batch tasks are ordered by their expected training
+        time, so as processes free up they take the longest remaining task and the long
+        tasks don't end up running alone at the end.
+
+        Args:
+            tasks (list) of train/test task dictionaries
+            expected_runtimes (list) the expected training time of each task in seconds
+
+        Returns: (tuple) of TaskBatch objects
+        """
+        parallel_tasks = defaultdict(list)
+        parallel_costs = defaultdict(list)
+        serial_tasks = []
+        serial_costs = []
+        for task, runtime in zip(tasks, expected_runtimes):
+            n_jobs = task['train_kwargs']['parameters'].get('n_jobs', None)
+            if n_jobs == -1:
+                serial_tasks.append(task)
+                serial_costs.append(runtime)
+            else:
+                cores = min(max(n_jobs or 1, 1), self.n_processes)
+                parallel_tasks[cores].append(task)
+                parallel_costs[cores].append(runtime)
+
+        def longest_first(batch_tasks, costs):
+            order = sorted(range(len(batch_tasks)), key=lambda i: costs[i], reverse=True)
+            return [batch_tasks[i] for i in order]
+
+        # batches along with the expected runtime of their tasks and how many run at once
+        batches = []
+        for cores in sorted(parallel_tasks, reverse=True):
+            if cores == 1:
+                description = "Classifiers expected to take longest to train first"
+                n_processes = None
+            else:
+                description = (
+                    f"Classifiers using {cores} cores through n_jobs, "
+                    "expected to take longest to train first"
+                )
+                n_processes = self.n_processes // cores
+            batches.append((
+                TaskBatch(
+                    parallelizable=True,
+                    tasks=longest_first(parallel_tasks[cores], parallel_costs[cores]),
+                    description=description,
+                    n_processes=n_processes,
+                ),
+                parallel_costs[cores],
+                n_processes or self.n_processes,
+            ))
+        batches.append((
+            TaskBatch(
+                parallelizable=False,
+                tasks=longest_first(serial_tasks, serial_costs),
+                description="Heavyweight classifiers with n_jobs set to -1."
+            ),
+            serial_costs,
+            1,
+        ))
+        logging.info(
+            "Split train/test tasks into %s task batches by expected training time "
+            "- each batch has models from all splits",
+            len(batches),
+        )
+        for batch_num, (batch, costs, n_processes) in enumerate(batches, 1):
+            busiest_process = balanced_batches(costs, costs, n_processes)[0] if costs else []
+            logging.info(
+                "Batch %s: %s (%s tasks total, expected to take about %s seconds on %s processes)",
+                batch_num,
+                batch.description,
+                len(batch.tasks),
+                int(sum(busiest_process)),
+                n_processes,
+            )
+        return tuple(batch for batch, _, _ in batches)
+
+    def batch_tasks_by_class_path(self, tasks):
         batches = (
             TaskBatch(
                 parallelizable=True,
@@ -108,15 +334,43 @@ class ModelTrainTester(object):
 
     def process_all_batches(self, task_batches):
         # In the simple loop version here we ignore parallelizability and do everything serially
-        for batch in task_batches:
-            for task in batch.tasks:
-                self.process_task(**task)
+        try:
+            for batch in task_batches:
+                for task in batch.tasks:
+                    self.process_task(**task, flush=False)
+        finally:
+            self.flush()
+
+    def flush(self):
+        """Saves any results that are buffered to be written in bulk"""
+        self.model_evaluator.flush()
+        self.model_trainer.flush()
 
-    def process_task(self, test_store, train_store, train_kwargs):
+    def process_task(self, test_store, train_store, train_kwargs, flush=True):
+        """Trains a model, then predicts and evaluates it on its test and train matrices
+
+        Args:
+            test_store (catwalk.storage.MatrixStore) the test matrix
+            train_store (catwalk.storage.MatrixStore) the train matrix
+            train_kwargs (dict) keyword arguments for ModelTrainer.process_train_task
+            flush (bool) whether to save buffered results when the task is done, rather
+                than leaving them to be saved with those of later tasks
+        """
+        try:
+            self._process_task(test_store, train_store, train_kwargs)
+        finally:
+            if flush:
+                self.flush()
+
+    def _process_task(self, test_store, train_store, train_kwargs):
         logging.info("Beginning train task %s", train_kwargs)
 
+        out_of_core_chunk_size = self.out_of_core_chunk_size
         # If the matrices and train labels are OK, train and test the model!
-        with self.model_trainer.cache_models(), test_store.cache(), train_store.cache():
+        # Out of core, the train matrix is never held in memory: it is read in chunks
+        # for training, and there are no predictions or evaluations on it.
+        train_store_cache = ExitStack() if out_of_core_chunk_size else train_store.cache()
+        with self.model_trainer.cache_models(), test_store.cache(), train_store_cache:
             # will cache any trained models until it goes out of scope (at the end of the task)
             # this way we avoid loading the model pickle again for predictions
 
@@ -130,7 +384,13 @@ class ModelTrainTester(object):
                     train_store.uuid
                 )
                 return
-            if len(train_store.labels.unique()) == 1:
+            if out_of_core_chunk_size:
+                train_label_values = set()
+                for _, labels in train_store.matrix_label_chunks(out_of_core_chunk_size):
+                    train_label_values.update(labels.unique())
+            else:
+                train_label_values = train_store.labels.unique()
+            if len(train_label_values) == 1:
                 logging.warning(
                     """Train Matrix for split %s had only one
                 unique value, no point in training this model. Skipping
@@ -169,7 +429,7 @@ class ModelTrainTester(object):
             )
 
             # Generate predictions for the testing data then training data
-            for store in (test_store, train_store):
+            for store in (test_store,) if out_of_core_chunk_size else (test_store, train_store):
                 predictions_proba = numpy.array(None)
                 protected_df = None
                 if self.replace:
@@ -188,15 +448,24 @@ class ModelTrainTester(object):
                         train_matrix_columns=train_store.columns(),
                     )
 
-                for subset in self.subsets:
-                    if self.replace or self.model_evaluator.needs_evaluations(
-                        store, model_id, filename_friendly_hash(subset)
-                    ):
+                # evaluations without a subset are saved with an empty subset hash
+                subset_hashes = [
+                    filename_friendly_hash(subset) if subset else ""
+                    for subset in self.subsets
+                ]
+                if self.replace:
+                    subsets_needed = set(subset_hashes)
+                else:
+                    subsets_needed = self.model_evaluator.subsets_needing_evaluations(
+                        store, model_id, subset_hashes
+                    )
+                for subset, subset_hash in zip(self.subsets, subset_hashes):
+                    if subset_hash in subsets_needed:
                         logging.info(
                             "Evaluating matrix %s-%s, subset %s, and model %s",
                             store.uuid,
                             store.matrix_type,
-                            filename_friendly_hash(subset),
+                            subset_hash,
                             model_id,
                         )
 
@@ -216,8 +485,8 @@ class ModelTrainTester(object):
                                 train_matrix_columns=train_store.columns(),
                             )
                         if protected_df is None:
-                            protected_df = self.protected_groups_generator.as_dataframe(
-                                as_of_dates=store.as_of_dates,
+                            protected_df = self.protected_groups_generator.as_matrix_dataframe(
+                                matrix_store=store,
                                 cohort_hash=self.cohort_hash,
                             )
 
@@ -236,7 +505,7 @@ class ModelTrainTester(object):
                             "in db from a previous run (or none needed at all), so skipping!",
                             store.uuid,
                             store.matrix_type,
-                            filename_friendly_hash(subset),
+                            subset_hash,
                             model_id
                         )
                 self.predictor.update_db_with_ranks(model_id, store.uuid, store.matrix_type)
@@ -0,0 +1,306 @@
+"""Group fairness audits of model predictions
+
+Computes, for each protected attribute and each threshold, the confusion counts and
+rates of every group, their disparity with a reference group, and whether each
+disparity is within the fairness threshold. These are the values saved in the
+test_results.aequitas and train_results.aequitas tables, and follow the definitions of
+the Aequitas toolkit, but are computed from the sorted predictions in one vectorized pass.
+"""
+import numpy
+import pandas
+from pandas.api.types import is_categorical_dtype
+
+
+# Attribute values that are missing are audited as their own group, under this name,
+# which is the name earlier Aequitas audits saved them under
+MISSING_ATTRIBUTE_VALUE = "pd.np.nan"
+
+# Columns identifying rows rather than groups, which are not audited
+NON_ATTRIBUTE_COLUMNS = ("entity_id", "as_of_date")
+
+# Disparities with a reference group whose metric is 0 are saved as this value
+DISPARITY_CAP = 10.0
+
+# A disparity is fair if it is between this threshold and its inverse
+FAIRNESS_THRESHOLD = 0.8
+
+# (metric, the table column the metric is saved in)
+GROUP_METRICS = (
+    ("ppr", "ppr"),
+    ("pprev", "pprev"),
+    ("precision", "precision"),
+    ("fdr", "fdr"),
+    ("for", "for_"),
+    ("fpr", "fpr"),
+    ("fnr", "fnr"),
+    ("tpr", "tpr"),
+    ("tnr", "tnr"),
+    ("npv", "npv"),
+)
+
+# parity column: the metric whose disparity it judges
+PARITY_METRICS = {
+    "Statistical_Parity": "ppr",
+    "Impact_Parity": "pprev",
+    "FDR_Parity": "fdr",
+    "FPR_Parity": "fpr",
+    "FOR_Parity": "for",
+    "FNR_Parity": "fnr",
+}
+
+# parity column: the two parities it combines. Computed in order, as later ones
+# combine earlier ones
+COMBINED_PARITIES = (
+    ("TypeI_Parity", ("FDR_Parity", "FPR_Parity")),
+    ("TypeII_Parity", ("FOR_Parity", "FNR_Parity")),
+    ("Equalized_Odds", ("FPR_Parity", "TPR_Parity")),
+    ("Unsupervised_Fairness", ("Statistical_Parity", "Impact_Parity")),
+    ("Supervised_Fairness", ("TypeI_Parity", "TypeII_Parity")),
+)
+
+def audit_thresholds(thresholds_config, num_rows):
+    """The number of top-ranked rows predicted positive for each configured threshold
+
+    Args:
+        thresholds_config (dict) with optional keys 'top_n', a list of absolute
+            thresholds, and 'percentiles', a list of thresholds between 0 and 100
+        num_rows (int) The number of rows being audited
+
+    Returns: (list) of (parameter, number of rows predicted positive) tuples
+    """
+    ranks = numpy.arange(1, num_rows + 1)
+    thresholds = []
+    for top_n in thresholds_config.get("top_n", []):
+        thresholds.append((f"{top_n}_abs", int((ranks <= top_n).sum())))
+    for percentile in thresholds_config.get("percentiles", []):
+        fraction = percentile / 100.0
+        thresholds.append(
+            (f"{fraction}_pct", int((ranks / num_rows <= fraction).sum()))
+        )
+    return thresholds
+
+
+def discretize_attributes(protected_df):
+    """Converts protected attributes to the string group values that are audited
+
+    Categorical attributes are treated like the values of their categories. Non-string
+    attributes with more than one value are cut into quartiles named by their bounds
+    (e.g. '0.00-0.25'), the rest are converted to strings, and missing values are named
+    MISSING_ATTRIBUTE_VALUE.
+
+    Args:
+        protected_df (pandas.DataFrame) protected attributes, one column for each.
+            Any NON_ATTRIBUTE_COLUMNS are left out
+
+    Returns: (pandas.DataFrame) of string attribute values
+    """
+    attributes = pandas.DataFrame(index=protected_df.index)
+    for column in protected_df.columns:
+        if column in NON_ATTRIBUTE_COLUMNS:
+            continue
+        values = protected_df[column]
+        if is_categorical_dtype(values):
+            # audited like the values of its categories, so numeric ones are still binned
+            values = pandas.Series(numpy.asarray(values), index=values.index)
+        if values.dtype != object and values.dtype != bool:
+            if values.nunique(dropna=False) > 1:
+                # cut the bare values, as some versions of pandas can't cut a series with
+                # a MultiIndex, like that of the matrix rows
+                bins, edges = pandas.qcut(
+                    values.values, 4, precision=2, labels=False, duplicates="drop", retbins=True
+                )
+                bins = pandas.Series(bins, index=values.index)
+                names = [
+                    "%0.2f-%0.2f" % (edges[i], edges[i + 1])
+                    for i in range(len(edges) - 1)
+                ]
+                values = bins.map(lambda bin_: names[int(bin_)], na_action="ignore")
+            else:
+                values = values.astype(str)
+        attributes[column] = values.fillna(MISSING_ATTRIBUTE_VALUE).astype(str)
+    return attributes
+
+
+def _divide(numerators, denominators):
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        return numpy.where(denominators != 0, numerators / denominators, numpy.nan)
+
+
+def _group_counts(codes, num_groups, weights, cutoffs):
+    """Counts the rows of each group above each cutoff, in one pass over the rows
+
+    Each row is assigned the segment between consecutive sorted cutoffs that it falls
+    in, the rows are counted per segment and group, and the counts are accumulated
+    over the segments.
+
+    Args:
+        codes (numpy.ndarray) the group of each row, in rank order
+        num_groups (int) the number of groups
+        weights (numpy.ndarray) what each row counts for
+        cutoffs (numpy.ndarray) sorted numbers of top-ranked rows
+
+    Returns: (numpy.ndarray) of shape (len(cutoffs), num_groups)
+    """
+    segments = numpy.searchsorted(cutoffs, numpy.arange(len(codes)), side="right")
+    counts = numpy.bincount(
+        segments * num_groups + codes,
+        weights=weights,
+        minlength=(len(cutoffs) + 1) * num_groups,
+    ).reshape(len(cutoffs) + 1, num_groups)
+    return numpy.cumsum(counts, axis=0)[:-1]
+
+
+def _attribute_crosstabs(attribute_name, values, labels, thresholds):
+    """The group sizes, confusion counts and rates of one attribute for each threshold"""
+    codes, group_values = pandas.factorize(values, sort=True)
+    num_groups = len(group_values)
+    positive = (labels == 1).astype(float)
+    negative = (labels == 0).astype(float)
+    group_size = numpy.bincount(codes, minlength=num_groups)
+    group_label_pos = numpy.bincount(codes, weights=positive, minlength=num_groups)
+    group_label_neg = numpy.bincount(codes, weights=negative, minlength=num_groups)
+
+    k = numpy.array([num_predicted for _, num_predicted in thresholds], dtype=int)
+    cutoffs, threshold_cutoff = numpy.unique(k, return_inverse=True)
+    everyone = numpy.ones(len(codes))
+    pp = _group_counts(codes, num_groups, everyone, cutoffs)[threshold_cutoff]
+    tp = _group_counts(codes, num_groups, positive, cutoffs)[threshold_cutoff]
+    fp = _group_counts(codes, num_groups, negative, cutoffs)[threshold_cutoff]
+    pn = group_size - pp
+    fn = group_label_pos - tp
+    tn = group_label_neg - fp
+
+    num_thresholds = len(thresholds)
+    crosstabs = pandas.DataFrame({
+        "parameter": numpy.repeat([parameter for parameter, _ in thresholds], num_groups),
+        "attribute_name": attribute_name,
+        "attribute_value": numpy.tile(group_values, num_thresholds),
+        "total_entities": len(codes),
+        "group_label_pos": numpy.tile(group_label_pos, num_thresholds).astype(int),
+        "group_label_neg": numpy.tile(group_label_neg, num_thresholds).astype(int),
+        "group_size": numpy.tile(group_size, num_thresholds),
+        "group_size_pct": numpy.tile(group_size / len(codes), num_thresholds),
+        "prev": numpy.tile(_divide(group_label_pos, group_size), num_thresholds),
+        "pp": pp.ravel().astype(int),
+        "pn": pn.ravel().astype(int),
+        "fp": fp.ravel().astype(int),
+        "fn": fn.ravel().astype(int),
+        "tn": tn.ravel().astype(int),
+        "tp": tp.ravel().astype(int),
+    })
+    rates = {
+        "ppr": _divide(pp, k[:, numpy.newaxis]),
+        "pprev": _divide(pp, group_size),
+        "precision": _divide(tp, pp),
+        "fdr": _divide(fp, pp),
+        "for": _divide(fn, pn),
+        "fpr": _divide(fp, group_label_neg),
+        "fnr": _divide(fn, group_label_pos),
+        "tpr": _divide(tp, group_label_pos),
+        "tnr": _divide(tn, group_label_neg),
+        "npv": _divide(tn, pn),
+    }
+    return crosstabs, rates, group_values, group_size
+
+
+def _reference_groups(attribute_name, rates, group_values, group_size, method, ref_groups):
+    """The index of the reference group of each threshold and metric
+
+    Returns: (dict) of metric to a numpy.ndarray with one group index per threshold
+    """
+    num_thresholds = next(iter(rates.values())).shape[0]
+    if method == "predefined":
+        if attribute_name not in ref_groups:
+            raise ValueError(
+                f"Bias audit: no predefined reference group for attribute {attribute_name}"
+            )
+        matches = numpy.flatnonzero(group_values == str(ref_groups[attribute_name]))
+        if len(matches) == 0:
+            raise ValueError(
+                f"Bias audit: predefined reference group {ref_groups[attribute_name]} "
+                f"not found in attribute {attribute_name}"
+            )
+        reference = numpy.full(num_thresholds, matches[0])
+        return {metric: reference for metric in rates}
+    if method == "majority":
+        reference = numpy.full(num_thresholds, numpy.argmax(group_size))
+        return {metric: reference for metric in rates}
+    references = {}
+    for metric, values in rates.items():
+        # the group with the lowest value, or the first group if no group has a value
+        references[metric] = numpy.where(
+            numpy.isnan(values).all(axis=1),
+            0,
+            numpy.argmin(numpy.where(numpy.isnan(values), numpy.inf, values), axis=1),
+        )
+    return references
+
+
+def _parity(disparities):
+    fair = (disparities >= FAIRNESS_THRESHOLD) & (disparities <= 1 / FAIRNESS_THRESHOLD)
+    return pandas.Series(fair, dtype=object).where(~numpy.isnan(disparities), None)
+
+
+def _combined_parity(first, second):
+    both_true = (first == True) & (second == True)  # noqa: E712
+    return both_true.astype(object).where(first.notnull() | second.notnull(), None)
+
+
+def audit_groups(protected_df, labels, thresholds, ref_groups_method=None, ref_groups=None):
+    """Audits the fairness of sorted predictions across protected groups
+
+    Args:
+        protected_df (pandas.DataFrame) protected attributes, one column for each, with
+            rows in the same order as the labels
+        labels (numpy.ndarray) labels, sorted by predicted score descending with the
+            tiebreaking rule being audited
+        thresholds (list) of (parameter, number of top rows predicted positive) tuples,
+            as returned by audit_thresholds
+        ref_groups_method (string, optional) How to pick the reference group of each
+            attribute: 'predefined', 'majority', or by default the group with the lowest
+            value of each metric
+        ref_groups (dict, optional) attribute name to reference group value, used by
+            the 'predefined' method
+
+    Returns: (pandas.DataFrame) one row for each threshold, attribute and group, with
+        columns named as the attributes of results_schema.TestAequitas
+    """
+    if ref_groups_method not in ("predefined", "majority"):
+        ref_groups_method = "min_metric"
+    if ref_groups_method == "predefined" and not ref_groups:
+        ref_groups_method = "min_metric"
+    labels = numpy.asarray(labels, dtype=float)
+    attributes = discretize_attributes(protected_df)
+
+    audits = []
+    for attribute_name in attributes.columns:
+        crosstabs, rates, group_values, group_size = _attribute_crosstabs(
+            attribute_name, attributes[attribute_name].values, labels, thresholds
+        )
+        references = _reference_groups(
+            attribute_name, rates, group_values, group_size, ref_groups_method, ref_groups
+        )
+        threshold_rows = numpy.arange(len(thresholds))[:, numpy.newaxis]
+        for metric, column in GROUP_METRICS:
+            values = rates[metric]
+            reference_values = values[threshold_rows, references[metric][:, numpy.newaxis]]
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                disparities = values / reference_values
+            disparities[numpy.isinf(disparities)] = DISPARITY_CAP
+            crosstabs[column] = values.ravel()
+            crosstabs[f"{metric}_disparity"] = disparities.ravel()
+            crosstabs[f"{metric}_ref_group_value"] = numpy.repeat(
+                group_values[references[metric]], len(group_values)
+            )
+        audits.append(crosstabs)
+    if not audits:
+        return pandas.DataFrame()
+    audit = pandas.concat(audits, ignore_index=True)
+
+    for parity, metric in PARITY_METRICS.items():
+        audit[parity] = _parity(audit[f"{metric}_disparity"].values)
+    audit["TPR_Parity"] = _parity(audit["tpr_disparity"].values)
+    for parity, (first, second) in COMBINED_PARITIES:
+        audit[parity] = _combined_parity(audit[first], audit[second])
+    del audit["TPR_Parity"]
+    return audit
@@ -1,16 +1,40 @@
+import threading
+import time
+
 import yaml
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.engine.url import URL
 from sqlalchemy.pool import QueuePool
 
 from triage.component.results_schema import Base
 
 
+# Connections each engine made by connect() keeps open, and how many more it may open
+# when they are all in use
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+
+
 def ensure_db(engine):
     Base.metadata.create_all(engine)
 
 
-def connect(poolclass=QueuePool):
+def connect(
+    poolclass=QueuePool,
+    pool_size=DEFAULT_POOL_SIZE,
+    max_overflow=DEFAULT_MAX_OVERFLOW,
+):
+    """Creates an engine for the database configured in database.yaml
+
+    Args:
+        poolclass (sqlalchemy.pool.Pool subclass) The connection pool to use
+        pool_size (int) The number of connections a QueuePool keeps open
+        max_overflow (int) The number of connections a QueuePool may open beyond
+            pool_size when they are all in use
+
+    Returns: (sqlalchemy.engine.Engine)
+    """
     with open("database.yaml") as fd:
         config = yaml.load(fd)
         dburl = URL(
@@ -21,4 +45,143 @@ def connect(poolclass=QueuePool):
             password=config["pass"],
             port=config["port"],
         )
-        return create_engine(dburl, poolclass=poolclass)
+    pool_kwargs = {}
+    if issubclass(poolclass, QueuePool):
+        # stale connections are replaced when checked out instead of failing a query
+        pool_kwargs = dict(pool_size=pool_size, max_overflow=max_overflow, pool_pre_ping=True)
+    return track_engine(create_engine(dburl, poolclass=poolclass, **pool_kwargs))
+
+
+class DatabaseStatistics(object):
+    """Counts the database work done by the engines tracked with track_engine, shared
+    through DB_STATS, so that the cost of talking to the database can be monitored
+    alongside the cost of modeling.
+
+    Counts the connections opened (as opposed to reused from a pool), the connections
+    checked out of pools, and the statements executed and the time spent waiting on them.
+    Bulk copies made on raw DBAPI connections are not counted as statements.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Resets all counters"""
+        with self._lock:
+            self.connections_opened = 0
+            self.connections_checked_out = 0
+            self.queries = 0
+            self.query_seconds = 0.0
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    def connection_checked_out(self):
+        with self._lock:
+            self.connections_checked_out += 1
+
+    def query_executed(self, seconds):
+        with self._lock:
+            self.queries += 1
+            self.query_seconds += seconds
+
+    def stats(self):
+        """Statistics for monitoring the database work done
+
+        Returns: (dict) the number of connections opened and checked out, and the number
+            of statements executed and the seconds spent waiting on them
+        """
+        with self._lock:
+            return {
+                "connections_opened": self.connections_opened,
+                "connections_checked_out": self.connections_checked_out,
+                "queries": self.queries,
+                "query_seconds": self.query_seconds,
+            }
+
+
+DB_STATS = DatabaseStatistics()
+
+
+def _count_connection_opened(dbapi_connection, connection_record):
+    DB_STATS.connection_opened()
+
+
+def _count_connection_checked_out(dbapi_connection, connection_record, connection_proxy):
+    DB_STATS.connection_checked_out()
+
+
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+
+def _stop_query_timer(conn):
+    start_times = conn.info.get("query_start_times")
+    if start_times:
+        DB_STATS.query_executed(time.perf_counter() - start_times.pop())
+
+
+def _stop_executed_query_timer(conn, cursor, statement, parameters, context, executemany):
+    _stop_query_timer(conn)
+
+
+def _stop_failed_query_timer(exception_context):
+    # only errors raised by the cursor had their timer started
+    if exception_context.connection is not None and exception_context.cursor is not None:
+        _stop_query_timer(exception_context.connection)
+
+
+_TRACKING_LISTENERS = (
+    ("connect", _count_connection_opened),
+    ("checkout", _count_connection_checked_out),
+    ("before_cursor_execute", _start_query_timer),
+    ("after_cursor_execute", _stop_executed_query_timer),
+    ("handle_error", _stop_failed_query_timer),
+)
+
+
+def track_engine(db_engine):
+    """Count the database work done through an engine in DB_STATS
+
+    Only engines passed here are counted, so that other engines in the process
+    don't pay for the tracking. Tracking an engine twice has no further effect.
+
+    Args:
+        db_engine (sqlalchemy.engine.Engine or triage.util.db.SerializableDbEngine)
+
+    Returns: the engine
+    """
+    engine = getattr(db_engine, "__wrapped__", db_engine)
+    if not isinstance(engine, Engine):
+        return db_engine
+    for identifier, listener in _TRACKING_LISTENERS:
+        if not event.contains(engine, identifier, listener):
+            event.listen(engine, identifier, listener)
+    return db_engine
+
+
+# Compiled SQL of the statements run through execute_cached, shared by every engine in
+# the process. Only module-level statements are run through it, so it stays small
+_COMPILED_STATEMENTS = {}
+
+
+def execute_cached(db_engine, statement, **params):
+    """Executes a statement that is run over and over, compiling its SQL only once
+
+    The statement should be built once, e.g. at module level, with bind parameters for
+    the values that change between executions, as its compiled SQL is cached by the
+    statement object.
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        statement (sqlalchemy.sql.expression.Executable) The statement to execute
+        **params The values of the statement's bind parameters
+
+    Returns: (list) of the result rows, or an empty list if the statement returns none
+    """
+    with db_engine.connect() as conn:
+        result = conn.execution_options(
+            compiled_cache=_COMPILED_STATEMENTS
+        ).execute(statement, params)
+        return result.fetchall() if result.returns_rows else []
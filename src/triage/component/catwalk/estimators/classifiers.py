@@ -1,9 +1,11 @@
 # coding: utf-8
 
+import numpy as np
 from sklearn.base import BaseEstimator, ClassifierMixin
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import MinMaxScaler
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.utils.validation import check_is_fitted
 
 from .transformers import CutOff
 
@@ -102,3 +104,104 @@ class ScaledLogisticRegression(BaseEstimator, ClassifierMixin):
 
     def score(self, X, y):
         return self.pipeline.score(X, y)
+
+
+class ChunkedScaledLogisticRegression(BaseEstimator, ClassifierMixin):
+    """
+    A ScaledLogisticRegression that can be trained on a matrix too large for memory.
+
+    The MaxMinScaler statistics are computed in a first pass over the chunks of
+    the matrix, and the logistic regression is then fit by stochastic gradient
+    descent, one chunk at a time, for `max_iter` passes over the chunks.
+    As in ScaledLogisticRegression, C is the inverse of the regularization
+    strength: the penalty is weighted by 1 / (C * number of rows).
+    """
+
+    def __init__(
+        self, penalty="l2", C=1.0, fit_intercept=True, max_iter=5, random_state=None
+    ):
+        self.penalty = penalty
+        self.C = C
+        self.fit_intercept = fit_intercept
+        self.max_iter = max_iter
+        self.random_state = random_state
+
+        self.minmax_scaler = MinMaxScaler()
+        self.dsapp_cutoff = CutOff()
+        self.sgd = None
+
+    def _transform(self, X):
+        return self.dsapp_cutoff.transform(self.minmax_scaler.transform(X))
+
+    def fit(self, X, y, sample_weight=None):
+        return self.fit_chunks(lambda: [(X, y, sample_weight)])
+
+    def fit_chunks(self, chunks, classes=None):
+        """Fit to a matrix given as chunks of rows
+
+        Args:
+            chunks (callable) Returns a new iterator over the chunks of the matrix each
+                time it is called, as tuples of (design matrix, labels, sample weights
+                or None)
+            classes (array-like, optional) Every label in the matrix.
+                Defaults to the labels found in the first pass over the chunks
+
+        Returns: self
+        """
+        self.minmax_scaler = MinMaxScaler()
+        n_samples = 0
+        found_classes = set()
+        for X, y, _ in chunks():
+            self.minmax_scaler.partial_fit(X)
+            n_samples += len(y)
+            found_classes.update(np.unique(y))
+        if classes is None:
+            classes = sorted(found_classes)
+
+        self.sgd = SGDClassifier(
+            loss="log",
+            penalty=self.penalty,
+            alpha=1.0 / (self.C * n_samples),
+            fit_intercept=self.fit_intercept,
+            random_state=self.random_state,
+        )
+        for _ in range(self.max_iter):
+            for X, y, sample_weight in chunks():
+                self.partial_fit(X, y, classes=classes, sample_weight=sample_weight)
+        return self
+
+    def partial_fit(self, X, y, classes=None, sample_weight=None):
+        """Update the fitted model with one more chunk of rows, scaled with the
+        statistics computed when it was fit
+        """
+        check_is_fitted(self.minmax_scaler, "scale_")
+        if self.sgd is None:
+            raise ValueError("Call fit or fit_chunks before partial_fit")
+        self.sgd.partial_fit(
+            self._transform(X), y, classes=classes, sample_weight=sample_weight
+        )
+
+        self.min_ = self.minmax_scaler.min_
+        self.scale_ = self.minmax_scaler.scale_
+        self.data_min_ = self.minmax_scaler.data_min_
+        self.data_max_ = self.minmax_scaler.data_max_
+        self.data_range_ = self.minmax_scaler.data_range_
+
+        self.coef_ = self.sgd.coef_
+        self.intercept_ = self.sgd.intercept_
+
+        self.classes_ = self.sgd.classes_
+
+        return self
+
+    def predict_proba(self, X):
+        return self.sgd.predict_proba(self._transform(X))
+
+    def predict_log_proba(self, X):
+        return self.sgd.predict_log_proba(self._transform(X))
+
+    def predict(self, X):
+        return self.sgd.predict(self._transform(X))
+
+    def score(self, X, y):
+        return self.sgd.score(self._transform(X), y)
@@ -8,20 +8,20 @@ import ohio.ext.pandas
 import pandas
 import statistics
 import typing
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from sqlalchemy import and_, bindparam, select, tuple_
 from sqlalchemy.orm import sessionmaker
 
-from aequitas.bias import Bias
-from aequitas.fairness import Fairness
-from aequitas.group import Group
-from aequitas.preprocessing import preprocess_input_df
-
 from . import metrics
+from .db import execute_cached
+from .bias_audit import audit_groups, audit_thresholds
 from .utils import (
     db_retry,
     sort_predictions_and_labels,
     get_subset_table_name,
-    filename_friendly_hash
+    filename_friendly_hash,
+    copy_db_objects,
+    save_db_objects,
 )
 from triage.util.db import scoped_session
 from triage.util.random import generate_python_random_seed
@@ -31,6 +31,9 @@ from triage.component.catwalk.storage import MatrixStore
 RELATIVE_TOLERANCE = 0.01
 SORT_TRIALS = 30
 
+# The number of evaluations an experiment accumulates before writing them to the database
+DEFAULT_EVALUATION_BUFFER_SIZE = 10000
+
 
 
 def subset_labels_and_predictions(
@@ -61,7 +64,7 @@ def subset_labels_and_predictions(
     # The subset isn't specific to the cohort, so inner join to the labels/predictions
     labels_subset = labels.align(subset_df, join="inner")[0]
     predictions_subset = indexed_predictions.align(subset_df, join="inner")[0].values
-    protected_df_subset = protected_df if protected_df.empty else protected_df.align(subset_df, join="inner")[0]
+    protected_df_subset = protected_df if protected_df.empty else protected_df.reindex(labels_subset.index)
     logging.debug(
         "%s entities in subset out of %s in matrix.",
         len(labels_subset),
@@ -149,6 +152,24 @@ class MetricEvaluationResult(typing.NamedTuple):
     num_positive_labels: int
 
 
+@functools.lru_cache(maxsize=None)
+def _evaluated_metrics(evaluation_obj):
+    """The statement selecting the metrics and parameters evaluated for a model, matrix
+    and any of several subsets, built once for each evaluations table so that its
+    compiled SQL is reused"""
+    return select([
+        evaluation_obj.subset_hash,
+        evaluation_obj.metric,
+        evaluation_obj.parameter,
+    ]).distinct().where(and_(
+        evaluation_obj.model_id == bindparam("model_id"),
+        evaluation_obj.evaluation_start_time == bindparam("evaluation_start_time"),
+        evaluation_obj.evaluation_end_time == bindparam("evaluation_end_time"),
+        evaluation_obj.as_of_date_frequency == bindparam("as_of_date_frequency"),
+        evaluation_obj.subset_hash.in_(bindparam("subset_hashes", expanding=True)),
+    ))
+
+
 class ModelEvaluator(object):
     """An object that can score models based on its known metrics"""
 
@@ -180,6 +201,7 @@ class ModelEvaluator(object):
         db_engine,
         custom_metrics=None,
         bias_config=None,
+        evaluation_buffer_size=0,
     ):
         """
         Args:
@@ -212,11 +234,18 @@ class ModelEvaluator(object):
                 Each function is expected take in the following params:
                 (predictions_proba, predictions_binary, labels, parameters)
                 and return a numeric score
+            bias_config (dict) The bias audit configuration, if any
+            evaluation_buffer_size (int) How many evaluations to accumulate, across
+                models and subsets, before writing them to the database together. By
+                default each evaluation call writes its own; otherwise call flush to
+                write the rest
         """
         self.testing_metric_groups = testing_metric_groups
         self.training_metric_groups = training_metric_groups
         self.db_engine = db_engine
         self.bias_config = bias_config
+        self.evaluation_buffer_size = evaluation_buffer_size
+        self._buffered_evaluations = OrderedDict()
         if custom_metrics:
             self._validate_metrics(custom_metrics)
             self.available_metrics.update(custom_metrics)
@@ -406,42 +435,47 @@ class ModelEvaluator(object):
         Returns:
             (bool) whether or not this matrix and model are missing any evaluations in the db
         """
+        return bool(self.subsets_needing_evaluations(matrix_store, model_id, [subset_hash]))
 
-        # assemble a list of evaluation objects from the config
-        # by running the evaluation code with an empty list of predictions and labels
-        eval_obj = matrix_store.matrix_type.evaluation_obj
-        matrix_type = matrix_store.matrix_type
-        metric_definitions = self.metric_definitions_from_matrix_type(matrix_type)
+    def subsets_needing_evaluations(self, matrix_store, model_id, subset_hashes):
+        """Returns the subsets of a matrix that are missing any of the configured
+        metrics for the given model, checking all of them in one query.
 
-        # assemble a list of evaluation objects from the database
-        # by querying the unique metrics and parameters relevant to the passed-in matrix
-        session = self.sessionmaker()
-        evaluation_objects_in_db = session.query(eval_obj).filter_by(
+        Args:
+            matrix_store (triage.component.catwalk.storage.MatrixStore)
+            model_id (int) A model id
+            subset_hashes (list) Identifiers of the subsets to be evaluated, '' for no subset
+
+        Returns:
+            (set) the subset hashes missing any evaluations in the db
+        """
+        # if we do have bias config, all subsets are needed. Too complicated with aequitas'
+        # visibility at present to check whether all the needed records are present.
+        if self.bias_config:
+            return set(subset_hashes)
+
+        # The needed metrics and parameters of each subset are all the unique metric/params
+        # from the config not present in the unique metric/params in the db for the subset
+        metric_definitions = self.metric_definitions_from_matrix_type(matrix_store.matrix_type)
+        metrics_needed = {(met.metric, met.parameter_string) for met in metric_definitions}
+        metrics_in_db = defaultdict(set)
+        for row in execute_cached(
+            self.db_engine,
+            _evaluated_metrics(matrix_store.matrix_type.evaluation_obj),
             model_id=model_id,
             evaluation_start_time=matrix_store.as_of_dates[0],
             evaluation_end_time=matrix_store.as_of_dates[-1],
             as_of_date_frequency=matrix_store.metadata["as_of_date_frequency"],
-            subset_hash=subset_hash,
-        ).distinct(eval_obj.metric, eval_obj.parameter).all()
-        # The list of needed metrics and parameters are all the unique metric/params from the config
-        # not present in the unique metric/params from the db
-        evals_needed = bool(
-            {(met.metric, met.parameter_string) for met in metric_definitions} -
-            {(obj.metric, obj.parameter) for obj in evaluation_objects_in_db}
-        )
-        session.close()
-        if evals_needed:
+            subset_hashes=list(subset_hashes),
+        ):
+            metrics_in_db[row.subset_hash].add((row.metric, row.parameter))
+        subsets_needed = {
+            subset_hash for subset_hash in subset_hashes
+            if metrics_needed - metrics_in_db[subset_hash]
+        }
+        if subsets_needed:
             logging.debug("Needed evaluations missing")
-            return True
-
-        # now check bias config if there
-        # if no bias config, no aequitas audits needed, so just return False at this point
-        if not self.bias_config:
-            return False
-
-        # if we do have bias config, return True. Too complicated with aequitas' visibility
-        # at present to check whether all the needed records are needed.
-        return True
+        return subsets_needed
 
     def _compute_evaluations(self, predictions_proba, labels, metric_definitions):
         """Compute evaluations for a set of predictions and labels
@@ -517,8 +551,6 @@ class ModelEvaluator(object):
                 name for the subset to evaluate on, if any
             protected_df (pandas.DataFrame) A dataframe with protected group attributes
         """
-        if (protected_df is not None) and (not protected_df.empty):
-            protected_df = protected_df.align(matrix_store.labels, join="inner", axis=0)[0]
         # If we are evaluating on a subset, we want to get just the labels and
         # predictions for the included entity-date pairs
         if subset:
@@ -537,17 +569,25 @@ class ModelEvaluator(object):
         else:
             labels = matrix_store.labels
             subset_hash = "" 
+        if (
+            (protected_df is not None)
+            and (not protected_df.empty)
+            and (not protected_df.index.equals(labels.index))
+        ):
+            # line the protected attributes up with the labels and predictions
+            protected_df = protected_df.reindex(labels.index)
         labels = numpy.array(labels)
 
         matrix_type = matrix_store.matrix_type
         metric_defs = self.metric_definitions_from_matrix_type(matrix_type)
 
         logging.info("Found %s metric definitions total", len(metric_defs))
-        # 1. get worst sorting
-        predictions_proba_worst, labels_worst = sort_predictions_and_labels(
+        # 1. get worst sorting, keeping the order of the rows for the bias audit
+        predictions_proba_worst, labels_worst, (order_worst,) = sort_predictions_and_labels(
             predictions_proba=predictions_proba,
             labels=labels,
             tiebreaker='worst',
+            parallel_arrays=(numpy.arange(len(labels)),),
         )
         worst_lookup = {
             (eval.metric, eval.parameter): eval
@@ -556,10 +596,11 @@ class ModelEvaluator(object):
         }
 
         # 2. get best sorting
-        predictions_proba_best, labels_best = sort_predictions_and_labels(
+        predictions_proba_best, labels_best, (order_best,) = sort_predictions_and_labels(
             predictions_proba=predictions_proba_worst,
             labels=labels_worst,
             tiebreaker='best',
+            parallel_arrays=(order_worst,),
         )
         best_lookup = {
             (eval.metric, eval.parameter): eval
@@ -650,20 +691,10 @@ class ModelEvaluator(object):
             self._write_audit_to_db(
                 model_id=model_id,
                 protected_df=protected_df,
-                predictions_proba=predictions_proba_worst,
-                labels=labels_worst,
-                tie_breaker='worst',
-                subset_hash=subset_hash,
-                matrix_type=matrix_type,
-                evaluation_start_time=evaluation_start_time,
-                evaluation_end_time=evaluation_end_time,
-                matrix_uuid=matrix_store.uuid)
-            self._write_audit_to_db(
-                model_id=model_id,
-                protected_df=protected_df,
-                predictions_proba=predictions_proba_best,
-                labels=labels_best,
-                tie_breaker='best',
+                sorted_labels={
+                    'worst': (order_worst, labels_worst),
+                    'best': (order_best, labels_best),
+                },
                 subset_hash=subset_hash,
                 matrix_type=matrix_type,
                 evaluation_start_time=evaluation_start_time,
@@ -674,9 +705,7 @@ class ModelEvaluator(object):
         self,
         model_id,
         protected_df,
-        predictions_proba,
-        labels,
-        tie_breaker,
+        sorted_labels,
         subset_hash,
         matrix_type,
         evaluation_start_time,
@@ -684,14 +713,17 @@ class ModelEvaluator(object):
         matrix_uuid
     ):
         """
-        Runs the bias audit and saves the result in the bias table.
+        Runs the bias audit for each tiebreaking rule and saves the result in the bias table.
+        Existing rows for the audited parameters and attributes are replaced with one
+        delete, and the new rows are saved with one COPY.
 
         Args:
             model_id (int) primary key of the model
-            protected_df (pandas.DataFrame) A dataframe with protected group attributes:
-            predictions_proba (numpy.array) List of prediction probabilities
-            labels (pandas.Series): List of labels
-            tie_breaker: 'best' or 'worst' case tiebreaking rule that the predictions and labels were sorted by
+            protected_df (pandas.DataFrame) A dataframe with protected group attributes,
+                in the same order as the labels before sorting
+            sorted_labels (dict) of tie_breaker ('best' or 'worst') to a tuple of the
+                positions of the protected_df rows sorted by score with that
+                tiebreaking rule, and the labels in that order
             subset_hash (str) the hash of the subset, if any, that the
                 evaluation is made on
             matrix_type (triage.component.catwalk.storage.MatrixType)
@@ -707,65 +739,54 @@ class ModelEvaluator(object):
         if protected_df.empty:
             return
 
-        # to preprocess aequitas requires the following columns:
-        # score, label value, model_id, protected attributes 
-        # fill out the protected_df, which just has protected attributes at this point
-        protected_df = protected_df.copy()
-        protected_df['model_id'] = model_id
-        protected_df['score'] = predictions_proba
-        protected_df['label_value'] = labels
-        aequitas_df, attr_cols_input = preprocess_input_df(protected_df)
-
-        # create group crosstabs
-        g = Group()
-        score_thresholds = {}
-        score_thresholds['rank_abs'] = self.bias_config['thresholds'].get('top_n', [])
-        # convert 0-100 percentile to 0-1 that Aequitas expects
-        score_thresholds['rank_pct'] = [value / 100.0 for value in self.bias_config['thresholds'].get('percentiles', [])]
-        groups_model, attr_cols = g.get_crosstabs(aequitas_df,
-                                                  score_thresholds=score_thresholds,
-                                                  model_id=model_id,
-                                                  attr_cols=attr_cols_input)
-        # analyze bias from reference groups
-        bias = Bias()
-        ref_groups_method = self.bias_config.get('ref_groups_method', None)
-        if ref_groups_method == 'predefined' and self.bias_config['ref_groups']:
-            bias_df = bias.get_disparity_predefined_groups(groups_model, aequitas_df, self.bias_config['ref_groups'])
-        elif ref_groups_method == 'majority':
-            bias_df = bias.get_disparity_major_group(groups_model, aequitas_df)
-        else:
-            bias_df = bias.get_disparity_min_metric(groups_model, aequitas_df)
-
-        # analyze fairness for each group
-        f = Fairness(tau=0.8) # the default fairness threshold is 0.8
-        group_value_df = f.get_group_value_fairness(bias_df)
-        group_value_df['subset_hash'] = subset_hash
-        group_value_df['tie_breaker'] = tie_breaker
-        group_value_df['evaluation_start_time'] = evaluation_start_time
-        group_value_df['evaluation_end_time'] = evaluation_end_time
-        group_value_df['matrix_uuid'] = matrix_uuid
-        group_value_df = group_value_df.rename(index=str, columns={"score_threshold": "parameter"})
-        if group_value_df.empty:
-            raise ValueError(f"""
-            Bias audit: aequitas_audit() failed.
-            Returned empty dataframe for model_id = {model_id}, and subset_hash = {subset_hash}
-            and matrix_type = {matrix_type}""")
+        thresholds = audit_thresholds(self.bias_config['thresholds'], len(protected_df))
+        audits = []
+        for tie_breaker, (order, labels) in sorted_labels.items():
+            audit = audit_groups(
+                protected_df.iloc[order],
+                labels,
+                thresholds,
+                ref_groups_method=self.bias_config.get('ref_groups_method', None),
+                ref_groups=self.bias_config.get('ref_groups', None),
+            )
+            if audit.empty:
+                raise ValueError(f"""
+                Bias audit failed.
+                Returned empty dataframe for model_id = {model_id}, and subset_hash = {subset_hash}
+                and matrix_type = {matrix_type}""")
+            audit['tie_breaker'] = tie_breaker
+            audits.append(audit)
+        audit = pandas.concat(audits, ignore_index=True)
+        # missing rates and parities are saved as nulls
+        audit = audit.astype(object).where(audit.notnull(), None)
+
+        aequitas_obj = matrix_type.aequitas_obj
         with scoped_session(self.db_engine) as session:
-            for index, row in group_value_df.iterrows():
-                session.query(matrix_type.aequitas_obj).filter_by(
-                    model_id=row['model_id'],
-                    evaluation_start_time=row['evaluation_start_time'],
-                    evaluation_end_time=row['evaluation_end_time'],
-                    subset_hash=row['subset_hash'],
-                    parameter=row['parameter'],
-                    tie_breaker=row['tie_breaker'],
-                    matrix_uuid=row['matrix_uuid'],
-                    attribute_name=row['attribute_name'],
-                    attribute_value=row['attribute_value']
-                ).delete()
-            session.bulk_insert_mappings(matrix_type.aequitas_obj, group_value_df.to_dict(orient="records"))
+            session.query(aequitas_obj).filter(
+                aequitas_obj.model_id == model_id,
+                aequitas_obj.evaluation_start_time == evaluation_start_time,
+                aequitas_obj.evaluation_end_time == evaluation_end_time,
+                aequitas_obj.subset_hash == subset_hash,
+                aequitas_obj.matrix_uuid == matrix_uuid,
+                aequitas_obj.tie_breaker.in_(list(sorted_labels)),
+                aequitas_obj.parameter.in_(audit['parameter'].unique().tolist()),
+                aequitas_obj.attribute_name.in_(audit['attribute_name'].unique().tolist()),
+            ).delete(synchronize_session=False)
+        save_db_objects(
+            self.db_engine,
+            (
+                aequitas_obj(
+                    model_id=model_id,
+                    subset_hash=subset_hash,
+                    evaluation_start_time=evaluation_start_time,
+                    evaluation_end_time=evaluation_end_time,
+                    matrix_uuid=matrix_uuid,
+                    **record
+                )
+                for record in audit.to_dict(orient="records")
+            )
+        )
 
-    @db_retry
     def _write_to_db(
         self,
         model_id,
@@ -779,7 +800,9 @@ class ModelEvaluator(object):
     ):
         """Write evaluation objects to the database
         Binds the model_id as as_of_date to the given ORM objects
-        and writes them to the database
+        and buffers them to be written to the database, replacing any previous
+        evaluations of the model for the same period and subset.
+        The buffer is written once it holds evaluation_buffer_size evaluations.
         Args:
             model_id (int) primary key of the model
             subset_hash (str) the hash of the subset, if any, that the
@@ -795,22 +818,69 @@ class ModelEvaluator(object):
             evaluation_table_obj (schema.TestEvaluation or TrainEvaluation)
                 specifies to which table to add the evaluations
         """
-        with scoped_session(self.db_engine) as session:
-            session.query(evaluation_table_obj).filter_by(
-                model_id=model_id,
-                evaluation_start_time=evaluation_start_time,
-                evaluation_end_time=evaluation_end_time,
-                as_of_date_frequency=as_of_date_frequency,
-                subset_hash=subset_hash
-            ).delete()
-
-            for evaluation in evaluations:
-                evaluation.model_id = model_id
-                evaluation.as_of_date_frequency = as_of_date_frequency
-                evaluation.subset_hash = subset_hash
-                evaluation.evaluation_start_time = evaluation_start_time
-                evaluation.evaluation_end_time = evaluation_end_time
-                evaluation.as_of_date_frequency = as_of_date_frequency
-                evaluation.matrix_uuid = matrix_uuid
-                evaluation.subset_hash = subset_hash
-                session.add(evaluation)
+        for evaluation in evaluations:
+            evaluation.model_id = model_id
+            evaluation.as_of_date_frequency = as_of_date_frequency
+            evaluation.subset_hash = subset_hash
+            evaluation.evaluation_start_time = evaluation_start_time
+            evaluation.evaluation_end_time = evaluation_end_time
+            evaluation.matrix_uuid = matrix_uuid
+        key = (
+            evaluation_table_obj,
+            (model_id, subset_hash, evaluation_start_time, evaluation_end_time, as_of_date_frequency),
+        )
+        # a later evaluation of the same model, period and subset replaces an earlier one
+        self._buffered_evaluations.pop(key, None)
+        self._buffered_evaluations[key] = evaluations
+        num_buffered = sum(len(buffered) for buffered in self._buffered_evaluations.values())
+        if num_buffered >= self.evaluation_buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered evaluations to the database
+
+        For each evaluation table, the evaluations being replaced are deleted, and the
+        buffered ones are saved with one COPY, in one transaction.
+        """
+        if not self._buffered_evaluations:
+            return
+        evaluations_by_table = OrderedDict()
+        for (evaluation_table_obj, key), evaluations in self._buffered_evaluations.items():
+            evaluations_by_table.setdefault(evaluation_table_obj, OrderedDict())[key] = evaluations
+        for evaluation_table_obj, keyed_evaluations in evaluations_by_table.items():
+            self._save_evaluations(evaluation_table_obj, keyed_evaluations)
+        self._buffered_evaluations = OrderedDict()
+
+    @db_retry
+    def _save_evaluations(self, evaluation_table_obj, keyed_evaluations):
+        """Replace evaluations in one of the evaluation tables
+
+        Args:
+            evaluation_table_obj (schema.TestEvaluation or TrainEvaluation)
+                specifies to which table to add the evaluations
+            keyed_evaluations (dict) of (model_id, subset_hash, evaluation_start_time,
+                evaluation_end_time, as_of_date_frequency) to the list of evaluation
+                objects replacing those in the table with those values
+        """
+        table = evaluation_table_obj.__table__
+        with self.db_engine.begin() as conn:
+            conn.execute(
+                table.delete().where(
+                    tuple_(
+                        table.c.model_id,
+                        table.c.subset_hash,
+                        table.c.evaluation_start_time,
+                        table.c.evaluation_end_time,
+                        table.c.as_of_date_frequency,
+                    ).in_(list(keyed_evaluations))
+                )
+            )
+            evaluations = list(itertools.chain.from_iterable(keyed_evaluations.values()))
+            if evaluations:
+                copy_db_objects(conn.connection, evaluations)
+        logging.info(
+            "Saved %s evaluations of %s models, periods and subsets to %s",
+            len(evaluations),
+            len(keyed_evaluations),
+            table.fullname,
+        )
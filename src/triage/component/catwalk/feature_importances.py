@@ -3,7 +3,10 @@ import warnings
 import numpy as np
 import sklearn.linear_model
 from sklearn.svm import SVC
-from triage.component.catwalk.estimators.classifiers import ScaledLogisticRegression
+from triage.component.catwalk.estimators.classifiers import (
+    ChunkedScaledLogisticRegression,
+    ScaledLogisticRegression,
+)
 
 
 def _ad_hoc_feature_importances(model):
@@ -24,7 +27,7 @@ def _ad_hoc_feature_importances(model):
     feature_importances = None
 
     if (isinstance(model, (sklearn.linear_model.logistic.LogisticRegression)) or 
-        isinstance(model, (ScaledLogisticRegression))):
+        isinstance(model, (ScaledLogisticRegression, ChunkedScaledLogisticRegression))):
         coef_odds_ratio = np.exp(model.coef_)
         # intercept_odds_ratio = np.exp(model.intercept_[:,np.newaxis])
         # We are ignoring the intercept
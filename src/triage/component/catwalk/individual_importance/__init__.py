@@ -3,10 +3,25 @@ import logging
 from triage.component.catwalk.utils import save_db_objects
 from triage.component.results_schema import IndividualImportance
 
-from .uniform import uniform_distribution
+from .tree_contributions import tree_contributions, tree_contributions_all_dates
+from .uniform import uniform_distribution, uniform_distribution_all_dates
 
 
-CALCULATE_STRATEGIES = {"uniform": uniform_distribution}
+CALCULATE_STRATEGIES = {
+    "uniform": uniform_distribution,
+    "tree_contributions": tree_contributions,
+}
+
+# Methods that can calculate importances for all as-of-dates of a matrix in one pass.
+# Methods missing here are called once per as-of-date from CALCULATE_STRATEGIES
+CALCULATE_ALL_DATES_STRATEGIES = {
+    "uniform": uniform_distribution_all_dates,
+    "tree_contributions": tree_contributions_all_dates,
+}
+
+# Methods that load the model itself, and so are also passed the model storage engine
+# and the number of threads to use
+MODEL_STRATEGIES = {"tree_contributions"}
 
 
 class IndividualImportanceCalculator(object):
@@ -19,13 +34,35 @@ class IndividualImportanceCalculator(object):
             present in CALCULATE_STRATEGIES that should be called.
             Defaults to ['uniform']
         replace (bool) Whether to replace old records or reuse them.
+        model_storage_engine (catwalk.storage.ModelStorageEngine, optional) The storage
+            of the models, needed by methods in MODEL_STRATEGIES
+        n_jobs (int) The number of threads methods in MODEL_STRATEGIES may use. Defaults to 1
     """
 
-    def __init__(self, db_engine, n_ranks=5, methods=["uniform"], replace=True):
+    def __init__(
+        self,
+        db_engine,
+        n_ranks=5,
+        methods=["uniform"],
+        replace=True,
+        model_storage_engine=None,
+        n_jobs=1,
+    ):
         self.db_engine = db_engine
         self.n_ranks = n_ranks
         self.methods = methods
         self.replace = replace
+        self.model_storage_engine = model_storage_engine
+        self.n_jobs = n_jobs
+
+    def _strategy_kwargs(self, method):
+        if method not in MODEL_STRATEGIES:
+            return {}
+        if self.model_storage_engine is None:
+            raise ValueError(
+                f"Individual importance method {method} needs a model storage engine"
+            )
+        return {"model_storage_engine": self.model_storage_engine, "n_jobs": self.n_jobs}
 
     def _num_existing_importances(self, model_id, as_of_date, method):
         return [
@@ -77,13 +114,57 @@ class IndividualImportanceCalculator(object):
     def calculate_and_save_all_methods_and_dates(self, model_id, test_matrix_store):
         """Calculate and save individual importances for the given model and test matrix
 
+        The importances for every method and as-of-date are saved with a single COPY
+
         Args:
             model_id (int) A model id, expected to be present in test_results.models
             test_matrix_store (catwalk.storage.MatrixStore) The test matrix
         """
+        records_by_method = {}
         for method in self.methods:
-            for as_of_date in test_matrix_store.as_of_dates:
-                self.calculate_and_save(model_id, test_matrix_store, method, as_of_date)
+            as_of_dates = [
+                as_of_date
+                for as_of_date in test_matrix_store.as_of_dates
+                if self._should_calculate(model_id, test_matrix_store, method, as_of_date)
+            ]
+            if not as_of_dates:
+                continue
+            if method in CALCULATE_ALL_DATES_STRATEGIES:
+                records_by_method[method] = CALCULATE_ALL_DATES_STRATEGIES[method](
+                    self.db_engine,
+                    model_id,
+                    as_of_dates,
+                    test_matrix_store,
+                    self.n_ranks,
+                    **self._strategy_kwargs(method),
+                )
+            else:
+                records_by_method[method] = {
+                    as_of_date: CALCULATE_STRATEGIES[method](
+                        self.db_engine,
+                        model_id,
+                        as_of_date,
+                        test_matrix_store,
+                        self.n_ranks,
+                        **self._strategy_kwargs(method),
+                    )
+                    for as_of_date in as_of_dates
+                }
+        self.save_all(records_by_method, model_id)
+
+    def _should_calculate(self, model_id, test_matrix_store, method, as_of_date):
+        if not self.replace and not self._needs_new_importances(
+            model_id, as_of_date, method, test_matrix_store
+        ):
+            logging.info(
+                "Found as many or more individual importances "
+                + "for model_id=%s/as_of_date=%s/method=%s, skipping",
+                model_id,
+                as_of_date,
+                method,
+            )
+            return False
+        return True
 
     def calculate_and_save(self, model_id, test_matrix_store, method, as_of_date):
         """Calculate and save importances for a given model, test matrix, method, and date
@@ -95,19 +176,14 @@ class IndividualImportanceCalculator(object):
                 Expected to be present in CALCULATE_STRATEGIES
             as_of_date (datetime or string) The date to produce individual importances as of
         """
-        if not self.replace and not self._needs_new_importances(
-            model_id, as_of_date, method, test_matrix_store
-        ):
-            logging.info(
-                "Found as many or more individual importances "
-                + "for model_id=%s/as_of_date=%s/method=%s, skipping",
+        if self._should_calculate(model_id, test_matrix_store, method, as_of_date):
+            importance_records = CALCULATE_STRATEGIES[method](
+                self.db_engine,
                 model_id,
                 as_of_date,
-                method,
-            )
-        else:
-            importance_records = CALCULATE_STRATEGIES[method](
-                self.db_engine, model_id, as_of_date, test_matrix_store, self.n_ranks
+                test_matrix_store,
+                self.n_ranks,
+                **self._strategy_kwargs(method),
             )
             self.save(
                 importance_records=importance_records,
@@ -130,15 +206,28 @@ class IndividualImportanceCalculator(object):
             method_name (string) The name of the method that produced the importance records
 
         """
-        self.db_engine.execute(
-            """delete from test_results.individual_importances
-            where model_id = %s
-            and as_of_date = %s
-            and method = %s""",
-            model_id,
-            as_of_date,
-            method_name,
-        )
+        self.save_all({method_name: {as_of_date: importance_records}}, model_id)
+
+    def save_all(self, records_by_method, model_id):
+        """Saves computed individual feature importance records for several methods and
+        as-of-dates of a model to the database with one COPY.
+        Will delete any records beforehand matching the model_id and each method and as_of_date
+
+        Args:
+            records_by_method (dict) of method name to a dict of as_of_date to a list of
+                individual importances, as passed to save()
+            model_id (int) A model id, expected to be present in test_results.models
+        """
+        for method_name, records_by_date in records_by_method.items():
+            self.db_engine.execute(
+                """delete from test_results.individual_importances
+                where model_id = %s
+                and as_of_date = any(%s)
+                and method = %s""",
+                model_id,
+                list(records_by_date.keys()),
+                method_name,
+            )
         record_stream = (
             IndividualImportance(
                 model_id=int(model_id),
@@ -149,6 +238,13 @@ class IndividualImportanceCalculator(object):
                 method=method_name,
                 importance_score=float(importance_record["score"]),
             )
+            for method_name, records_by_date in records_by_method.items()
+            for as_of_date, importance_records in records_by_date.items()
             for importance_record in importance_records
         )
-        save_db_objects(self.db_engine, record_stream)
+        if any(
+            importance_records
+            for records_by_date in records_by_method.values()
+            for importance_records in records_by_date.values()
+        ):
+            save_db_objects(self.db_engine, record_stream)
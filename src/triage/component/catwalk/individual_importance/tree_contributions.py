@@ -0,0 +1,241 @@
+import logging
+
+import numpy
+from scipy import sparse
+from sklearn.ensemble.forest import BaseForest
+from sklearn.ensemble.gradient_boosting import BaseGradientBoosting
+from sklearn.externals import joblib
+from sklearn.tree.tree import BaseDecisionTree
+
+from triage.component.catwalk.utils import retrieve_model_hash_from_id
+
+from .uniform import _rows_by_as_of_date
+
+
+# Rows of the test matrix whose decision paths are traversed together.
+# Bounds the memory of the dense contribution array built for each batch
+DEFAULT_BATCH_SIZE = 10000
+
+
+def _positive_class_index(model):
+    classes = list(getattr(model, "classes_", []))
+    if 1 in classes:
+        return classes.index(1)
+    return None
+
+
+def _weighted_trees(model):
+    """The fitted trees of a tree-based model, along with how their predictions combine
+
+    Args:
+        model A fitted sklearn decision tree, forest, or gradient boosting model
+
+    Returns: (tuple) of a list of (tree, weight) tuples and whether the tree node values
+        are class counts to normalize into probabilities, or None if the model is not
+        a supported tree-based model
+    """
+    if isinstance(model, BaseDecisionTree):
+        return [(model, 1.0)], hasattr(model, "classes_")
+    if isinstance(model, BaseForest):
+        trees = list(model.estimators_)
+        return [(tree, 1.0 / len(trees)) for tree in trees], hasattr(model, "classes_")
+    if isinstance(model, BaseGradientBoosting):
+        estimators = numpy.asarray(model.estimators_)
+        if estimators.shape[1] != 1:
+            return None
+        # boosted trees are regressors on the gradient, each scaled by the learning rate
+        return [(tree, model.learning_rate) for tree in estimators[:, 0]], False
+    return None
+
+
+def _node_values(tree, normalize, positive_index):
+    """The value that each node of a tree predicts for the positive class
+
+    Args:
+        tree A fitted sklearn decision tree
+        normalize (bool) Whether the node values are class counts
+        positive_index (int) The column of the positive class in the node values
+
+    Returns: (numpy.ndarray) one value for each node
+    """
+    values = tree.tree_.value[:, 0, :]
+    if not normalize:
+        return values[:, 0]
+    if positive_index is None:
+        return numpy.zeros(values.shape[0])
+    return values[:, positive_index] / values.sum(axis=1)
+
+
+def _contribution_matrix(tree, weight, normalize, positive_index, n_features):
+    """A sparse matrix of the change in predicted value along each edge of a tree
+
+    Row i holds, in the column of the feature its parent splits on, the difference between
+    the values of node i and its parent. Multiplying a decision path indicator matrix by it
+    sums the contributions of each feature along each path.
+
+    Returns: (scipy.sparse.csr_matrix) of shape (number of nodes, n_features)
+    """
+    node_values = _node_values(tree, normalize, positive_index) * weight
+    tree_ = tree.tree_
+    parents = numpy.flatnonzero(tree_.children_left != -1)
+    children = numpy.concatenate(
+        [tree_.children_left[parents], tree_.children_right[parents]]
+    )
+    parents = numpy.concatenate([parents, parents])
+    return sparse.csr_matrix(
+        (
+            node_values[children] - node_values[parents],
+            (children, tree_.feature[parents]),
+        ),
+        shape=(tree_.node_count, n_features),
+    )
+
+
+def _batch_contributions(trees, contributions, features):
+    """Sums the feature contributions along the decision paths of a batch of rows
+
+    Args:
+        trees (list) The fitted trees of the model
+        contributions (scipy.sparse.csr_matrix) The stacked contribution matrices of the trees
+        features (numpy.ndarray) The feature values of the rows, as float32
+
+    Returns: (numpy.ndarray) of shape (number of rows, number of features)
+    """
+    paths = sparse.hstack(
+        [tree.tree_.decision_path(features) for tree in trees], format="csr"
+    )
+    return (paths * contributions).toarray()
+
+
+def tree_contributions_all_dates(
+    db_engine,
+    model_id,
+    as_of_dates,
+    test_matrix_store,
+    n_ranks,
+    model_storage_engine,
+    n_jobs=1,
+    batch_size=DEFAULT_BATCH_SIZE,
+):
+    """Calculates individual feature importances of a tree-based model from the
+    contribution of each feature along the decision path of each entity
+
+    The prediction of a tree is the value of its root node plus the change in value
+    at each split along the path to a leaf; each change is attributed to the feature
+    that was split on. Contributions are averaged over the trees of a forest, and summed
+    over the trees of a gradient boosting model, scaled by the learning rate, so those
+    contributions are in log-odds rather than probability.
+    The features with the largest absolute contributions are kept for each entity.
+
+    Paths are traversed for batches of rows at once, and batches are spread over threads.
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        model_id (int) A model id, expected to be present in model_metadata.models
+        as_of_dates (list of datetime.date) The dates to produce individual importances as of
+        test_matrix_store (catwalk.storage.MatrixStore) The test matrix
+        n_ranks (int) Number of ranks to calculate and save. Defaults to 5
+        model_storage_engine (catwalk.storage.ModelStorageEngine) The storage of the model
+        n_jobs (int) The number of threads to traverse batches of rows with
+        batch_size (int) The number of rows to traverse at once
+
+    Returns: (dict) of as_of_date to a list of dicts with entity_id, feature_value,
+        feature_name, score
+    """
+    model = model_storage_engine.load(retrieve_model_hash_from_id(db_engine, model_id))
+    weighted_trees = _weighted_trees(model)
+    if weighted_trees is None:
+        logging.warning(
+            "Model %s is a %s, which is not a supported tree-based model. "
+            "Not calculating tree contribution individual importances",
+            model_id,
+            type(model).__name__,
+        )
+        return {as_of_date: [] for as_of_date in as_of_dates}
+
+    matrix = test_matrix_store.design_matrix
+    feature_names = numpy.asarray(matrix.columns)
+    trees_and_weights, normalize = weighted_trees
+    positive_index = _positive_class_index(model)
+    trees = [tree for tree, _ in trees_and_weights]
+    contributions = sparse.vstack(
+        [
+            _contribution_matrix(tree, weight, normalize, positive_index, len(feature_names))
+            for tree, weight in trees_and_weights
+        ],
+        format="csr",
+    )
+
+    entity_ids = matrix.index.get_level_values("entity_id")
+    feature_values = matrix.values
+    n_ranks = min(n_ranks, len(feature_names))
+
+    results = {}
+    for as_of_date, positions in _rows_by_as_of_date(matrix, as_of_dates).items():
+        batches = [
+            positions[start:start + batch_size]
+            for start in range(0, len(positions), batch_size)
+        ]
+        batch_contributions = joblib.Parallel(n_jobs=n_jobs, prefer="threads")(
+            joblib.delayed(_batch_contributions)(
+                trees,
+                contributions,
+                numpy.ascontiguousarray(feature_values[batch], dtype=numpy.float32),
+            )
+            for batch in batches
+        )
+        results[as_of_date] = []
+        for batch, entity_contributions in zip(batches, batch_contributions):
+            top_features = numpy.argsort(
+                -numpy.abs(entity_contributions), axis=1, kind="mergesort"
+            )[:, :n_ranks]
+            rows = numpy.arange(len(batch))[:, numpy.newaxis]
+            results[as_of_date].extend(
+                {
+                    "entity_id": entity_id,
+                    "feature_value": feature_value,
+                    "feature_name": feature_name,
+                    "score": score,
+                }
+                for entity_id, feature_name, feature_value, score in zip(
+                    numpy.repeat(entity_ids[batch].values, n_ranks).tolist(),
+                    feature_names[top_features].ravel().tolist(),
+                    feature_values[batch][rows, top_features].ravel().tolist(),
+                    entity_contributions[rows, top_features].ravel().tolist(),
+                )
+            )
+    return results
+
+
+def tree_contributions(
+    db_engine,
+    model_id,
+    as_of_date,
+    test_matrix_store,
+    n_ranks,
+    model_storage_engine,
+    n_jobs=1,
+):
+    """Calculates individual feature importances of a tree-based model from the
+    contribution of each feature along the decision path of each entity
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        model_id (int) A model id, expected to be present in model_metadata.models
+        as_of_date (datetime.date) The date to produce individual importances as of
+        test_matrix_store (catwalk.storage.MatrixStore) The test matrix
+        n_ranks (int) Number of ranks to calculate and save. Defaults to 5
+        model_storage_engine (catwalk.storage.ModelStorageEngine) The storage of the model
+        n_jobs (int) The number of threads to traverse batches of rows with
+
+    Returns: (list) dicts with entity_id, feature_value, feature_name, score
+    """
+    return tree_contributions_all_dates(
+        db_engine,
+        model_id,
+        [as_of_date],
+        test_matrix_store,
+        n_ranks,
+        model_storage_engine,
+        n_jobs,
+    )[as_of_date]
@@ -1,6 +1,43 @@
+import datetime
+
+import numpy
+import pandas
+
 from triage.component.catwalk.model_trainers import NO_FEATURE_IMPORTANCE
 
 
+def _check_as_of_date_type(as_of_date):
+    if type(as_of_date) != datetime.date:
+        raise TypeError("Types of date in matrix and input must match, "
+                        f"Matrix was {datetime.date}",
+                        f"Input was {type(as_of_date)}")
+
+
+def _rows_by_as_of_date(matrix, as_of_dates):
+    """Finds the positions of the matrix rows for each of the given as-of-dates
+
+    The dates in the matrix index are truncated to the day and grouped once,
+    so each as-of-date can be looked up without scanning the whole matrix.
+
+    Args:
+        matrix (pandas.DataFrame), with index 'entity_id'/'as_of_date'
+        as_of_dates (list of datetime.date) as-of-dates in the matrix
+
+    Returns: (dict) of as_of_date to a numpy array of row positions, in matrix order
+    """
+    for as_of_date in as_of_dates:
+        _check_as_of_date_type(as_of_date)
+    index_dates = pandas.DatetimeIndex(
+        matrix.index.get_level_values("as_of_date")
+    ).normalize()
+    positions = matrix.groupby(index_dates, sort=False).indices
+    empty = numpy.array([], dtype=int)
+    return {
+        as_of_date: positions.get(pandas.Timestamp(as_of_date), empty)
+        for as_of_date in as_of_dates
+    }
+
+
 def _entity_feature_values(matrix, feature_name, as_of_date):
     """Finds the value of the given feature for each entity in a matrix
 
@@ -11,38 +48,25 @@ def _entity_feature_values(matrix, feature_name, as_of_date):
 
     Returns: (list) of (entity_id, feature_value) tuples
     """
-    results = []
-    index_of_entity = matrix.index.names.index("entity_id")
-    index_of_date = matrix.index.names.index("as_of_date")
-    if feature_name == NO_FEATURE_IMPORTANCE:
-        zipped_iter = zip(matrix.index.values, [None] * len(matrix.index.values))
-    else:
-        zipped_iter = zip(matrix.index.values, matrix[feature_name].tolist())
-    for row in zipped_iter:
-        index_values, feature_value = row
-        entity_id = index_values[index_of_entity]
-        if type(index_values[index_of_date].date()) != type(as_of_date):
-            raise TypeError("Types of date in matrix and input must match, "
-                            f"Matrix was {type(index_values[index_of_date].date())}",
-                            f"Input was {type(as_of_date)}")
-        if index_values[index_of_date].date() == as_of_date:
-            results.append((entity_id, feature_value))
-    return results
+    positions = _rows_by_as_of_date(matrix, [as_of_date])[as_of_date]
+    return list(zip(*_entity_ids_and_values(matrix, feature_name, positions)))
 
 
-def uniform_distribution(db_engine, model_id, as_of_date, test_matrix_store, n_ranks):
-    """Calculates individual feature importances based on the global feature importances
+def _entity_ids_and_values(matrix, feature_name, positions):
+    """The entity ids and values of a feature at the given row positions of a matrix
 
-    Args:
-        db_engine (sqlalchemy.engine)
-        model_id (int) A model id, expected to be present in model_metadata.models
-        as_of_date (datetime.date) The date to produce individual importances as of
-        test_matrix_store (catwalk.storage.MatrixStore) The test matrix
-        n_ranks (int) Number of ranks to calculate and save. Defaults to 5
-
-    Returns: (list) dicts with entity_id, feature_value, feature_name, score
+    Returns: (tuple) of the entity id list and the feature value list
     """
-    global_feature_importances = [
+    entity_ids = matrix.index.get_level_values("entity_id")[positions].tolist()
+    if feature_name == NO_FEATURE_IMPORTANCE:
+        feature_values = [None] * len(positions)
+    else:
+        feature_values = matrix[feature_name].values[positions].tolist()
+    return entity_ids, feature_values
+
+
+def _top_feature_importances(db_engine, model_id, n_ranks):
+    return [
         row
         for row in db_engine.execute(
             """select feature, feature_importance
@@ -53,17 +77,59 @@ def uniform_distribution(db_engine, model_id, as_of_date, test_matrix_store, n_r
         )
     ]
 
-    results = []
 
-    for feature_name, feature_importance in global_feature_importances:
-        efv = _entity_feature_values(test_matrix_store.design_matrix, feature_name, as_of_date)
-        for entity_id, feature_value in efv:
-            results.append(
+def uniform_distribution_all_dates(db_engine, model_id, as_of_dates, test_matrix_store, n_ranks):
+    """Calculates individual feature importances based on the global feature importances
+    for several as-of-dates at once
+
+    The global feature importances are read and the matrix rows grouped by as-of-date
+    only once, instead of once per date.
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        model_id (int) A model id, expected to be present in model_metadata.models
+        as_of_dates (list of datetime.date) The dates to produce individual importances as of
+        test_matrix_store (catwalk.storage.MatrixStore) The test matrix
+        n_ranks (int) Number of ranks to calculate and save. Defaults to 5
+
+    Returns: (dict) of as_of_date to a list of dicts with entity_id, feature_value,
+        feature_name, score
+    """
+    global_feature_importances = _top_feature_importances(db_engine, model_id, n_ranks)
+    matrix = test_matrix_store.design_matrix
+    rows_by_date = _rows_by_as_of_date(matrix, as_of_dates)
+
+    results = {}
+    for as_of_date, positions in rows_by_date.items():
+        results[as_of_date] = []
+        for feature_name, feature_importance in global_feature_importances:
+            entity_ids, feature_values = _entity_ids_and_values(
+                matrix, feature_name, positions
+            )
+            results[as_of_date].extend(
                 {
                     "entity_id": entity_id,
                     "feature_value": feature_value,
                     "feature_name": feature_name,
                     "score": feature_importance,
                 }
+                for entity_id, feature_value in zip(entity_ids, feature_values)
             )
     return results
+
+
+def uniform_distribution(db_engine, model_id, as_of_date, test_matrix_store, n_ranks):
+    """Calculates individual feature importances based on the global feature importances
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        model_id (int) A model id, expected to be present in model_metadata.models
+        as_of_date (datetime.date) The date to produce individual importances as of
+        test_matrix_store (catwalk.storage.MatrixStore) The test matrix
+        n_ranks (int) Number of ranks to calculate and save. Defaults to 5
+
+    Returns: (list) dicts with entity_id, feature_value, feature_name, score
+    """
+    return uniform_distribution_all_dates(
+        db_engine, model_id, [as_of_date], test_matrix_store, n_ranks
+    )[as_of_date]
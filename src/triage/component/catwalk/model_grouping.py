@@ -24,10 +24,14 @@ class ModelGrouper(object):
         model_group_keys (list) A list of matrix metadata keys to uniquely define a model group.'
             In addition, the non-matrix attributes 'class_path' and 'parameters', referring to
             classifier training arguments, can be sent.
+
+    The model group id of each set of grouping arguments is remembered, so models in the
+    same group only query the database for it once.
     """
 
     def __init__(self, model_group_keys=()):
         self.model_group_keys = frozenset(model_group_keys)
+        self._model_group_ids = {}
 
     def _final_model_group_args(self, class_path, parameters, matrix_metadata):
         """Generates model grouping arguments based on input.
@@ -114,6 +118,9 @@ class ModelGrouper(object):
         model_group_args = self._final_model_group_args(
             class_path, parameters, matrix_metadata
         )
+        cache_key = (str(db_engine.url), json.dumps(model_group_args, sort_keys=True))
+        if cache_key in self._model_group_ids:
+            return self._model_group_ids[cache_key]
         db_conn = db_engine.raw_connection()
         cur = db_conn.cursor()
         cur.execute(
@@ -151,4 +158,6 @@ class ModelGrouper(object):
         db_conn.close()
 
         logging.debug("Model_group_id = {}".format(model_group_id))
+        if model_group_id is not None:
+            self._model_group_ids[cache_key] = model_group_id
         return model_group_id
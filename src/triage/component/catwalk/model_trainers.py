@@ -1,20 +1,24 @@
 import copy
 import datetime
 import importlib
+import inspect
+import json
 import logging
 import random
-import sys
+import time
+from collections import defaultdict
 from contextlib import contextmanager
 
 import numpy as np
 import pandas
 from sklearn.model_selection import ParameterGrid
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import sessionmaker
 
 from triage.util.random import generate_python_random_seed
 from triage.component.results_schema import Model, FeatureImportance
 from triage.component.catwalk.exceptions import BaselineFeatureNotInMatrix
-from triage.tracking import built_model, skipped_model, errored_model
+from triage.tracking import BufferedIncrements
 
 from .model_grouping import ModelGrouper
 from .feature_importances import get_feature_importances
@@ -22,13 +26,24 @@ from .utils import (
     filename_friendly_hash,
     retrieve_model_id_from_hash,
     db_retry,
-    save_db_objects,
+    copy_db_objects,
 )
 
 NO_FEATURE_IMPORTANCE = (
     "Algorithm does not support a standard way" + " to calculate feature importance."
 )
 
+# Estimators that can grow a fitted model along one parameter with warm_start, giving
+# the same model as fitting from scratch with the larger value (as long as random_state
+# is set; forests draw the seeds of the new trees after those of the existing ones)
+WARM_STARTABLE_PARAMETERS = {
+    "sklearn.ensemble.RandomForestClassifier": "n_estimators",
+    "sklearn.ensemble.ExtraTreesClassifier": "n_estimators",
+}
+
+# Triage labels are binary; estimators trained in chunks need to know every label up front
+BINARY_CLASSES = np.array([0, 1])
+
 
 def flatten_grid_config(grid_config):
     """Flattens a model/parameter grid configuration into individually
@@ -50,6 +65,11 @@ class ModelTrainer(object):
         model_storage_engine (catwalk.storage.ModelStorageEngine)
         db_engine (sqlalchemy.engine)
         replace (bool) whether or not to replace existing versions of models
+        run_id (int, optional) the experiment run to count built, skipped and errored
+            models in. The counts are saved in batches; call flush to save the rest
+        out_of_core_chunk_size (int, optional) If given, estimators that implement
+            partial_fit are trained on the train matrix this many rows at a time,
+            as it is read from storage, instead of on the whole matrix in memory
     """
 
     def __init__(
@@ -60,6 +80,7 @@ class ModelTrainer(object):
         model_grouper=None,
         replace=True,
         run_id=None,
+        out_of_core_chunk_size=None,
     ):
         self.experiment_hash = experiment_hash
         self.model_storage_engine = model_storage_engine
@@ -67,11 +88,22 @@ class ModelTrainer(object):
         self.db_engine = db_engine
         self.replace = replace
         self.run_id = run_id
+        self.out_of_core_chunk_size = out_of_core_chunk_size
+        self.run_increments = BufferedIncrements(run_id, db_engine) if run_id else None
 
     @property
     def sessionmaker(self):
         return sessionmaker(bind=self.db_engine)
 
+    def _track(self, field):
+        if self.run_increments:
+            self.run_increments.increment(field)
+
+    def flush(self):
+        """Saves the run tracking counts of the models processed so far"""
+        if self.run_increments:
+            self.run_increments.flush()
+
     def unique_parameters(self, parameters):
         return {key: parameters[key] for key in parameters.keys() if key != "n_jobs"}
 
@@ -99,66 +131,181 @@ class ModelTrainer(object):
         logging.info("Creating model hash from unique data %s", unique)
         return filename_friendly_hash(unique)
 
-    def _train(self, matrix_store, class_path, parameters):
+    def _train(self, matrix_store, class_path, parameters, warm_start_model=None):
         """Fit a model to a training set. Works on any modeling class that
         is available in this package's environment and implements .fit
 
         Args:
             class_path (string) A full classpath to the model class
             parameters (dict) hyperparameters to give to the model constructor
+            warm_start_model (object, optional) A fitted model of the same class,
+                with parameters that only differ in a smaller value of its
+                warm-startable parameter, to grow into the requested model
+                instead of fitting from scratch
 
         Returns:
             tuple of (fitted model, list of column names without label)
         """
+        if warm_start_model is not None:
+            warm_start_model.set_params(**parameters)
+            warm_start_model.set_params(warm_start=True)
+            warm_start_model.fit(
+                matrix_store.design_matrix,
+                matrix_store.labels,
+                **self._fit_kwargs(warm_start_model, matrix_store)
+            )
+            # so the stored model's parameters are the same as if it were fit from scratch
+            warm_start_model.set_params(warm_start=parameters.get("warm_start", False))
+            return warm_start_model
+
         module_name, class_name = class_path.rsplit(".", 1)
         module = importlib.import_module(module_name)
         cls = getattr(module, class_name)
         instance = cls(**parameters)
 
-        return instance.fit(matrix_store.design_matrix, matrix_store.labels)
+        if self.out_of_core_chunk_size:
+            if hasattr(instance, "partial_fit"):
+                return self._train_out_of_core(instance, matrix_store)
+            logging.warning(
+                "%s does not implement partial_fit, so it will be trained on the whole "
+                "train matrix in memory",
+                class_name,
+            )
 
-    @db_retry
-    def _save_feature_importances(self, model_id, feature_importances, feature_names):
-        """Saves feature importances to the database.
+        return instance.fit(
+            matrix_store.design_matrix,
+            matrix_store.labels,
+            **self._fit_kwargs(instance, matrix_store)
+        )
+
+    def _train_out_of_core(self, instance, matrix_store):
+        """Fit a model to a train matrix read from storage in chunks of rows, so only
+        one chunk is in memory at a time
+
+        Estimators with a fit_chunks method (e.g. ChunkedScaledLogisticRegression) are
+        given the chunks to make as many passes over them as they need; other estimators
+        are fit with partial_fit, in one pass over the chunks.
+
+        Args:
+            instance (object) An unfitted model that implements partial_fit
+            matrix_store (catwalk.storage.MatrixStore) The train matrix
+
+        Returns: (object) the fitted model
+        """
+        negative_sample_rate = self._negative_sample_rate(instance.partial_fit, matrix_store)
+
+        def chunks():
+            for design_matrix, labels in matrix_store.matrix_label_chunks(
+                self.out_of_core_chunk_size
+            ):
+                yield design_matrix, labels, self._sample_weight(labels, negative_sample_rate)
+
+        logging.info(
+            "Training %s out of core, %s rows at a time",
+            instance.__class__.__name__,
+            self.out_of_core_chunk_size,
+        )
+        if hasattr(instance, "fit_chunks"):
+            return instance.fit_chunks(chunks, classes=BINARY_CLASSES)
+
+        partial_fit_kwargs = {}
+        if "classes" in inspect.signature(instance.partial_fit).parameters:
+            partial_fit_kwargs["classes"] = BINARY_CLASSES
+        for design_matrix, labels, sample_weight in chunks():
+            if sample_weight is not None:
+                partial_fit_kwargs["sample_weight"] = sample_weight
+            instance.partial_fit(design_matrix, labels, **partial_fit_kwargs)
+        return instance
+
+    def _fit_kwargs(self, instance, matrix_store):
+        """Extra keyword arguments for fitting a model to a matrix
+
+        Args:
+            instance (object) An unfitted model
+            matrix_store (catwalk.storage.MatrixStore) The train matrix
+
+        Returns: (dict) keyword arguments to pass to the model's fit method
+        """
+        sample_weight = self._sample_weight(
+            matrix_store.labels, self._negative_sample_rate(instance.fit, matrix_store)
+        )
+        if sample_weight is None:
+            return {}
+        return {"sample_weight": sample_weight}
+
+    def _negative_sample_rate(self, fit_method, matrix_store):
+        """The rate the negative rows of a train matrix were downsampled at, if the model
+        should be weighted to correct for it
+
+        If the negative rows of the train matrix were downsampled, each negative row
+        is weighted by the inverse of the sample rate, so the model sees the classes in
+        their original proportions. Only estimators whose fit method takes a
+        sample_weight argument can be given these weights; others are trained on the
+        downsampled matrix as it is.
+
+        Args:
+            fit_method (callable) The method the model will be fit with
+            matrix_store (catwalk.storage.MatrixStore) The train matrix
+
+        Returns: (float) the sample rate, or None if no weights are needed
+        """
+        negative_sample_rate = matrix_store.metadata.get("negative_sample_rate")
+        if not negative_sample_rate or negative_sample_rate >= 1:
+            return None
+        if "sample_weight" not in inspect.signature(fit_method).parameters:
+            logging.warning(
+                "%s does not take sample weights, so it will be trained on a train matrix "
+                "with downsampled negative labels without correcting for them",
+                fit_method.__self__.__class__.__name__,
+            )
+            return None
+        return negative_sample_rate
+
+    @staticmethod
+    def _sample_weight(labels, negative_sample_rate):
+        if negative_sample_rate is None:
+            return None
+        return np.where(labels == 0, 1.0 / negative_sample_rate, 1.0)
+
+    def _warm_start_model(self, warm_start_model_hashes):
+        """Load the first of the given models that has already been stored
+
+        Args:
+            warm_start_model_hashes (list) model hashes to look for, in order of preference
+
+        Returns: (object) a copy of the first stored model, or None if none are stored
+        """
+        for warm_start_model_hash in warm_start_model_hashes:
+            if not self.model_storage_engine.exists(warm_start_model_hash):
+                continue
+            try:
+                # a copy, since the cached model may be used to predict elsewhere
+                model = copy.deepcopy(self.model_storage_engine.load(warm_start_model_hash))
+            except Exception:
+                logging.warning(
+                    "Could not load model %s to warm-start from", warm_start_model_hash
+                )
+                continue
+            logging.info("Warm-starting from stored model %s", warm_start_model_hash)
+            return model
+        return None
 
-        Deletes any existing feature importances for the given model_id.
+    @staticmethod
+    def _feature_importance_objects(model_id, feature_importances, feature_names):
+        """Ranks feature importances, as rows of the feature importances table
 
         Args:
             model_id (int) The database id for the model
             feature_importances (numpy.ndarray, maybe). Calculated feature importances
                 for the model
             feature_names (list) Feature names for the corresponding entries in feature_importances
+
+        Returns: (list) of results_schema.FeatureImportance objects
         """
-        self.db_engine.execute(
-            "delete from train_results.feature_importances where model_id = %s",
-            model_id,
-        )
-        db_objects = []
-        if isinstance(feature_importances, np.ndarray):
-            temp_df = pandas.DataFrame({"feature_importance": feature_importances})
-            features_index = temp_df.index.tolist()
-            rankings_abs = temp_df["feature_importance"].rank(
-                method="dense", ascending=False
-            )
-            rankings_pct = temp_df["feature_importance"].rank(
-                method="dense", ascending=False, pct=True
-            )
-            for feature_index, importance, rank_abs, rank_pct in zip(
-                features_index, feature_importances, rankings_abs, rankings_pct
-            ):
-                db_objects.append(
-                    FeatureImportance(
-                        model_id=model_id,
-                        feature_importance=round(float(importance), 10),
-                        feature=feature_names[feature_index],
-                        rank_abs=int(rank_abs),
-                        rank_pct=round(float(rank_pct), 10),
-                    )
-                )
         # get_feature_importances was not able to find
         # feature importances
-        else:
-            db_objects.append(
+        if not isinstance(feature_importances, np.ndarray):
+            return [
                 FeatureImportance(
                     model_id=model_id,
                     feature_importance=0,
@@ -166,8 +313,22 @@ class ModelTrainer(object):
                     rank_abs=0,
                     rank_pct=0,
                 )
+            ]
+        importances = pandas.Series(feature_importances)
+        rankings_abs = importances.rank(method="dense", ascending=False)
+        rankings_pct = importances.rank(method="dense", ascending=False, pct=True)
+        return [
+            FeatureImportance(
+                model_id=model_id,
+                feature_importance=round(float(importance), 10),
+                feature=feature_name,
+                rank_abs=int(rank_abs),
+                rank_pct=round(float(rank_pct), 10),
+            )
+            for feature_name, importance, rank_abs, rank_pct in zip(
+                feature_names, feature_importances, rankings_abs, rankings_pct
             )
-        save_db_objects(self.db_engine, db_objects)
+        ]
 
     @db_retry
     def _write_model_to_db(
@@ -180,6 +341,7 @@ class ModelTrainer(object):
         model_group_id,
         model_size,
         misc_db_parameters,
+        saved_model_id=None,
     ):
         """Writes model and feature importance data to a database
         Will overwrite the data of any previous versions
@@ -192,6 +354,9 @@ class ModelTrainer(object):
         If the replace flag on the object is not set, the existing model metadata
         and feature importances will be used.
 
+        The model is upserted, and its feature importances replaced, in one transaction,
+        so a failure never leaves a model without its feature importances.
+
         Args:
             class_path (string) A full classpath to the model class
             parameters (dict) hyperparameters to give to the model constructor
@@ -201,48 +366,66 @@ class ModelTrainer(object):
             model_group_id (int) the unique id for the model group
             model_size (float) the size of the stored model in kB
             misc_db_parameters (dict) params to pass through to the database
+            saved_model_id (int, optional) the id of the model in the database, if it
+                has been saved before
+
+        Returns: (int) a database id for the model
         """
-        model_id = retrieve_model_id_from_hash(self.db_engine, model_hash)
-        if model_id and not self.replace:
+        if saved_model_id and not self.replace:
             logging.info(
                 "Metadata for model_id %s found in database. Reusing model metadata.",
-                model_id,
+                saved_model_id,
             )
-            return model_id
-        else:
-            model = Model(
-                model_hash=model_hash,
-                model_type=class_path,
-                hyperparameters=parameters,
-                model_group_id=model_group_id,
-                built_by_experiment=self.experiment_hash,
-                model_size=model_size,
-                **misc_db_parameters,
+            return saved_model_id
+
+        model_values = dict(
+            model_hash=model_hash,
+            model_type=class_path,
+            hyperparameters=parameters,
+            model_group_id=model_group_id,
+            built_by_experiment=self.experiment_hash,
+            model_size=model_size,
+            **misc_db_parameters,
+        )
+        upsert = (
+            insert(Model.__table__)
+            .values(**model_values)
+            .on_conflict_do_update(
+                index_elements=[Model.__table__.c.model_hash],
+                set_={
+                    column: value
+                    for column, value in model_values.items()
+                    if column != "model_hash"
+                },
             )
-            session = self.sessionmaker()
-            if model_id:
-                logging.info(
-                    "Found model id %s, updating non-unique attributes", model_id
-                )
-                model.model_id = model_id
-                session.merge(model)
-                session.commit()
-            else:
-                session.add(model)
-                session.commit()
-                model_id = model.model_id
-                logging.info("Added new model id %s", model_id)
-            session.close()
-
-        logging.info("Saving feature importances for model_id %s", model_id)
-        self._save_feature_importances(
-            model_id, get_feature_importances(trained_model), feature_names
+            .returning(Model.__table__.c.model_id)
         )
+        feature_importances = get_feature_importances(trained_model)
+        with self.db_engine.begin() as conn:
+            model_id = conn.execute(upsert).scalar()
+            logging.info("Saved model id %s", model_id)
+            logging.info("Saving feature importances for model_id %s", model_id)
+            conn.execute(
+                "delete from train_results.feature_importances where model_id = %s",
+                model_id,
+            )
+            copy_db_objects(
+                conn.connection,
+                self._feature_importance_objects(model_id, feature_importances, feature_names),
+            )
         logging.info("Done saving feature importances for model_id %s", model_id)
         return model_id
 
     def _train_and_store_model(
-        self, matrix_store, class_path, parameters, model_hash, misc_db_parameters, random_seed
+        self,
+        matrix_store,
+        class_path,
+        parameters,
+        model_hash,
+        misc_db_parameters,
+        random_seed,
+        warm_start_model_hashes=(),
+        saved_model_id=None,
     ):
         """Train a model, cache it, and write metadata to a database
 
@@ -252,6 +435,10 @@ class ModelTrainer(object):
             parameters (dict) hyperparameters to give to the model constructor
             model_hash (string) a unique id for the model
             misc_db_parameters (dict) params to pass through to the database
+            warm_start_model_hashes (list) smaller models this one can be grown from,
+                largest first
+            saved_model_id (int, optional) the id of the model in the database, if it
+                has been saved before
 
         Returns: (int) a database id for the model
         """
@@ -259,7 +446,15 @@ class ModelTrainer(object):
         misc_db_parameters["random_seed"] = random_seed
         misc_db_parameters["run_time"] = datetime.datetime.now().isoformat()
         logging.info("Training and storing model for matrix uuid %s", matrix_store.uuid)
-        trained_model = self._train(matrix_store, class_path, parameters)
+        training_start = time.time()
+        trained_model = self._train(
+            matrix_store,
+            class_path,
+            parameters,
+            self._warm_start_model(warm_start_model_hashes),
+        )
+        # saved so later experiments can estimate how long similar models take to train
+        misc_db_parameters["training_time"] = time.time() - training_start
 
         unique_parameters = self.unique_parameters(parameters)
 
@@ -271,7 +466,7 @@ class ModelTrainer(object):
         )
         # Writing the model to storage, then getting its size in kilobytes.
         self.model_storage_engine.write(trained_model, model_hash)
-        model_size = sys.getsizeof(trained_model) / (1024.0)
+        model_size = self.model_storage_engine.size(model_hash) / (1024.0)
 
         logging.info("Cached model: %s", model_hash)
         model_id = self._write_model_to_db(
@@ -283,6 +478,7 @@ class ModelTrainer(object):
             model_group_id,
             model_size,
             misc_db_parameters,
+            saved_model_id,
         )
         logging.info("Wrote model to db: hash %s, got id %s", model_hash, model_id)
         return model_id
@@ -343,7 +539,14 @@ class ModelTrainer(object):
         ]
 
     def process_train_task(
-        self, matrix_store, class_path, parameters, model_hash, misc_db_parameters, random_seed=None
+        self,
+        matrix_store,
+        class_path,
+        parameters,
+        model_hash,
+        misc_db_parameters,
+        random_seed=None,
+        warm_start_model_hashes=(),
     ):
         """Trains and stores a model, or skips it and returns the existing id
 
@@ -354,18 +557,23 @@ class ModelTrainer(object):
             model_hash (string) a unique id for the model
             misc_db_parameters (dict) params to pass through to the database
             random_seed (int, optional) a number to use to seed the random number generator before training. if none given, will generate one to store
+            warm_start_model_hashes (list, optional) smaller models in the same grid that
+                this one can be grown from if they have been stored already, largest first
         Returns: (int) model id
         """
         try:
-            saved_model_id = retrieve_model_id_from_hash(self.db_engine, model_hash)
+            # with the replace flag set, the model is saved over any existing one
+            saved_model_id = (
+                None if self.replace
+                else retrieve_model_id_from_hash(self.db_engine, model_hash)
+            )
             if (
                 not self.replace
                 and self.model_storage_engine.exists(model_hash)
                 and saved_model_id
             ):
                 logging.info("Skipping %s/%s", class_path, parameters)
-                if self.run_id:
-                    skipped_model(self.run_id, self.db_engine)
+                self._track("models_skipped")
                 return saved_model_id
 
             if self.replace:
@@ -381,17 +589,22 @@ class ModelTrainer(object):
             )
             try:
                 model_id = self._train_and_store_model(
-                    matrix_store, class_path, parameters, model_hash, misc_db_parameters, random_seed
+                    matrix_store,
+                    class_path,
+                    parameters,
+                    model_hash,
+                    misc_db_parameters,
+                    random_seed,
+                    warm_start_model_hashes,
+                    saved_model_id,
                 )
             except BaselineFeatureNotInMatrix:
                 logging.warning(
                     "Tried to train baseline model without required feature in matrix. Skipping."
                 )
-                if self.run_id:
-                    skipped_model(self.run_id, self.db_engine)
+                self._track("models_skipped")
                 model_id = None
-            if self.run_id:
-                built_model(self.run_id, self.db_engine)
+            self._track("models_made")
             return model_id
         except Exception as exc:
             logging.warning("Model training for matrix %s, estimator %s/%s, model hash %s",
@@ -402,7 +615,7 @@ class ModelTrainer(object):
                             model_hash,
                             exc
                             )
-            errored_model(self.run_id, self.db_engine)
+            self._track("models_errored")
 
     @staticmethod
     def flattened_grid_config(grid_config):
@@ -467,5 +680,51 @@ class ModelTrainer(object):
                     "random_seed": random_seed
                 }
             )
+        self._add_warm_start_model_hashes(tasks)
         logging.info("Found %s unique model training tasks", len(tasks))
         return tasks
+
+    def _add_warm_start_model_hashes(self, tasks):
+        """Link each task to the tasks in the grid whose models it can be grown from
+
+        Tasks for a warm-startable estimator that only differ in its warm-startable
+        parameter form a chain. Each task but the smallest in a chain gets a
+        'warm_start_model_hashes' list of the smaller models' hashes, largest first,
+        so that if any of them has been trained already only the difference
+        needs to be fit.
+
+        Args:
+            tasks (list) training task definitions, modified in place
+        """
+        chains = defaultdict(list)
+        for task in tasks:
+            warm_start_parameter = WARM_STARTABLE_PARAMETERS.get(task["class_path"])
+            if (
+                not warm_start_parameter
+                or task["parameters"].get("warm_start")
+                or not isinstance(task["parameters"].get(warm_start_parameter), int)
+            ):
+                continue
+            other_parameters = {
+                key: value
+                for key, value in self.unique_parameters(task["parameters"]).items()
+                if key != warm_start_parameter
+            }
+            chain_key = (
+                task["class_path"],
+                json.dumps(other_parameters, sort_keys=True, default=str),
+            )
+            chains[chain_key].append(task)
+
+        for (class_path, _), chain in chains.items():
+            warm_start_parameter = WARM_STARTABLE_PARAMETERS[class_path]
+            chain.sort(key=lambda task: task["parameters"][warm_start_parameter])
+            for index, task in enumerate(chain):
+                smaller_model_hashes = [
+                    smaller_task["model_hash"]
+                    for smaller_task in reversed(chain[:index])
+                    if smaller_task["parameters"][warm_start_parameter]
+                    < task["parameters"][warm_start_parameter]
+                ]
+                if smaller_model_hashes:
+                    task["warm_start_model_hashes"] = smaller_model_hashes
@@ -1,10 +1,13 @@
+import functools
 import logging
 import math
 
 import numpy
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import or_
+from sqlalchemy import and_, bindparam, or_, select
 
+from .db import execute_cached
+from .storage import MODEL_CACHE
 from .utils import db_retry, retrieve_model_hash_from_id, save_db_objects, sort_predictions_and_labels, AVAILABLE_TIEBREAKERS
 from triage.component.results_schema import Model
 from triage.util.db import scoped_session
@@ -17,6 +20,18 @@ class ModelNotFoundError(ValueError):
     pass
 
 
+@functools.lru_cache(maxsize=None)
+def _predicted_as_of_dates(prediction_obj):
+    """The statement selecting the as-of-dates a model has predictions for in a matrix,
+    built once for each predictions table so that its compiled SQL is reused"""
+    return select([prediction_obj.as_of_date]).distinct().where(
+        and_(
+            prediction_obj.model_id == bindparam("model_id"),
+            prediction_obj.matrix_uuid == bindparam("matrix_uuid"),
+        )
+    )
+
+
 class Predictor(object):
     expected_matrix_ts_format = "%Y-%m-%d %H:%M:%S"
     available_tiebreakers = AVAILABLE_TIEBREAKERS
@@ -59,11 +74,25 @@ class Predictor(object):
             A python object which implements .predict()
         """
 
-        model_hash = retrieve_model_hash_from_id(self.db_engine, model_id)
+        model_hash = self._model_hash(model_id)
         logging.info("Checking for model_hash %s in store", model_hash)
         if self.model_storage_engine.exists(model_hash):
             return self.model_storage_engine.load(model_hash)
 
+    def _model_hash(self, model_id):
+        """Look up the hash of a model id, in the model cache if possible
+
+        Args:
+            model_id (int) The id of a given model in the database
+
+        Returns: (str) the stored hash of the model
+        """
+        model_hash = MODEL_CACHE.model_hash(self.db_engine.url, model_id)
+        if model_hash is None:
+            model_hash = retrieve_model_hash_from_id(self.db_engine, model_id)
+            MODEL_CACHE.remember_model_hash(self.db_engine.url, model_id, model_hash)
+        return model_hash
+
     @db_retry
     def delete_model(self, model_id):
         """Deletes the cached model associated with a given model id
@@ -71,7 +100,8 @@ class Predictor(object):
         Args:
             model_id (int) The id of a given model in the database
         """
-        model_hash = retrieve_model_hash_from_id(self.db_engine, model_id)
+        model_hash = self._model_hash(model_id)
+        MODEL_CACHE.forget_model_hash(self.db_engine.url, model_id)
         self.model_storage_engine.delete(model_hash)
 
     @db_retry
@@ -96,19 +126,17 @@ class Predictor(object):
         """
         if not self.save_predictions:
             return False
-        session = self.sessionmaker()
-        prediction_obj = matrix_store.matrix_type.prediction_obj
         as_of_dates_in_db = set(
             as_of_date.date()
-            for (as_of_date,) in session.query(prediction_obj).filter_by(
+            for (as_of_date,) in execute_cached(
+                self.db_engine,
+                _predicted_as_of_dates(matrix_store.matrix_type.prediction_obj),
                 model_id=model_id,
-                matrix_uuid=matrix_store.uuid
-            ).distinct(prediction_obj.as_of_date).values("as_of_date")
+                matrix_uuid=matrix_store.uuid,
+            )
         )
         as_of_dates_needed = set(matrix_store.as_of_dates)
-        needed = bool(as_of_dates_needed - as_of_dates_in_db)
-        session.close()
-        return needed
+        return bool(as_of_dates_needed - as_of_dates_in_db)
 
     @db_retry
     def _load_saved_predictions(self, existing_predictions, matrix_store):
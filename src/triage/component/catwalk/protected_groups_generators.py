@@ -1,13 +1,24 @@
+import datetime
 import logging
 import textwrap
+from collections import OrderedDict
 
 import pandas
-from sqlalchemy import text
 
 from triage.database_reflection import table_exists
 from triage.component.catwalk.storage import MatrixStore
 
 
+# The most protected group dataframes, of each kind, that a generator keeps in memory
+MAX_CACHED_DATAFRAMES = 16
+
+
+def _as_date(as_of_date):
+    if isinstance(as_of_date, datetime.datetime):
+        return as_of_date.date()
+    return as_of_date
+
+
 class ProtectedGroupsGeneratorNoOp(object):
     def generate_all_dates(self, *args, **kwargs):
         logging.warning(
@@ -22,18 +33,37 @@ class ProtectedGroupsGeneratorNoOp(object):
     def as_dataframe(self, *args, **kwargs):
         return pandas.DataFrame()
 
+    def as_matrix_dataframe(self, *args, **kwargs):
+        return pandas.DataFrame()
+
 
 class ProtectedGroupsGenerator(object):
-    def __init__(self, db_engine, from_obj, attribute_columns, entity_id_column, knowledge_date_column, protected_groups_table_name, replace=True):
+    def __init__(self, db_engine, from_obj, attribute_columns, entity_id_column, knowledge_date_column, protected_groups_table_name, replace=True, storage_engine=None):
         self.db_engine = db_engine
+        # saves the protected groups of each matrix, so that they're shared between
+        # the processes evaluating models on the matrix
+        self.storage_engine = storage_engine
         self.replace = replace
         self.protected_groups_table_name = protected_groups_table_name
         self.from_obj = from_obj
         self.attribute_columns = attribute_columns
         self.entity_id_column = entity_id_column
         self.knowledge_date_column = knowledge_date_column
+        self.clear_cache()
+
+    def clear_cache(self):
+        """Forget the protected group dataframes loaded so far"""
+        self._dataframes = OrderedDict()
+        self._matrix_dataframes = OrderedDict()
+
+    @staticmethod
+    def _cache(cache, key, value):
+        cache[key] = value
+        while len(cache) > MAX_CACHED_DATAFRAMES:
+            cache.popitem(last=False)
 
     def generate_all_dates(self, as_of_dates, cohort_table_name, cohort_hash):
+        self.clear_cache()
         table_is_new = False
         if not table_exists(self.protected_groups_table_name, self.db_engine):
             self.db_engine.execute(
@@ -57,34 +87,31 @@ class ProtectedGroupsGenerator(object):
                 f'delete from {self.protected_groups_table_name} where cohort_hash = %s',
                 cohort_hash
             )
-
-        logging.info(
-            "Creating protected_groups for %s as of dates",
-            len(as_of_dates)
-        )
-        for as_of_date in as_of_dates:
-            if not self.replace:
-                logging.info(
-                    "Looking for existing protected_groups for as of date %s",
-                    as_of_date
+        else:
+            logging.info("Looking for existing protected_groups for %s as of dates", len(as_of_dates))
+            existing_dates = set(
+                row[0] for row in self.db_engine.execute(
+                    f"""select distinct as_of_date from {self.protected_groups_table_name}
+                    where cohort_hash = %s""",
+                    cohort_hash
                 )
-                any_existing_rows = list(self.db_engine.execute(
-                    f"""select 1 from {self.protected_groups_table_name}
-                    where as_of_date = '{as_of_date}'
-                    and cohort_hash = '{cohort_hash}'
-                    limit 1
-                    """
-                ))
-                if len(any_existing_rows) == 1:
-                    logging.info("Since nonzero existing protected_groups found, skipping")
-                    continue
-
+            )
+            as_of_dates = [
+                as_of_date for as_of_date in as_of_dates
+                if _as_date(as_of_date) not in existing_dates
+            ]
             logging.info(
-                "Generating protected groups for as of date %s ",
-                as_of_date
+                "Skipping as of dates with existing protected_groups, %s remain",
+                len(as_of_dates)
             )
+
+        if as_of_dates:
+            if self.storage_engine:
+                # the saved protected groups of matrices may come from the rows replaced
+                self.storage_engine.delete_cohort(cohort_hash)
+            logging.info("Generating protected_groups for %s as of dates", len(as_of_dates))
             self.generate(
-                start_date=as_of_date,
+                as_of_dates=as_of_dates,
                 cohort_table_name=cohort_table_name,
                 cohort_hash=cohort_hash
             )
@@ -99,44 +126,86 @@ class ProtectedGroupsGenerator(object):
             logging.info("Done creating protected_groups table %s: rows: %s", self.protected_groups_table_name, nrows)
 
 
-    def generate(self, start_date, cohort_table_name, cohort_hash):
-        full_insert_query = text(textwrap.dedent(
-            '''
-            insert into {protected_groups_table}
-            select distinct on (cohort.entity_id, cohort.as_of_date)
+    def generate(self, as_of_dates, cohort_table_name, cohort_hash):
+        """Inserts the protected groups of the cohort for all of the given dates at once
+
+        The rows of the from_obj that could be the latest record of a cohort entity are
+        copied into a temporary table indexed by entity and knowledge date, and the latest
+        record before each as of date is looked up in it for every cohort row in a single
+        statement.
+
+        Args:
+            as_of_dates (list) the as of dates to generate protected groups for
+            cohort_table_name (string) the table of entities and as of dates in the cohort
+            cohort_hash (string) the hash of the cohort, saved with each row
+        """
+        as_of_dates_sql = "array[{}]::timestamp[]".format(
+            ", ".join("'{}'".format(as_of_date) for as_of_date in as_of_dates)
+        )
+        attribute_columns = ", ".join(str(col) for col in self.attribute_columns)
+        source_table = "protected_groups_source"
+        create_source_query = textwrap.dedent(
+            f"""
+            create temporary table {source_table} on commit drop as
+            select
+                from_obj.{self.entity_id_column} as entity_id,
+                from_obj.{self.knowledge_date_column} as knowledge_date,
+                {attribute_columns}
+            from (select * from {self.from_obj}) from_obj
+            where from_obj.{self.entity_id_column} in (
+                select entity_id from {cohort_table_name}
+                where as_of_date = any({as_of_dates_sql})
+            )
+            and from_obj.{self.knowledge_date_column} < '{max(as_of_dates)}'::timestamp
+            """
+        )
+        insert_query = textwrap.dedent(
+            f"""
+            insert into {self.protected_groups_table_name}
+            select
                 cohort.entity_id,
-                '{as_of_date}'::date as as_of_date,
-                {attribute_columns},
-                \'{cohort_hash}\' as cohort_hash
-            from {cohort_table_name} cohort 
-            left join (select * from {from_obj}) from_obj  on 
-                cohort.entity_id = from_obj.{entity_id_column} and
-                cohort.as_of_date > from_obj.{knowledge_date_column}
-            where cohort.as_of_date = '{as_of_date}'::date
-            order by cohort.entity_id, cohort.as_of_date, {knowledge_date_column} desc
-        '''
-        ).format(
-            protected_groups_table=self.protected_groups_table_name,
-            as_of_date=start_date,
-            attribute_columns=", ".join([str(col) for col in self.attribute_columns]),
-            cohort_hash=cohort_hash,
-            cohort_table_name=cohort_table_name,
-            from_obj=self.from_obj,
-            knowledge_date_column=self.knowledge_date_column,
-            entity_id_column=self.entity_id_column
-        ))
-        logging.debug("Running protected_groups creation query")
-        logging.debug(full_insert_query)
-        self.db_engine.execute(full_insert_query)
+                cohort.as_of_date::date as as_of_date,
+                {", ".join(f"latest.{col}" for col in self.attribute_columns)},
+                '{cohort_hash}' as cohort_hash
+            from (
+                select distinct entity_id, as_of_date from {cohort_table_name}
+                where as_of_date = any({as_of_dates_sql})
+            ) cohort
+            left join lateral (
+                select {attribute_columns}
+                from {source_table} source
+                where source.entity_id = cohort.entity_id
+                and source.knowledge_date < cohort.as_of_date
+                order by source.knowledge_date desc
+                limit 1
+            ) latest on true
+            """
+        )
+        logging.debug("Running protected_groups creation queries")
+        logging.debug(create_source_query)
+        logging.debug(insert_query)
+        with self.db_engine.begin() as conn:
+            conn.execute(create_source_query)
+            conn.execute(f"create index on {source_table} (entity_id, knowledge_date)")
+            conn.execute(f"analyze {source_table}")
+            conn.execute(insert_query)
 
     def as_dataframe(self, as_of_dates, cohort_hash):
         """Queries the protected groups table to retrieve the protected attributes for each date
+
+        The attributes of each cohort and set of dates are only queried once, and are kept
+        as categoricals; later calls return the same dataframe, so it should not be modified.
+
         Args:
-            db_engine (sqlalchemy.engine) a database engine
             as_of_dates (list) the as_of_Dates to query
+            cohort_hash (string) the hash of the cohort the protected groups were generated for
 
         Returns: (pandas.DataFrame) a dataframe with protected attributes for the given dates
         """
+        key = (cohort_hash, tuple(sorted(as_of_dates)))
+        if key in self._dataframes:
+            self._dataframes.move_to_end(key)
+            return self._dataframes[key]
         as_of_dates_sql = "[{}]".format(
             ", ".join("'{}'".format(date.strftime("%Y-%m-%d %H:%M:%S.%f")) for date in as_of_dates)
         )
@@ -156,4 +225,41 @@ class ProtectedGroupsGenerator(object):
             index_col=MatrixStore.indices,
         )
         del protected_df['cohort_hash']
+        # string attributes repeat a few values over many rows, so are stored as categories
+        for column in protected_df.columns:
+            if protected_df[column].dtype == object:
+                protected_df[column] = protected_df[column].astype("category")
+        self._cache(self._dataframes, key, protected_df)
+        return protected_df
+
+    def as_matrix_dataframe(self, matrix_store, cohort_hash):
+        """The protected attributes of each row of a matrix, in the order of its labels
+
+        Aligned dataframes are kept for each matrix, so evaluating many models on the same
+        matrix neither queries nor realigns the protected groups again. Given a storage
+        engine, they are also saved in project storage, so processes evaluating models on
+        a matrix after the first one load them instead.
+
+        Args:
+            matrix_store (catwalk.storage.MatrixStore) the matrix to align the attributes to
+            cohort_hash (string) the hash of the cohort the protected groups were generated for
+
+        Returns: (pandas.DataFrame) a dataframe with protected attributes, indexed the same as
+            the matrix labels
+        """
+        key = (cohort_hash, matrix_store.uuid)
+        if key in self._matrix_dataframes:
+            self._matrix_dataframes.move_to_end(key)
+            return self._matrix_dataframes[key]
+        storage_engine = self.storage_engine
+        if storage_engine and storage_engine.exists(cohort_hash, matrix_store.uuid):
+            protected_df = self.storage_engine.load(cohort_hash, matrix_store.uuid)
+        else:
+            labels_index = matrix_store.labels.index
+            protected_df = self.as_dataframe(
+                matrix_store.as_of_dates, cohort_hash
+            ).reindex(labels_index)
+            if self.storage_engine:
+                self.storage_engine.write(protected_df, cohort_hash, matrix_store.uuid)
+        self._cache(self._matrix_dataframes, key, protected_df)
         return protected_df
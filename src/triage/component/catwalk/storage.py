@@ -4,6 +4,11 @@ import itertools
 import logging
 import os
 import pathlib
+import pickle
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
 from contextlib import contextmanager
 from os.path import dirname
 from urllib.parse import urlparse
@@ -27,6 +32,16 @@ from triage.component.results_schema import (
 )
 from triage.util.pandas import downcast_matrix
 
+try:
+    import lz4  # noqa: F401
+    FAST_MODEL_COMPRESSION = ("lz4", 3)
+except ImportError:
+    # without lz4, the fastest level of zlib
+    FAST_MODEL_COMPRESSION = ("zlib", 1)
+
+# the ways ModelStorageEngine can save models
+MODEL_SERIALIZATIONS = ("compressed", "fast", "mmap")
+
 
 class Store(object):
     """Base class for classes which know how to access a file in a preset medium.
@@ -66,6 +81,10 @@ class Store(object):
     def exists(self):
         raise NotImplementedError
 
+    def size(self):
+        """The size of the stored object in bytes"""
+        raise NotImplementedError
+
     def load(self):
         with self.open("rb") as fd:
             return fd.read()
@@ -77,6 +96,19 @@ class Store(object):
     def open(self, *args, **kwargs):
         raise NotImplementedError
 
+    def move(self, destination):
+        """Move the stored object to another store in the same medium, replacing any
+        object there
+
+        Args:
+            destination (Store) A store of the same class
+        """
+        raise NotImplementedError
+
+    def delete_tree(self):
+        """Delete the directory at this path and everything in it, if it exists"""
+        raise NotImplementedError
+
 
 class S3Store(Store):
     """Store an object in S3.
@@ -126,9 +158,20 @@ class S3Store(Store):
     def exists(self):
         return self.client.exists(self.path)
 
+    def size(self):
+        return self.client.info(self.path)["Size"]
+
     def delete(self):
         self.client.rm(self.path)
 
+    def move(self, destination):
+        self.client.mv(self.path, destination.path)
+
+    def delete_tree(self):
+        client = self.client
+        if client.exists(self.path):
+            client.rm(self.path, recursive=True)
+
     def open(self, *args, **kwargs):
         # NOTE: remove S3FileWrapper as soon as s3fs properly
         # NOTE: chunks out too-large writes
@@ -160,9 +203,18 @@ class FSStore(Store):
     def exists(self):
         return os.path.isfile(self.path)
 
+    def size(self):
+        return os.path.getsize(self.path)
+
     def delete(self):
         os.remove(self.path)
 
+    def move(self, destination):
+        os.replace(self.path, destination.path)
+
+    def delete_tree(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
     def open(self, *args, **kwargs):
         return open(self.path, *args, **kwargs)
 
@@ -191,6 +243,14 @@ class ProjectStorage(object):
         """
         return self.storage_class(self.project_path, *directories, leaf_filename)
 
+    def delete_directory(self, directories):
+        """Delete a directory of the project and everything in it, if it exists
+
+        Args:
+        directories (list): A list of subdirectories, the last of which is deleted
+        """
+        self.storage_class(self.project_path, *directories).delete_tree()
+
     def matrix_storage_engine(self, matrix_storage_class=None, matrix_directory=None):
         """Return a matrix storage engine bound to this project's storage
 
@@ -202,32 +262,287 @@ class ProjectStorage(object):
         """
         return MatrixStorageEngine(self, matrix_storage_class, matrix_directory)
 
-    def model_storage_engine(self, model_directory=None):
+    def model_storage_engine(self, model_directory=None, serialization="compressed"):
         """Return a model storage engine bound to this project's storage
 
         Args:
             model_directory (string, optional) A directory to store models
                 If not passed will allow the ModelStorageEngine to decide
+            serialization (string, optional) How models are saved, one of
+                MODEL_SERIALIZATIONS. Defaults to 'compressed'
         Returns: triage.component.catwalk.storage.ModelStorageEngine
         """
-        return ModelStorageEngine(self, model_directory)
+        return ModelStorageEngine(self, model_directory, serialization)
+
+    def feature_slice_storage_engine(self, namespace, slice_directory=None):
+        """Return a feature slice storage engine bound to this project's storage
+
+        Args:
+            namespace (string) A subdirectory for slices that are valid together,
+                e.g. the slices of one set of feature tables
+            slice_directory (string, optional) A directory to store feature slices
+                If not passed will allow the FeatureSliceStorageEngine to decide
+        Returns: triage.component.catwalk.storage.FeatureSliceStorageEngine
+        """
+        return FeatureSliceStorageEngine(self, namespace, slice_directory)
+
+    def protected_groups_storage_engine(
+        self, namespace, protected_groups_directory=None
+    ):
+        """Return a protected groups storage engine bound to this project's storage
+
+        Args:
+            namespace (string) A subdirectory for the protected groups of one table
+            protected_groups_directory (string, optional) A directory to store
+                protected groups. If not passed will allow the
+                ProtectedGroupsStorageEngine to decide
+        Returns: triage.component.catwalk.storage.ProtectedGroupsStorageEngine
+        """
+        return ProtectedGroupsStorageEngine(self, namespace, protected_groups_directory)
+
+
+class _ByteCounter(object):
+    """A write-only file that only counts the bytes written to it"""
+    def __init__(self):
+        self.nbytes = 0
+
+    def write(self, data):
+        # pickle protocol 5 writes large buffers as PickleBuffer objects, which have no len
+        self.nbytes += memoryview(data).nbytes
+
+
+def model_nbytes(model):
+    """The number of bytes a model takes when pickled, which approximates its size in
+    memory, found without holding the pickled model in memory
+
+    Args:
+        model (object) A picklable model object
+
+    Returns: (int) the size of the pickled model
+    """
+    counter = _ByteCounter()
+    pickle.dump(model, counter, protocol=pickle.HIGHEST_PROTOCOL)
+    return counter.nbytes
+
+
+class ModelCache(object):
+    """A least-recently-used cache of loaded models, shared by every ModelStorageEngine
+    in the process through MODEL_CACHE, so that models loaded over and over (e.g. to
+    score several matrices, or in postmodeling) are only read from storage once.
+
+    Models are cached by where they are stored, as a model hash is only unique within
+    one project. Models are kept until their total size, as pickled, would exceed the
+    byte budget, and then the least recently used are evicted. A model larger than the whole budget
+    is not cached. The cache also remembers which model hash each model id in a database
+    has, so models can be looked up by id without querying the database again.
+
+    A budget of 0, the default, turns the cache off.
+
+    Args:
+        max_bytes (int, optional) The most bytes of models to keep
+    """
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Forget every cached model and model hash, and reset the statistics"""
+        with self._lock:
+            self._models = OrderedDict()
+            self._model_hashes = {}
+            self.size_bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.model_hash_hits = 0
+            self.model_hash_misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def resize(self, max_bytes):
+        """Change the byte budget, evicting models as needed to fit in it
+
+        Args:
+            max_bytes (int) The most bytes of models to keep. 0 turns the cache off
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            if not self.enabled:
+                self._model_hashes = {}
+            self._evict()
+
+    def __contains__(self, key):
+        return key in self._models
+
+    def get(self, key):
+        """Return a cached model, marking it as the most recently used
+
+        Args:
+            key (string) Where the model is stored, e.g. its path in project storage
+
+        Returns: (object) the model, or None if it is not cached
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, model):
+        """Cache a model, evicting the least recently used models to make room
+
+        Args:
+            key (string) Where the model is stored, e.g. its path in project storage
+            model (object) The loaded model
+        """
+        if not self.enabled:
+            return
+        nbytes = model_nbytes(model)
+        if nbytes > self.max_bytes:
+            logging.info(
+                "Model %s (%s bytes) is larger than the model cache, not caching it",
+                key,
+                nbytes,
+            )
+            return
+        with self._lock:
+            self.discard(key)
+            self._models[key] = (model, nbytes)
+            self.size_bytes += nbytes
+            self._evict()
+
+    def discard(self, key):
+        """Remove a model from the cache, if it is cached
+
+        Args:
+            key (string) Where the model is stored, e.g. its path in project storage
+        """
+        with self._lock:
+            if key in self._models:
+                _, nbytes = self._models.pop(key)
+                self.size_bytes -= nbytes
+
+    def _evict(self):
+        while self._models and self.size_bytes > self.max_bytes:
+            key, (_, nbytes) = self._models.popitem(last=False)
+            self.size_bytes -= nbytes
+            self.evictions += 1
+            logging.debug("Evicted model %s from the model cache", key)
+
+    def model_hash(self, db_url, model_id):
+        """Look up the hash of a model id remembered with remember_model_hash
+
+        Args:
+            db_url (string or sqlalchemy.engine.url.URL) The database of the model id
+            model_id (int) The model's id in that database
+
+        Returns: (string) the model hash, or None if it isn't known
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            model_hash = self._model_hashes.get((str(db_url), model_id))
+            if model_hash is None:
+                self.model_hash_misses += 1
+            else:
+                self.model_hash_hits += 1
+            return model_hash
+
+    def remember_model_hash(self, db_url, model_id, model_hash):
+        """Remember the hash of a model id
+
+        Args:
+            db_url (string or sqlalchemy.engine.url.URL) The database of the model id
+            model_id (int) The model's id in that database
+            model_hash (string) The model's hash
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._model_hashes[(str(db_url), model_id)] = model_hash
+
+    def forget_model_hash(self, db_url, model_id):
+        """Forget the hash of a model id, e.g. because the model was deleted
+
+        Args:
+            db_url (string or sqlalchemy.engine.url.URL) The database of the model id
+            model_id (int) The model's id in that database
+        """
+        with self._lock:
+            self._model_hashes.pop((str(db_url), model_id), None)
+
+    def stats(self):
+        """Statistics for monitoring how well the cache works
+
+        Returns: (dict) the number of model hits, misses and evictions, model id lookup
+            hits and misses, and the number and total size of the cached models
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "model_hash_hits": self.model_hash_hits,
+                "model_hash_misses": self.model_hash_misses,
+                "num_models": len(self._models),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# the model cache shared by every ModelStorageEngine in this process
+MODEL_CACHE = ModelCache()
 
 
 class ModelStorageEngine(object):
     """Store arbitrary models in a given project storage using joblib
 
+    Models can be saved in one of the MODEL_SERIALIZATIONS:
+        'compressed': compressed with zlib, the smallest but slowest to save and load
+        'fast': compressed with lz4 if it is installed, or else with the fastest level
+            of zlib
+        'mmap': uncompressed, so that on the local filesystem the numpy arrays inside
+            models are memory-mapped when loaded, and processes loading the same model
+            share one copy of them
+
+    Any model can be loaded whichever way it was saved.
+
     Args:
         project_storage (triage.component.catwalk.storage.ProjectStorage)
             A project file storage engine
         model_directory (string, optional) A directory name for models.
             Defaults to 'trained_models'
+        serialization (string, optional) How models are saved, one of
+            MODEL_SERIALIZATIONS. Defaults to 'compressed'
     """
-    def __init__(self, project_storage, model_directory=None):
+    def __init__(self, project_storage, model_directory=None, serialization="compressed"):
+        if serialization not in MODEL_SERIALIZATIONS:
+            raise ValueError(
+                f"Unknown model serialization {serialization}, "
+                f"must be one of {MODEL_SERIALIZATIONS}"
+            )
         self.project_storage = project_storage
         self.directories = [model_directory or "trained_models"]
+        self.serialization = serialization
         self.should_cache = False
         self.reset_cache()
 
+    @property
+    def compression(self):
+        """The joblib compress argument for this engine's serialization"""
+        if self.serialization == "mmap":
+            return 0
+        if self.serialization == "fast":
+            return FAST_MODEL_COMPRESSION
+        return True
+
     def reset_cache(self):
         self.cache = {}
 
@@ -246,7 +561,8 @@ class ModelStorageEngine(object):
             self.should_cache = False
 
     def write(self, obj, model_hash):
-        """Persist a model object using joblib. Also performs compression
+        """Persist a model object using joblib, compressed according to the
+        engine's serialization
 
         Args:
             obj (object) A picklable model object
@@ -255,12 +571,17 @@ class ModelStorageEngine(object):
         if self.should_cache:
             logging.info("Caching model %s", model_hash)
             self.cache[model_hash] = obj
+        # a model replacing an older version shouldn't be served from the old copy
+        MODEL_CACHE.discard(self._cache_key(model_hash))
         with self._get_store(model_hash).open("wb") as fd:
-            joblib.dump(obj, fd, compress=True)
+            joblib.dump(obj, fd, compress=self.compression)
 
     def load(self, model_hash):
         """Load a model object using joblib
 
+        With the 'mmap' serialization, models on the local filesystem are loaded
+        with their numpy arrays memory-mapped read-only.
+
         Args:
             model_hash (string) An identifier, unique within this project, for the model
 
@@ -269,8 +590,28 @@ class ModelStorageEngine(object):
         if self.should_cache and model_hash in self.cache:
             logging.info("Returning model %s from cache", model_hash)
             return self.cache[model_hash]
-        with self._get_store(model_hash).open("rb") as fd:
-            return joblib.load(fd)
+        model = MODEL_CACHE.get(self._cache_key(model_hash))
+        if model is not None:
+            logging.info("Returning model %s from the model cache", model_hash)
+            return model
+        store = self._get_store(model_hash)
+        if self.serialization == "mmap" and isinstance(store, FSStore):
+            model = joblib.load(str(store.path), mmap_mode="r")
+        else:
+            with store.open("rb") as fd:
+                model = joblib.load(fd)
+        MODEL_CACHE.put(self._cache_key(model_hash), model)
+        return model
+
+    def size(self, model_hash):
+        """The size of the stored model in bytes
+
+        Args:
+            model_hash (string) An identifier, unique within this project, for the model
+
+        Returns: (int) the size of the model's file in project storage
+        """
+        return self._get_store(model_hash).size()
 
     def exists(self, model_hash):
         """Check whether the model is persisted
@@ -280,6 +621,13 @@ class ModelStorageEngine(object):
 
         Returns: (bool) Whether or not a model by that identifier exists in project storage
         """
+        # cached models were read from or written to this engine's storage, so don't check
+        # again. The model cache is keyed by storage path, so other projects can't fill it
+        if (
+            (self.should_cache and model_hash in self.cache)
+            or self._cache_key(model_hash) in MODEL_CACHE
+        ):
+            return True
         return self._get_store(model_hash).exists()
 
     def delete(self, model_hash):
@@ -288,12 +636,182 @@ class ModelStorageEngine(object):
         Args:
             model_hash (string) An identifier, unique within this project, for the model
         """
+        self.cache.pop(model_hash, None)
+        MODEL_CACHE.discard(self._cache_key(model_hash))
         return self._get_store(model_hash).delete()
 
+    def _cache_key(self, model_hash):
+        # the same hash may name different models in different projects
+        return "/".join([str(self.project_storage.project_path)] + self.directories + [model_hash])
+
     def _get_store(self, model_hash):
         return self.project_storage.get_store(self.directories, model_hash)
 
 
+def _dump_atomically(obj, project_storage, directories, leaf_filename):
+    """Persist an object using joblib, with compression
+
+    The object is written under a temporary name and then moved into place, so an
+    interrupted write never leaves a truncated file for later runs to load, and
+    processes writing the same file at once don't interleave their writes.
+    """
+    store = project_storage.get_store(directories, leaf_filename)
+    temporary_store = project_storage.get_store(
+        directories, "{}.{}.tmp".format(leaf_filename, uuid.uuid4().hex)
+    )
+    try:
+        with temporary_store.open("wb") as fd:
+            joblib.dump(obj, fd, compress=True)
+        temporary_store.move(store)
+    except BaseException:
+        if temporary_store.exists():
+            temporary_store.delete()
+        raise
+
+
+class FeatureSliceStorageEngine(object):
+    """Store the rows of one feature table for one as-of-date in a given project storage
+
+    Slices are persisted using joblib, so their column types survive the round trip.
+
+    Args:
+        project_storage (triage.component.catwalk.storage.ProjectStorage)
+            A project file storage engine
+        namespace (string) A subdirectory for slices that are valid together
+        slice_directory (string, optional) A directory name for feature slices.
+            Defaults to 'feature_slices'
+    """
+    def __init__(self, project_storage, namespace, slice_directory=None):
+        self.project_storage = project_storage
+        self.directories = [slice_directory or "feature_slices", namespace]
+
+    def write(self, df, feature_table_name, as_of_date):
+        """Persist a feature slice using joblib. Also performs compression
+
+        Args:
+            df (pandas.DataFrame) The rows of the feature table for the as-of-date
+            feature_table_name (string) The name of the feature table
+            as_of_date (datetime) The as-of-date of the rows
+        """
+        _dump_atomically(
+            df,
+            self.project_storage,
+            self.directories + [feature_table_name],
+            self._slice_filename(as_of_date),
+        )
+
+    def load(self, feature_table_name, as_of_date):
+        """Load a feature slice using joblib
+
+        Args:
+            feature_table_name (string) The name of the feature table
+            as_of_date (datetime) The as-of-date of the rows
+
+        Returns: (pandas.DataFrame) The rows of the feature table for the as-of-date
+        """
+        with self._get_store(feature_table_name, as_of_date).open("rb") as fd:
+            return joblib.load(fd)
+
+    def exists(self, feature_table_name, as_of_date):
+        """Check whether the feature slice is persisted
+
+        Args:
+            feature_table_name (string) The name of the feature table
+            as_of_date (datetime) The as-of-date of the rows
+
+        Returns: (bool) Whether or not the slice exists in project storage
+        """
+        return self._get_store(feature_table_name, as_of_date).exists()
+
+    def delete_all(self):
+        """Delete every slice in the namespace"""
+        self.project_storage.delete_directory(self.directories)
+
+    def _get_store(self, feature_table_name, as_of_date):
+        return self.project_storage.get_store(
+            self.directories + [feature_table_name],
+            self._slice_filename(as_of_date),
+        )
+
+    @staticmethod
+    def _slice_filename(as_of_date):
+        return pd.Timestamp(as_of_date).strftime("%Y-%m-%dT%H%M%S") + ".pkl"
+
+
+class ProtectedGroupsStorageEngine(object):
+    """Store the protected groups of matrices in a given project storage
+
+    The protected attributes of each row of a matrix are persisted using joblib, so
+    processes evaluating models on the same matrix can load them instead of querying
+    and aligning them again.
+
+    Args:
+        project_storage (triage.component.catwalk.storage.ProjectStorage)
+            A project file storage engine
+        namespace (string) A subdirectory for the protected groups of one table
+        protected_groups_directory (string, optional) A directory name for protected
+            groups. Defaults to 'protected_groups'
+    """
+    def __init__(self, project_storage, namespace, protected_groups_directory=None):
+        self.project_storage = project_storage
+        self.directories = [protected_groups_directory or "protected_groups", namespace]
+
+    def write(self, df, cohort_hash, matrix_uuid):
+        """Persist the protected groups of a matrix using joblib
+
+        Args:
+            df (pandas.DataFrame) The protected attributes of each row of the matrix
+            cohort_hash (string) The hash of the cohort of the protected groups
+            matrix_uuid (string) The uuid of the matrix
+        """
+        _dump_atomically(
+            df,
+            self.project_storage,
+            self.directories + [cohort_hash],
+            self._filename(matrix_uuid),
+        )
+
+    def load(self, cohort_hash, matrix_uuid):
+        """Load the protected groups of a matrix using joblib
+
+        Args:
+            cohort_hash (string) The hash of the cohort of the protected groups
+            matrix_uuid (string) The uuid of the matrix
+
+        Returns: (pandas.DataFrame) The protected attributes of each row of the matrix
+        """
+        with self._get_store(cohort_hash, matrix_uuid).open("rb") as fd:
+            return joblib.load(fd)
+
+    def exists(self, cohort_hash, matrix_uuid):
+        """Check whether the protected groups of a matrix are persisted
+
+        Args:
+            cohort_hash (string) The hash of the cohort of the protected groups
+            matrix_uuid (string) The uuid of the matrix
+
+        Returns: (bool) Whether or not they exist in project storage
+        """
+        return self._get_store(cohort_hash, matrix_uuid).exists()
+
+    def delete_cohort(self, cohort_hash):
+        """Delete the protected groups of every matrix of a cohort
+
+        Args:
+            cohort_hash (string) The hash of the cohort of the protected groups
+        """
+        self.project_storage.delete_directory(self.directories + [cohort_hash])
+
+    def _get_store(self, cohort_hash, matrix_uuid):
+        return self.project_storage.get_store(
+            self.directories + [cohort_hash], self._filename(matrix_uuid)
+        )
+
+    @staticmethod
+    def _filename(matrix_uuid):
+        return "{}.pkl".format(matrix_uuid)
+
+
 class MatrixStorageEngine(object):
     """Store matrices in a given project storage
 
@@ -402,6 +920,37 @@ class MatrixStore(object):
     def matrix_label_tuple(self, matrix_label_tuple):
         self._matrix_label_tuple = matrix_label_tuple
 
+    def matrix_label_chunks(self, chunk_size):
+        """Iterate over the matrix in consecutive chunks of rows, without loading all of
+        it into memory at once (unless it is already loaded)
+
+        Args:
+            chunk_size (int) The number of rows in each chunk
+
+        Yields: (tuple) of (pandas.DataFrame, pandas.Series) the design matrix and labels
+            of each chunk
+        """
+        if self._matrix_label_tuple:
+            design_matrix, labels = self._matrix_label_tuple
+            for start in range(0, len(design_matrix), chunk_size):
+                yield (
+                    design_matrix.iloc[start:(start + chunk_size)],
+                    labels.iloc[start:(start + chunk_size)],
+                )
+            return
+        for chunk in self._load_chunks(chunk_size):
+            yield self._preprocess_and_split_matrix(chunk)
+
+    def _load_chunks(self, chunk_size):
+        """Load the matrix from storage in consecutive chunks of rows
+
+        Storage formats that can be read a piece at a time override this; by default
+        the whole matrix is loaded and then split.
+        """
+        matrix = self._load()
+        for start in range(0, len(matrix), chunk_size):
+            yield matrix.iloc[start:(start + chunk_size)].copy()
+
     @property
     def design_matrix(self):
         """The matrix without the label vector, only the index and features"""
@@ -543,6 +1092,21 @@ class MatrixStore(object):
     def full_matrix_for_saving(self):
         return self.design_matrix.assign(**{self.label_column_name: self.labels})
 
+    def save_chunks(self, chunks):
+        """Save a matrix given as consecutive chunks of rows, and its metadata
+
+        Storage formats that can be appended to override this to write each chunk
+        as it arrives; by default the chunks are put together and saved at once.
+
+        Args:
+            chunks (iterable of pandas.DataFrame) Consecutive rows of the matrix,
+                indexed on entity_id and as_of_date and including the label column
+        """
+        matrix = pd.concat(list(chunks))
+        labels = matrix.pop(self.label_column_name)
+        self.matrix_label_tuple = matrix, labels
+        self.save()
+
     def load_metadata(self):
         """Load metadata from storage"""
         with self.metadata_base_store.open("rb") as fd:
@@ -586,11 +1150,26 @@ class CSVMatrixStore(MatrixStore):
         with self.matrix_base_store.open("rb") as fd:
             return pd.read_csv(fd, compression="gzip", parse_dates=["as_of_date"])
 
+    def _load_chunks(self, chunk_size):
+        with self.matrix_base_store.open("rb") as fd:
+            for chunk in pd.read_csv(
+                fd, compression="gzip", parse_dates=["as_of_date"], chunksize=chunk_size
+            ):
+                yield chunk
+
     def save(self):
         self.matrix_base_store.write(gzip.compress(self.full_matrix_for_saving.to_csv(None).encode("utf-8")))
         with self.metadata_base_store.open("wb") as fd:
             yaml.dump(self.metadata, fd, encoding="utf-8")
 
+    def save_chunks(self, chunks):
+        with self.matrix_base_store.open("wb") as fd:
+            with gzip.GzipFile(fileobj=fd, mode="wb") as gzipped:
+                for i, chunk in enumerate(chunks):
+                    gzipped.write(chunk.to_csv(None, header=(i == 0)).encode("utf-8"))
+        with self.metadata_base_store.open("wb") as fd:
+            yaml.dump(self.metadata, fd, encoding="utf-8")
+
 
 class TestMatrixType(object):
     string_name = "test"
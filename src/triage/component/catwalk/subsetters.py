@@ -13,10 +13,12 @@ class Subsetter(object):
         db_engine,
         replace,
         as_of_times,
+        run_id=None,
     ):
         self.db_engine = db_engine
         self.replace = replace
         self.as_of_times = as_of_times
+        self.run_id = run_id
 
     def generate_tasks(self, subset_configs):
         logging.info("Generating subset table creation tasks")
@@ -28,7 +30,8 @@ class Subsetter(object):
                     entity_date_table_name=get_subset_table_name(subset_config),
                     db_engine=self.db_engine,
                     query=subset_config["query"],
-                    replace=self.replace
+                    replace=self.replace,
+                    run_id=self.run_id,
                 )
                 subset_tasks.append(
                     {
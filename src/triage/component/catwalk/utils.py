@@ -8,7 +8,6 @@ import random
 from itertools import chain
 from functools import partial
 
-import postgres_copy
 import sqlalchemy
 from retrying import retry
 from sqlalchemy.orm import sessionmaker
@@ -22,6 +21,8 @@ from triage.component.results_schema import (
     ExperimentModel,
 )
 
+from .db import execute_cached
+
 
 def filename_friendly_hash(inputs):
     def dt_handler(x):
@@ -121,6 +122,116 @@ def missing_model_hashes(experiment_hash, db_engine):
     return [row[0] for row in db_engine.execute(query, experiment_hash)]
 
 
+@db_retry
+def matrix_dimensions(matrix_uuids, db_engine):
+    """Look up the row and feature counts of matrices
+
+    Args:
+        matrix_uuids (iterable) of matrix uuids
+        db_engine (sqlalchemy.engine)
+
+    Returns: (dict) matrix uuids mapped to tuples of their number of rows and
+        number of features, for only those matrices present in the matrices table
+    """
+    session = sessionmaker(bind=db_engine)()
+    try:
+        rows = (
+            session.query(Matrix.matrix_uuid, Matrix.num_observations, Matrix.feature_dictionary)
+            .filter(Matrix.matrix_uuid.in_(list(matrix_uuids)))
+            .all()
+        )
+    finally:
+        session.close()
+    return {
+        matrix_uuid: (
+            num_observations or 0,
+            sum(len(feature_names) for feature_names in (feature_dictionary or {}).values())
+        )
+        for matrix_uuid, num_observations, feature_dictionary in rows
+    }
+
+
+def matrix_footprints(matrix_uuids, db_engine):
+    """Estimate the in-memory size of matrices from their row and column counts
+
+    Matrices are downcast to 32-bit floats when loaded, so each value, including
+    the label, takes four bytes.
+
+    Args:
+        matrix_uuids (iterable) of matrix uuids
+        db_engine (sqlalchemy.engine)
+
+    Returns: (dict) matrix uuids mapped to their estimated size in bytes,
+        for only those matrices present in the matrices table
+    """
+    return {
+        matrix_uuid: 4.0 * num_rows * (num_features + 1)
+        for matrix_uuid, (num_rows, num_features)
+        in matrix_dimensions(matrix_uuids, db_engine).items()
+    }
+
+
+# How many of the latest models of each class previous_training_times looks up
+TRAINING_TIME_HISTORY_SIZE = 100
+
+
+@db_retry
+def previous_training_times(class_paths, db_engine, history_size=TRAINING_TIME_HISTORY_SIZE):
+    """Look up how long the latest previously trained models of the given classes took to train
+
+    Args:
+        class_paths (iterable) of estimator class paths
+        db_engine (sqlalchemy.engine)
+        history_size (int) The most models of each class to look up, latest first
+
+    Returns: (list) of tuples of class path, hyperparameters, training time in seconds,
+        and the number of rows and features in the train matrix, for each model
+        with a recorded training time
+    """
+    session = sessionmaker(bind=db_engine)()
+    try:
+        latest_models = (
+            session.query(
+                Model.model_type,
+                Model.hyperparameters,
+                Model.training_time,
+                Model.train_matrix_uuid,
+                sqlalchemy.func.row_number().over(
+                    partition_by=Model.model_type,
+                    order_by=Model.model_id.desc(),
+                ).label("recency"),
+            )
+            .filter(Model.model_type.in_(list(class_paths)))
+            .filter(Model.training_time.isnot(None))
+            .subquery()
+        )
+        rows = (
+            session.query(
+                latest_models.c.model_type,
+                latest_models.c.hyperparameters,
+                latest_models.c.training_time,
+                Matrix.num_observations,
+                Matrix.feature_dictionary,
+            )
+            .outerjoin(Matrix, latest_models.c.train_matrix_uuid == Matrix.matrix_uuid)
+            .filter(latest_models.c.recency <= history_size)
+            .all()
+        )
+    finally:
+        session.close()
+    return [
+        (
+            class_path,
+            hyperparameters or {},
+            training_time,
+            num_observations or 0,
+            sum(len(feature_names) for feature_names in (feature_dictionary or {}).values()),
+        )
+        for class_path, hyperparameters, training_time, num_observations, feature_dictionary
+        in rows
+    ]
+
+
 class Batch:
     # modified from
     # http://codereview.stackexchange.com/questions/118883/split-up-an-iterable-into-batches
@@ -150,6 +261,34 @@ class Batch:
             yield self.group()
 
 
+def balanced_batches(items, costs, n_batches):
+    """Split items into batches of roughly equal total cost
+
+    Uses the longest-processing-time-first heuristic: items are visited from most
+    to least expensive and each is placed into the batch with the lowest running total.
+
+    Args:
+        items (list) The items to split
+        costs (list of numbers) The estimated cost of each item, in the same order as items
+        n_batches (int) The number of batches to split the items into
+
+    Returns: (list) of lists of items, the most expensive batch first and
+        each batch ordered from most to least expensive item
+    """
+    if len(items) != len(costs):
+        raise ValueError("Expected one cost per item, got %s items and %s costs"
+                         % (len(items), len(costs)))
+    n_batches = max(1, min(n_batches, len(items)))
+    batches = [[] for _ in range(n_batches)]
+    totals = [0] * n_batches
+    for index in sorted(range(len(items)), key=lambda i: costs[i], reverse=True):
+        cheapest = totals.index(min(totals))
+        batches[cheapest].append(items[index])
+        totals[cheapest] += costs[index]
+    ordered = sorted(zip(totals, range(n_batches)), reverse=True)
+    return [batches[batch_index] for _, batch_index in ordered if batches[batch_index]]
+
+
 AVAILABLE_TIEBREAKERS = {'random', 'best', 'worst'}
 
 def sort_predictions_and_labels(predictions_proba, labels, tiebreaker='random', sort_seed=None, parallel_arrays=()):
@@ -195,6 +334,16 @@ def sort_predictions_and_labels(predictions_proba, labels, tiebreaker='random',
         return_value.append(tuple(numpy.flip(arr[mask]) for arr in parallel_arrays))
     return return_value
 
+
+# Model lookups run before training or predicting with each model
+_MODEL_ID_FROM_HASH = sqlalchemy.select([Model.model_id]).where(
+    Model.model_hash == sqlalchemy.bindparam("model_hash")
+)
+_MODEL_HASH_FROM_ID = sqlalchemy.select([Model.model_hash]).where(
+    Model.model_id == sqlalchemy.bindparam("model_id")
+)
+
+
 @db_retry
 def retrieve_model_id_from_hash(db_engine, model_hash):
     """Retrieves a model id from the database that matches the given hash
@@ -205,12 +354,8 @@ def retrieve_model_id_from_hash(db_engine, model_hash):
 
     Returns: (int) The model id (if found in DB), None (if not)
     """
-    session = sessionmaker(bind=db_engine)()
-    try:
-        saved = session.query(Model).filter_by(model_hash=model_hash).one_or_none()
-        return saved.model_id if saved else None
-    finally:
-        session.close()
+    rows = execute_cached(db_engine, _MODEL_ID_FROM_HASH, model_hash=model_hash)
+    return rows[0].model_id if rows else None
 
 
 @db_retry
@@ -220,42 +365,78 @@ def retrieve_model_hash_from_id(db_engine, model_id):
     Args:
         model_id (int) The id of a given model in the database
 
-    Returns: (str) the stored hash of the model
+    Returns: (str) the stored hash of the model, or None if the model is not found
     """
-    session = sessionmaker(bind=db_engine)()
-    try:
-        return session.query(Model).get(model_id).model_hash
-    finally:
-        session.close()
+    rows = execute_cached(db_engine, _MODEL_HASH_FROM_ID, model_id=model_id)
+    return rows[0].model_hash if rows else None
 
 
 def _write_csv(file_like, db_objects, type_of_object):
     writer = csv.writer(file_like, quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
+    # attributes may be named differently from their columns, e.g. for_ for 'for'
+    attribute_names = [
+        type_of_object.__mapper__.get_property_by_column(col).key
+        for col in type_of_object.__table__.columns
+    ]
     for db_object in db_objects:
         if type(db_object) != type_of_object:
             raise TypeError("Cannot copy collection of objects to db as they are not all "
                             f"of the same type. First object was {type_of_object} "
                             f"and later encountered a {type(db_object)}")
         writer.writerow(
-            [getattr(db_object, col.name) for col in db_object.__table__.columns]
+            [getattr(db_object, attribute_name) for attribute_name in attribute_names]
         )
 
 
-@db_retry
-def save_db_objects(db_engine, db_objects):
-    """Saves a collection of SQLAlchemy model objects to the database using a COPY command
+def copy_db_objects(connection, db_objects):
+    """Copies a collection of SQLAlchemy model objects to the database, without committing
+
+    None is saved as null, except in columns that cannot be null,
+    where empty strings are saved as empty strings rather than nulls
 
     Args:
-        db_engine (sqlalchemy.engine)
+        connection A DBAPI connection, whose open transaction the rows are added in
+            (e.g. the .connection of a sqlalchemy connection)
         db_objects (iterable) SQLAlchemy model objects, corresponding to a valid table
     """
     db_objects = iter(db_objects)
     first_object = next(db_objects)
     type_of_object = type(first_object)
+    table = type_of_object.__table__
+    relation = ".".join('"{}"'.format(part) for part in (table.schema, table.name) if part)
+    not_null_columns = ", ".join(
+        '"{}"'.format(col.name) for col in table.columns if not col.nullable
+    )
+    # the columns are named, as migrations may have left them in another order in the table
+    columns = ", ".join('"{}"'.format(col.name) for col in table.columns)
+    copy_sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv{})".format(
+        relation,
+        columns,
+        ", FORCE_NOT_NULL ({})".format(not_null_columns) if not_null_columns else "",
+    )
 
     with PipeTextIO(partial(
             _write_csv,
             db_objects=chain((first_object,), db_objects),
             type_of_object=type_of_object
     )) as pipe:
-        postgres_copy.copy_from(pipe, type_of_object, db_engine, format="csv")
+        connection.cursor().copy_expert(copy_sql, pipe)
+
+
+@db_retry
+def save_db_objects(db_engine, db_objects):
+    """Saves a collection of SQLAlchemy model objects to the database using a COPY command
+
+    None is saved as null, except in columns that cannot be null,
+    where empty strings are saved as empty strings rather than nulls
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        db_objects (iterable) SQLAlchemy model objects, corresponding to a valid table
+    """
+    conn = db_engine.raw_connection()
+    try:
+        copy_db_objects(conn, db_objects)
+        conn.commit()
+    finally:
+        conn.close()
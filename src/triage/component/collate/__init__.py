@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 from .collate import available_imputations, Aggregation, Aggregate, Compare, Categorical
-from .from_obj import FromObj
+from .from_obj import FromObj, CohortFilteredFromObj
 from .spacetime import SpacetimeAggregation
 
 __all__ = [
@@ -8,6 +8,7 @@ __all__ = [
     "Aggregation",
     "Aggregate",
     "FromObj",
+    "CohortFilteredFromObj",
     "Compare",
     "Categorical",
     "SpacetimeAggregation",
@@ -694,6 +694,54 @@ class Aggregation(object):
             group=self.state_group,
         )
 
+    def get_null_counts_table_name(self):
+        """
+        Returns name for the table holding the null counts of the aggregation table
+        """
+        schema = '"%s".' % self.schema if self.schema else ""
+        return '%s"%s_%s_null_counts"' % (schema, self.prefix, self.suffix)
+
+    def get_null_counts_drop(self):
+        """
+        Generate a drop table statement for the null counts table
+        Returns: string sql query
+        """
+        return "DROP TABLE IF EXISTS %s" % self.get_null_counts_table_name()
+
+    def get_null_counts_create(self):
+        """
+        Generate a query that counts the nulls in every column of the aggregation table
+        in a single scan, and stores them as one (column_name, null_count) row per column
+
+        Returns: a CREATE TABLE AS query
+        """
+        columns = list(self.get_imputation_rules().keys())
+        counts_sql = ",\n".join(
+            """SUM(CASE WHEN "{col}" IS NULL THEN 1 ELSE 0 END)""".format(col=column)
+            for column in columns
+        )
+        names_sql = ", ".join("'%s'" % column.replace("'", "''") for column in columns)
+        query = """
+            SELECT column_name, null_count
+            FROM (
+                SELECT ARRAY[{counts}]::BIGINT[] AS null_counts
+                {from_clause}
+            ) counts,
+            UNNEST(ARRAY[{names}]::TEXT[], counts.null_counts) AS t(column_name, null_count)
+            """.format(
+            counts=counts_sql,
+            names=names_sql,
+            from_clause=self._null_counts_from(),
+        )
+        return "CREATE TABLE %s AS (%s)" % (self.get_null_counts_table_name(), query)
+
+    def _null_counts_from(self):
+        return "FROM %s t1 LEFT JOIN %s t2 USING(%s)" % (
+            self.state_table,
+            self.get_table_name(),
+            self.state_group,
+        )
+
     def _get_impute_select(self, impute_cols, nonimpute_cols, partitionby=None):
 
         imprules = self.get_imputation_rules()
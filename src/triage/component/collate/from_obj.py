@@ -1,4 +1,7 @@
+import hashlib
+import json
 import logging
+from triage.database_reflection import table_exists
 from triage.validation_primitives import (
     table_should_exist,
     table_should_have_column,
@@ -88,3 +91,101 @@ class FromObj(object):
             'Successfully found configured knowledge date column in %s',
             self.materialized_table
         )
+
+
+class CohortFilteredFromObj(FromObj):
+    """A from_obj materialized with only the rows that can contribute to features
+
+    Rows are restricted to entities that appear in the cohort table at any date
+    and to knowledge dates within the feature date window. The resulting table is
+    ordered and indexed by (entity_id, knowledge date) and analyzed, so per-date
+    joins against the cohort only touch the relevant rows.
+
+    The table name is a hash of the from_obj text, the cohort table (whose name
+    contains the cohort hash), the knowledge date column and the date window, so the
+    same table can be shared by all aggregations with that from_obj and reused by
+    later runs.
+    """
+    def __init__(
+        self,
+        from_obj,
+        schema,
+        knowledge_date_column,
+        cohort_table,
+        max_date,
+        min_date=None,
+    ):
+        super().__init__(
+            from_obj=from_obj,
+            name=schema,
+            knowledge_date_column=knowledge_date_column
+        )
+        self.schema = schema
+        self.cohort_table = cohort_table
+        self.max_date = max_date
+        self.min_date = min_date
+
+    @property
+    def prefilter_hash(self):
+        return hashlib.md5(
+            json.dumps(
+                [
+                    self.from_obj,
+                    self.cohort_table,
+                    self.knowledge_date_column,
+                    str(self.min_date),
+                    str(self.max_date),
+                ]
+            ).encode("utf-8")
+        ).hexdigest()
+
+    @property
+    def materialized_table(self):
+        return f"{self.schema}.from_obj_{self.prefilter_hash}"
+
+    @property
+    def create_materialized_table_sql(self):
+        min_date_clause = (
+            f" and from_obj.{self.knowledge_date_column} >= '{self.min_date}'::date"
+            if self.min_date is not None
+            else ""
+        )
+        return (
+            f"create table {self.materialized_table} as ("
+            f"select from_obj.* from (select * from {self.from_obj}) from_obj "
+            f"where from_obj.entity_id in (select distinct entity_id from {self.cohort_table}) "
+            f"and from_obj.{self.knowledge_date_column} < '{self.max_date}'::date"
+            f"{min_date_clause} "
+            f"order by from_obj.entity_id, from_obj.{self.knowledge_date_column})"
+        )
+
+    @property
+    def index_materialized_table_sql(self):
+        return (
+            f"create index on {self.materialized_table} "
+            f"(entity_id, {self.knowledge_date_column})"
+        )
+
+    @property
+    def analyze_materialized_table_sql(self):
+        return f"analyze {self.materialized_table}"
+
+    def should_materialize(self):
+        return True
+
+    def maybe_materialize(self, db_engine, replace=True):
+        if not replace and table_exists(self.materialized_table, db_engine):
+            logging.info(
+                "Reusing cohort-filtered table %s for from_obj %s",
+                self.materialized_table,
+                self.from_obj
+            )
+            return
+        logging.info("Creating cohort-filtered table for from_obj %s", self.from_obj)
+        db_engine.execute(self.drop_materialized_table_sql)
+        db_engine.execute(self.create_materialized_table_sql)
+        logging.info("Created table to hold from_obj. New table: %s", self.materialized_table)
+        self.validate(db_engine)
+        db_engine.execute(self.index_materialized_table_sql)
+        db_engine.execute(self.analyze_materialized_table_sql)
+        logging.info("Indexed and analyzed from_obj table: %s", self.materialized_table)
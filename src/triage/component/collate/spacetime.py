@@ -362,6 +362,14 @@ class SpacetimeAggregation(Aggregation):
             date_col=self.output_date_column,
         )
 
+    def _null_counts_from(self):
+        return "FROM %s t1 LEFT JOIN %s t2 USING(%s, %s)" % (
+            self._state_table_sub(),
+            self.get_table_name(),
+            self.state_group,
+            self.output_date_column,
+        )
+
     def get_impute_create(self, impute_cols, nonimpute_cols):
         """
         Generates the CREATE TABLE query for the aggregation table with imputation.
@@ -21,6 +21,9 @@ from .schema import (
     ExperimentRunStatus,
     Model,
     ModelGroup,
+    QueryRuntime,
+    TaskMemoryUsage,
+    PrunedModelGroup,
     Subset,
     TestEvaluation,
     TrainEvaluation,
@@ -46,6 +49,9 @@ __all__ = (
     "ExperimentRunStatus",
     "Model",
     "ModelGroup",
+    "QueryRuntime",
+    "TaskMemoryUsage",
+    "PrunedModelGroup",
     "Subset",
     "TestEvaluation",
     "TrainEvaluation",
@@ -0,0 +1,36 @@
+"""add task memory usage
+
+Revision ID: 3ce8b3f2c4b1
+Revises: a98acf92fd48
+Create Date: 2019-06-10 14:21:05.112387
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3ce8b3f2c4b1'
+down_revision = 'a98acf92fd48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('task_memory_usage',
+    sa.Column('model_hash', sa.String(), nullable=False),
+    sa.Column('test_matrix_uuid', sa.String(), nullable=False),
+    sa.Column('class_path', sa.String(), nullable=True),
+    sa.Column('matrix_bytes', sa.Float(), nullable=True),
+    sa.Column('estimated_memory', sa.Float(), nullable=True),
+    sa.Column('peak_rss', sa.Float(), nullable=True),
+    sa.Column('run_id', sa.Integer(), nullable=True),
+    sa.Column('last_updated_time', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['run_id'], ['model_metadata.experiment_runs.id'], ),
+    sa.PrimaryKeyConstraint('model_hash', 'test_matrix_uuid'),
+    schema='model_metadata'
+    )
+
+
+def downgrade():
+    op.drop_table('task_memory_usage', schema='model_metadata')
@@ -0,0 +1,24 @@
+"""add training time to models
+
+Revision ID: 7c4e1f0b9a2d
+Revises: 3ce8b3f2c4b1
+Create Date: 2019-06-17 10:42:31.508214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c4e1f0b9a2d'
+down_revision = '3ce8b3f2c4b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('models', sa.Column('training_time', sa.Float(), nullable=True), schema='model_metadata')
+
+
+def downgrade():
+    op.drop_column('models', 'training_time', schema='model_metadata')
@@ -0,0 +1,33 @@
+"""add query runtimes
+
+Revision ID: a98acf92fd48
+Revises: b4d7569d31cb
+Create Date: 2019-06-03 10:42:17.501944
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a98acf92fd48'
+down_revision = 'b4d7569d31cb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('query_runtimes',
+    sa.Column('query_hash', sa.String(), nullable=False),
+    sa.Column('table_name', sa.String(), nullable=True),
+    sa.Column('runtime', sa.Float(), nullable=True),
+    sa.Column('run_id', sa.Integer(), nullable=True),
+    sa.Column('last_updated_time', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['run_id'], ['model_metadata.experiment_runs.id'], ),
+    sa.PrimaryKeyConstraint('query_hash'),
+    schema='model_metadata'
+    )
+
+
+def downgrade():
+    op.drop_table('query_runtimes', schema='model_metadata')
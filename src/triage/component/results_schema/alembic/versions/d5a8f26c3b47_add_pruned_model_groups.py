@@ -0,0 +1,41 @@
+"""add pruned model groups
+
+Revision ID: d5a8f26c3b47
+Revises: 7c4e1f0b9a2d
+Create Date: 2019-06-24 16:05:12.734019
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a8f26c3b47'
+down_revision = '7c4e1f0b9a2d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('pruned_model_groups',
+    sa.Column('experiment_hash', sa.String(), nullable=False),
+    sa.Column('model_group_id', sa.Integer(), nullable=False),
+    sa.Column('run_id', sa.Integer(), nullable=True),
+    sa.Column('last_train_end_time', sa.DateTime(), nullable=True),
+    sa.Column('metric', sa.String(), nullable=True),
+    sa.Column('parameter', sa.String(), nullable=True),
+    sa.Column('mean_dist_from_best', sa.Float(), nullable=True),
+    sa.Column('rank', sa.Integer(), nullable=True),
+    sa.Column('num_model_groups_ranked', sa.Integer(), nullable=True),
+    sa.Column('reason', sa.Text(), nullable=True),
+    sa.Column('pruned_time', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['experiment_hash'], ['model_metadata.experiments.experiment_hash'], ),
+    sa.ForeignKeyConstraint(['model_group_id'], ['model_metadata.model_groups.model_group_id'], ),
+    sa.ForeignKeyConstraint(['run_id'], ['model_metadata.experiment_runs.id'], ),
+    sa.PrimaryKeyConstraint('experiment_hash', 'model_group_id'),
+    schema='model_metadata'
+    )
+
+
+def downgrade():
+    op.drop_table('pruned_model_groups', schema='model_metadata')
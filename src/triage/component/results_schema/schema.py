@@ -161,6 +161,7 @@ class Model(Base):
     training_label_timespan = Column(Interval)
     model_size = Column(Float)
     random_seed = Column(Integer)
+    training_time = Column(Float)
 
     model_group_rel = relationship("ModelGroup")
     matrix_rel = relationship("Matrix")
@@ -538,3 +539,64 @@ class ExperimentRun(Base):
     stacktrace = Column(Text)
 
     experiment_rel = relationship("Experiment")
+
+
+class QueryRuntime(Base):
+
+    __tablename__ = "query_runtimes"
+    __table_args__ = {"schema": "model_metadata"}
+
+    query_hash = Column(String, primary_key=True)
+    table_name = Column(String)
+    runtime = Column(Float)
+    run_id = Column(Integer, ForeignKey("model_metadata.experiment_runs.id"))
+    last_updated_time = Column(DateTime)
+
+    run_rel = relationship("ExperimentRun")
+
+
+class TaskMemoryUsage(Base):
+
+    __tablename__ = "task_memory_usage"
+    __table_args__ = {"schema": "model_metadata"}
+
+    model_hash = Column(String, primary_key=True)
+    test_matrix_uuid = Column(String, primary_key=True)
+    class_path = Column(String)
+    matrix_bytes = Column(Float)
+    estimated_memory = Column(Float)
+    peak_rss = Column(Float)
+    run_id = Column(Integer, ForeignKey("model_metadata.experiment_runs.id"))
+    last_updated_time = Column(DateTime)
+
+    run_rel = relationship("ExperimentRun")
+
+
+class PrunedModelGroup(Base):
+
+    __tablename__ = "pruned_model_groups"
+    __table_args__ = {"schema": "model_metadata"}
+
+    experiment_hash = Column(
+        String,
+        ForeignKey("model_metadata.experiments.experiment_hash"),
+        primary_key=True
+    )
+    model_group_id = Column(
+        Integer,
+        ForeignKey("model_metadata.model_groups.model_group_id"),
+        primary_key=True
+    )
+    run_id = Column(Integer, ForeignKey("model_metadata.experiment_runs.id"))
+    last_train_end_time = Column(DateTime)
+    metric = Column(String)
+    parameter = Column(String)
+    mean_dist_from_best = Column(Float)
+    rank = Column(Integer)
+    num_model_groups_ranked = Column(Integer)
+    reason = Column(Text)
+    pruned_time = Column(DateTime(timezone=True), server_default=func.now())
+
+    experiment_rel = relationship("Experiment")
+    model_group_rel = relationship("ModelGroup")
+    run_rel = relationship("ExperimentRun")
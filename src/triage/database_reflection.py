@@ -99,6 +99,29 @@ def table_row_count(table_name, db_engine):
     )
 
 
+def table_has_index(table_name, columns, db_engine):
+    """Check whether the table has an index on exactly the given columns
+
+    The table is expected to exist.
+
+    Args:
+        table_name (string) A table name (with schema)
+        columns (list) The indexed column names, in order
+        db_engine (sqlalchemy.engine)
+
+    Returns: (boolean) Whether or not the table has such an index
+    """
+    indexed_columns = "({})".format(", ".join(columns))
+    return any(
+        index_definition.endswith(indexed_columns)
+        for (index_definition,) in db_engine.execute(
+            "select pg_get_indexdef(indexrelid) from pg_index "
+            "where indrelid = %s::regclass",
+            table_name,
+        )
+    )
+
+
 def table_has_column(table_name, column, db_engine):
     """Check whether the table contains a column of the given name
 
@@ -36,8 +36,10 @@ from triage.component.catwalk import (
     IndividualImportanceCalculator,
     ModelGrouper,
     ModelTrainTester,
-    Subsetter
+    Subsetter,
 )
+from triage.component.audition.model_group_pruning import ModelGroupPruner
+from triage.component.catwalk.evaluation import DEFAULT_EVALUATION_BUFFER_SIZE
 from triage.component.catwalk.protected_groups_generators import (
     ProtectedGroupsGenerator,
     ProtectedGroupsGeneratorNoOp,
@@ -51,8 +53,10 @@ from triage.component.catwalk.utils import (
     missing_model_hashes,
     filename_friendly_hash,
 )
+from triage.component.catwalk.db import DB_STATS, track_engine
 from triage.component.catwalk.storage import (
     CSVMatrixStore,
+    MODEL_CACHE,
     ModelStorageEngine,
     ProjectStorage,
     MatrixStorageEngine,
@@ -100,10 +104,39 @@ class ExperimentBase(ABC):
         materialize_subquery_fromobjs (bool, default True) Whether or not to create and index
             tables for feature "from objects" that are subqueries. Can speed up performance
             when building features for many as-of-dates.
+        prefilter_fromobjs (bool, default False) Whether or not to create tables for all
+            feature "from objects" that only hold rows for cohort entities within the
+            feature date window, indexed by entity and knowledge date. Can speed up
+            performance when the cohort is small relative to the source tables.
+        extract_feature_supersets (bool, default False) Whether or not to extract features
+            once for all matrices that share the same rows (e.g. the matrices of different
+            feature groups) and build each matrix as a projection of that extraction.
+        cache_feature_slices (bool, default False) Whether or not to cache the rows of each
+            feature table for each as-of-date in project storage and assemble matrices out
+            of these slices, so overlapping matrices extract each as-of-date only once.
+            Slices are kept between runs, and deleted when the feature tables are
+            rebuilt.
+        matrix_stream_chunk_size (int, optional) If given, matrices are streamed from the
+            database into storage this many rows at a time instead of being built in
+            memory, so building a matrix needs memory for one chunk rather than the whole
+            matrix. Does not apply to feature supersets or cached feature slices.
+        out_of_core_chunk_size (int, optional) If given, estimators that implement
+            partial_fit are trained on their train matrix this many rows at a time, as it
+            is read from storage, and no predictions are made on train matrices.
+        model_serialization (string, default 'compressed') How trained models are saved:
+            'compressed' (smallest), 'fast' (quicker to save and load) or 'mmap'
+            (uncompressed, and memory-mapped when loaded from the local filesystem)
+        model_cache_mb (int, optional) If given, loaded models are kept in a cache shared
+            by everything in the process that loads models, evicting the least recently
+            used once the models in it take more than this many megabytes
         profile (bool)
     """
 
     cleanup_timeout = 60  # seconds
+    # the number of database connections to use at once for steps that can use several
+    n_db_processes = 1
+    # the number of processes train/test tasks are spread across
+    n_processes = 1
 
     def __init__(
         self,
@@ -116,6 +149,13 @@ class ExperimentBase(ABC):
         cleanup_timeout=None,
         materialize_subquery_fromobjs=True,
         features_ignore_cohort=False,
+        prefilter_fromobjs=False,
+        extract_feature_supersets=False,
+        cache_feature_slices=False,
+        matrix_stream_chunk_size=None,
+        out_of_core_chunk_size=None,
+        model_serialization="compressed",
+        model_cache_mb=None,
         profile=False,
         save_predictions=True,
         skip_validation=False,
@@ -140,7 +180,11 @@ class ExperimentBase(ABC):
         random.seed(self.config['random_seed'])
 
         self.project_storage = ProjectStorage(project_path)
-        self.model_storage_engine = ModelStorageEngine(self.project_storage)
+        self.model_storage_engine = ModelStorageEngine(
+            self.project_storage, serialization=model_serialization
+        )
+        if model_cache_mb:
+            MODEL_CACHE.resize(model_cache_mb * 1024 * 1024)
         self.matrix_storage_engine = MatrixStorageEngine(
             self.project_storage, matrix_storage_class
         )
@@ -148,12 +192,17 @@ class ExperimentBase(ABC):
         self.replace = replace
         self.save_predictions = save_predictions
         self.skip_validation = skip_validation
-        self.db_engine = db_engine
+        self.db_engine = track_engine(db_engine)
         results_schema.upgrade_if_clean(dburl=self.db_engine.url)
 
         self.features_schema_name = "features"
         self.materialize_subquery_fromobjs = materialize_subquery_fromobjs
         self.features_ignore_cohort = features_ignore_cohort
+        self.prefilter_fromobjs = prefilter_fromobjs
+        self.extract_feature_supersets = extract_feature_supersets
+        self.cache_feature_slices = cache_feature_slices
+        self.matrix_stream_chunk_size = matrix_stream_chunk_size
+        self.out_of_core_chunk_size = out_of_core_chunk_size
 
         # only fill default values for full runs
         if not partial_run:
@@ -214,6 +263,14 @@ class ExperimentBase(ABC):
                 "Will not run experiment.".format(config_version, CONFIG_VERSION)
             )
 
+    @property
+    def feature_slice_storage_engine(self):
+        if not self.cache_feature_slices:
+            return None
+        # slices are shared by every run of the experiment until its feature tables
+        # are rebuilt, when they're deleted
+        return self.project_storage.feature_slice_storage_engine(self.experiment_hash)
+
     @cachedproperty
     def cohort_hash(self):
         if "query" in self.config.get("cohort_config", {}):
@@ -236,7 +293,9 @@ class ExperimentBase(ABC):
                 entity_date_table_name=self.cohort_table_name,
                 db_engine=self.db_engine,
                 query=cohort_config["query"],
-                replace=self.replace
+                replace=self.replace,
+                n_db_processes=self.n_db_processes,
+                run_id=self.run_id,
             )
         else:
             logging.warning(
@@ -281,7 +340,10 @@ class ExperimentBase(ABC):
                 entity_id_column=bias_config.get("entity_id_column", None),
                 knowledge_date_column=bias_config.get("knowledge_date_column", None),
                 protected_groups_table_name=self.protected_groups_table_name,
-                replace=self.replace
+                replace=self.replace,
+                storage_engine=self.project_storage.protected_groups_storage_engine(
+                    self.protected_groups_table_name
+                ),
             )
         else:
             self.protected_groups_generator = ProtectedGroupsGeneratorNoOp()
@@ -300,7 +362,9 @@ class ExperimentBase(ABC):
             db_engine=self.db_engine,
             feature_start_time=split_config["feature_start_time"],
             materialize_subquery_fromobjs=self.materialize_subquery_fromobjs,
-            features_ignore_cohort=self.features_ignore_cohort
+            features_ignore_cohort=self.features_ignore_cohort,
+            run_id=self.run_id,
+            prefilter_fromobjs=self.prefilter_fromobjs,
         )
 
         self.feature_group_creator = FeatureGroupCreator(
@@ -311,6 +375,7 @@ class ExperimentBase(ABC):
             self.config.get("feature_group_strategies", ["all"])
         )
 
+        negative_downsampling_config = self.config.get("negative_downsampling", {})
         self.planner = Planner(
             feature_start_time=dt_from_str(split_config["feature_start_time"]),
             label_names=[
@@ -319,6 +384,8 @@ class ExperimentBase(ABC):
             label_types=["binary"],
             cohort_names=[self.config.get("cohort_config", {}).get("name", None)],
             user_metadata=self.config.get("user_metadata", {}),
+            negative_sample_rate=negative_downsampling_config.get("rate"),
+            negative_sample_seed=negative_downsampling_config.get("random_seed", 0),
         )
 
         self.matrix_builder = MatrixBuilder(
@@ -336,12 +403,17 @@ class ExperimentBase(ABC):
             engine=self.db_engine,
             replace=self.replace,
             run_id=self.run_id,
+            feature_slice_storage_engine=self.feature_slice_storage_engine,
+            stream_chunk_size=self.matrix_stream_chunk_size,
+            negative_sample_rate=negative_downsampling_config.get("rate"),
+            negative_sample_seed=negative_downsampling_config.get("random_seed", 0),
         )
 
         self.subsetter = Subsetter(
             db_engine=self.db_engine,
             replace=self.replace,
-            as_of_times=self.all_as_of_times
+            as_of_times=self.all_as_of_times,
+            run_id=self.run_id,
         )
 
         self.trainer = ModelTrainer(
@@ -351,6 +423,7 @@ class ExperimentBase(ABC):
             db_engine=self.db_engine,
             replace=self.replace,
             run_id=self.run_id,
+            out_of_core_chunk_size=self.out_of_core_chunk_size,
         )
 
         self.predictor = Predictor(
@@ -366,15 +439,30 @@ class ExperimentBase(ABC):
             n_ranks=self.config.get("individual_importance", {}).get("n_ranks", 5),
             methods=self.config.get("individual_importance", {}).get("methods", ["uniform"]),
             replace=self.replace,
+            model_storage_engine=self.model_storage_engine,
+            n_jobs=self.config.get("individual_importance", {}).get("n_jobs", 1),
         )
 
         self.evaluator = ModelEvaluator(
             db_engine=self.db_engine,
             testing_metric_groups=self.config.get("scoring", {}).get("testing_metric_groups", []),
             training_metric_groups=self.config.get("scoring", {}).get("training_metric_groups", []),
-            bias_config=self.config.get("bias_audit_config", {})
+            bias_config=self.config.get("bias_audit_config", {}),
+            evaluation_buffer_size=DEFAULT_EVALUATION_BUFFER_SIZE,
         )
 
+        pruning_config = self.config.get("model_group_pruning")
+        if pruning_config:
+            self.model_group_pruner = ModelGroupPruner(
+                db_engine=self.db_engine,
+                metric=pruning_config["metric"],
+                parameter=pruning_config["parameter"],
+                keep_fraction=pruning_config.get("keep_fraction", 0.5),
+                min_model_groups=pruning_config.get("min_model_groups", 1),
+            )
+        else:
+            self.model_group_pruner = None
+
         self.model_train_tester = ModelTrainTester(
             matrix_storage_engine=self.matrix_storage_engine,
             model_evaluator=self.evaluator,
@@ -383,7 +471,9 @@ class ExperimentBase(ABC):
             predictor=self.predictor,
             subsets=self.subsets,
             protected_groups_generator=self.protected_groups_generator,
-            cohort_hash=self.cohort_hash
+            cohort_hash=self.cohort_hash,
+            n_processes=self.n_processes,
+            out_of_core_chunk_size=self.out_of_core_chunk_size,
         )
 
     def get_for_update(self):
@@ -690,8 +780,22 @@ class ExperimentBase(ABC):
     def process_matrix_build_tasks(self, matrix_build_tasks):
         pass
 
+    def process_superset_build_tasks(self, superset_build_tasks):
+        """Builds feature superset matrices and slices them into the matrices of each task
+
+        Runs in the experiment's process unless overridden, so that experiment classes
+        written before supersets existed still work.
+
+        Args:
+            superset_build_tasks (dict) as returned by Planner.superset_build_tasks
+        """
+        self.matrix_builder.build_all_superset_matrices(superset_build_tasks)
+
     @experiment_entrypoint
     def generate_preimputation_features(self):
+        if any(self.feature_aggregation_table_tasks.values()):
+            # slices cut from the feature tables being rebuilt would be out of date
+            self.clean_up_feature_slices()
         self.process_query_tasks(self.feature_aggregation_table_tasks)
         logging.info(
             "Finished running preimputation feature queries. The final results are in tables: %s",
@@ -717,7 +821,19 @@ class ExperimentBase(ABC):
         with self.get_for_update() as experiment:
             experiment.matrices_needed = len(self.matrix_build_tasks.keys())
         record_matrix_building_started(self.run_id, self.db_engine)
-        self.process_matrix_build_tasks(self.matrix_build_tasks)
+        if self.replace:
+            # entity date tables are shared between matrices and named after their rows,
+            # so drop any left behind by an earlier run that may be out of date
+            self.clean_up_entity_date_tables()
+        try:
+            if self.extract_feature_supersets:
+                self.process_superset_build_tasks(
+                    self.planner.superset_build_tasks(self.matrix_build_tasks)
+                )
+            else:
+                self.process_matrix_build_tasks(self.matrix_build_tasks)
+        finally:
+            self.clean_up_entity_date_tables()
 
     @experiment_entrypoint
     def generate_matrices(self):
@@ -753,11 +869,105 @@ class ExperimentBase(ABC):
             model_comment=self.config.get('model_comment', None)
         )
 
+    def _task_model_group_id(self, task):
+        return self.trainer.model_grouper.get_model_group_id(
+            task['train_kwargs']['class_path'],
+            self.trainer.unique_parameters(task['train_kwargs']['parameters']),
+            task['train_store'].metadata,
+            self.db_engine,
+        )
+
+    def _train_and_test_models_with_pruning(self):
+        """Train and test models one split at a time, pruning model groups in between
+
+        Every model group is trained on the earliest splits (as many as the
+        configured initial_splits), and then the model groups that are furthest from
+        the best on the splits so far are pruned before training on each later split.
+        Baselines are never pruned.
+        """
+        if "grid_config" not in self.config:
+            logging.warning(
+                "No grid_config was passed in the experiment config. No models will be trained"
+            )
+            return
+        splits = sorted(
+            self.full_matrix_definitions,
+            key=lambda split: split["train_matrix"]["matrix_info_end_time"]
+        )
+        initial_splits = self.config["model_group_pruning"].get("initial_splits", 1)
+        rounds = [splits[:initial_splits]] + [[split] for split in splits[initial_splits:]]
+
+        with self.get_for_update() as experiment:
+            experiment.grid_size = sum(
+                1 for _param in self.trainer.flattened_grid_config(self.config.get('grid_config')))
+        record_model_building_started(self.run_id, self.db_engine)
+
+        kept_model_group_ids = None
+        trained_model_hashes = set()
+        for round_number, round_splits in enumerate(rounds, 1):
+            batches = self.model_train_tester.generate_task_batches(
+                splits=round_splits,
+                grid_config=self.config.get('grid_config'),
+                model_comment=self.config.get('model_comment', None)
+            )
+            model_group_ids = {
+                task['train_kwargs']['model_hash']: self._task_model_group_id(task)
+                for batch in batches for task in batch.tasks
+            }
+            if kept_model_group_ids is not None:
+                batches = [
+                    batch._replace(
+                        tasks=[
+                            task for task in batch.tasks
+                            if model_group_ids[task['train_kwargs']['model_hash']]
+                            in kept_model_group_ids
+                        ],
+                    )
+                    for batch in batches
+                ]
+            model_hashes = set(
+                task['train_kwargs']['model_hash'] for batch in batches for task in batch.tasks
+            )
+            associate_models_with_experiment(self.experiment_hash, model_hashes, self.db_engine)
+            with self.get_for_update() as experiment:
+                experiment.models_needed = len(trained_model_hashes | model_hashes)
+            logging.info(
+                "Pruning round %s of %s: training %s models on %s splits",
+                round_number,
+                len(rounds),
+                len(model_hashes),
+                len(round_splits),
+            )
+            self.process_train_test_batches(batches)
+            trained_model_hashes |= model_hashes
+
+            if round_number < len(rounds):
+                round_model_group_ids = set(
+                    model_group_ids[model_hash] for model_hash in model_hashes
+                )
+                baseline_model_group_ids = set(
+                    model_group_ids[task['train_kwargs']['model_hash']]
+                    for batch in batches for task in batch.tasks
+                    if task['train_kwargs']['class_path'].startswith(
+                        'triage.component.catwalk.baselines'
+                    )
+                )
+                kept_model_group_ids = self.model_group_pruner.prune(
+                    model_group_ids=round_model_group_ids,
+                    model_hashes=trained_model_hashes,
+                    experiment_hash=self.experiment_hash,
+                    run_id=self.run_id,
+                    protected_model_group_ids=baseline_model_group_ids,
+                )
+
     @experiment_entrypoint
     def train_and_test_models(self):
         self.generate_subsets()
         logging.info("Creating protected groups table")
         self.generate_protected_groups()
+        if self.model_group_pruner:
+            self._train_and_test_models_with_pruning()
+            return
         batches = self._all_train_test_batches()
         if not batches:
             logging.warning("No train/test tasks found, so no training to do")
@@ -822,12 +1032,27 @@ class ExperimentBase(ABC):
         else:
             logging.info("All matrices that were supposed to be build were built. Awesome!")
 
+        if MODEL_CACHE.enabled:
+            logging.info("Model cache statistics: %s", MODEL_CACHE.stats())
+        logging.info("Database statistics: %s", DB_STATS.stats())
+
     def clean_up_matrix_building_tables(self):
         logging.info("Cleaning up cohort and labels tables")
         with timeout(self.cleanup_timeout):
             self.cohort_table_generator.clean_up()
             self.label_generator.clean_up(self.labels_table_name)
 
+    def clean_up_entity_date_tables(self):
+        logging.info("Cleaning up matrix entity date tables")
+        self.matrix_builder.clean_up_entity_date_tables(self.matrix_build_tasks.values())
+
+    def clean_up_feature_slices(self):
+        if self.cache_feature_slices:
+            logging.info(
+                "Cleaning up feature slices of experiment %s", self.experiment_hash
+            )
+            self.feature_slice_storage_engine.delete_all()
+
     def clean_up_subset_tables(self):
         logging.info("Cleaning up cohort and labels tables")
         with timeout(self.cleanup_timeout):
@@ -1,16 +1,46 @@
 import logging
+import resource
 import traceback
+from concurrent.futures import wait, FIRST_COMPLETED
 from functools import partial
 from pebble import ProcessPool
 from multiprocessing.reduction import ForkingPickler
 
-from triage.component.catwalk.utils import Batch
+from triage.component.catwalk.utils import Batch, matrix_footprints
+from triage.tracking import previous_memory_multipliers, record_task_memory
 
 from triage.experiments import ExperimentBase
 
+# how many times the size of its matrices a train/test task is assumed to use in memory
+# for estimators that haven't been measured yet
+DEFAULT_MEMORY_MULTIPLIER = 5.0
+
 
 class MultiCoreExperiment(ExperimentBase):
-    def __init__(self, config, db_engine, *args, n_processes=1, n_db_processes=1, **kwargs):
+    """Run an experiment using several processes
+
+    Args:
+        n_processes (int) How many processes to use for matrix building and
+            model training/testing
+        n_db_processes (int) How many processes to use for database-bound steps
+            like feature generation
+        memory_budget_mb (int, optional) If given, parallel train/test tasks are only
+            started while the memory they are estimated to use, all together, fits
+            within this many megabytes, and the peak memory each task used is recorded
+            so later estimates are more accurate
+
+    For all other arguments see triage.experiments.ExperimentBase
+    """
+    def __init__(
+        self,
+        config,
+        db_engine,
+        *args,
+        n_processes=1,
+        n_db_processes=1,
+        memory_budget_mb=None,
+        **kwargs
+    ):
         try:
             ForkingPickler.dumps(db_engine)
         except Exception as exc:
@@ -20,19 +50,24 @@ class MultiCoreExperiment(ExperimentBase):
                 "(e.g. from triage import create_engine)"
             ) from exc
 
-        super(MultiCoreExperiment, self).__init__(config, db_engine, *args, **kwargs)
         if n_processes < 1:
             raise ValueError("n_processes must be 1 or greater")
         if n_db_processes < 1:
             raise ValueError("n_db_processes must be 1 or greater")
+        if memory_budget_mb is not None and memory_budget_mb <= 0:
+            raise ValueError("memory_budget_mb must be greater than 0")
+        # set before initializing the experiment so the components that can use
+        # several database connections or processes are created with the right number
+        self.n_db_processes = n_db_processes
+        self.n_processes = n_processes
+        super(MultiCoreExperiment, self).__init__(config, db_engine, *args, **kwargs)
         if n_db_processes == 1 and n_processes == 1:
             logging.warning(
                 "Both n_processes and n_db_processes were set to 1. "
                 "If you only wish to use one process to run the experiment, "
                 "consider using the SingleThreadedExperiment class instead"
             )
-        self.n_processes = n_processes
-        self.n_db_processes = n_db_processes
+        self.memory_budget_mb = memory_budget_mb
 
     def generated_chunked_parallelized_results(
         self, partially_bound_function, tasks, n_processes, chunksize=1
@@ -56,14 +91,42 @@ class MultiCoreExperiment(ExperimentBase):
             run_task_with_splatted_arguments, self.model_train_tester.process_task
         )
 
+        if self.memory_budget_mb:
+            memory_estimates = self.train_test_memory_estimates(
+                [task for batch in batches if batch.parallelizable for task in batch.tasks]
+            )
+            partial_test_and_record_memory = partial(
+                run_train_test_task_and_record_memory,
+                self.model_train_tester,
+                run_id=self.run_id,
+                db_engine=self.db_engine,
+            )
+
         for batch in batches:
-            if batch.parallelizable:
+            # batches of tasks that each use several cores run fewer tasks at once
+            n_processes = min(batch.n_processes or self.n_processes, self.n_processes)
+            if batch.parallelizable and self.memory_budget_mb:
+                logging.info(
+                    "Starting parallelizable batch train/testing with %s tasks, %s processes, "
+                    "%s MB memory budget",
+                    len(batch.tasks),
+                    n_processes,
+                    self.memory_budget_mb,
+                )
+                parallelize_within_memory_budget(
+                    partial_test_and_record_memory,
+                    [(task,) + memory_estimates[id(task)] for task in batch.tasks],
+                    [memory_estimates[id(task)][1] for task in batch.tasks],
+                    self.memory_budget_mb * 1024 * 1024,
+                    n_processes,
+                )
+            elif batch.parallelizable:
                 logging.info(
                     "Starting parallelizable batch train/testing with %s tasks, %s processes",
                     len(batch.tasks),
-                    self.n_processes
+                    n_processes
                 )
-                parallelize(partial_test, batch.tasks, self.n_processes)
+                parallelize(partial_test, batch.tasks, n_processes)
             else:
                 logging.info(
                     "Starting serial batch train/testing with %s tasks",
@@ -72,18 +135,54 @@ class MultiCoreExperiment(ExperimentBase):
                 for serial_task in batch.tasks:
                     self.model_train_tester.process_task(**serial_task)
 
+    def train_test_memory_estimates(self, tasks):
+        """Estimate the memory each train/test task will use
+
+        A task is assumed to use its train and test matrices' size times a multiplier
+        for its estimator, which is the average ratio observed for that estimator in
+        previous runs, or DEFAULT_MEMORY_MULTIPLIER if it hasn't been measured yet.
+
+        Args:
+            tasks (list) of train/test tasks
+
+        Returns: (dict) the id of each task mapped to a tuple of the size of its
+            matrices and its estimated memory usage, both in bytes
+        """
+        footprints = matrix_footprints(
+            set(task["train_store"].uuid for task in tasks)
+            | set(task["test_store"].uuid for task in tasks),
+            self.db_engine,
+        )
+        multipliers = previous_memory_multipliers(
+            set(task["train_kwargs"]["class_path"] for task in tasks),
+            self.db_engine,
+        )
+        estimates = {}
+        for task in tasks:
+            matrix_bytes = (
+                footprints.get(task["train_store"].uuid, 0)
+                + footprints.get(task["test_store"].uuid, 0)
+            )
+            multiplier = multipliers.get(
+                task["train_kwargs"]["class_path"], DEFAULT_MEMORY_MULTIPLIER
+            )
+            estimates[id(task)] = (matrix_bytes, matrix_bytes * multiplier)
+        return estimates
+
     def process_query_tasks(self, query_tasks):
         logging.info("Processing query tasks with %s processes", self.n_db_processes)
         for table_name, tasks in query_tasks.items():
             logging.info("Processing features for %s", table_name)
             self.feature_generator.run_commands(tasks.get("prepare", []))
             partial_insert = partial(
-                insert_into_table, feature_generator=self.feature_generator
+                insert_into_table,
+                feature_generator=self.feature_generator,
+                table_name=table_name
             )
 
-            insert_batches = [
-                list(task_batch) for task_batch in Batch(tasks.get("inserts", []), 25)
-            ]
+            insert_batches = self.feature_generator.batch_inserts(
+                tasks.get("inserts", []), n_processes=self.n_db_processes
+            )
             parallelize(partial_insert, insert_batches, n_processes=self.n_db_processes)
             self.feature_generator.run_commands(tasks.get("finalize", []))
             logging.info("%s completed", table_name)
@@ -101,6 +200,19 @@ class MultiCoreExperiment(ExperimentBase):
             partial_build_matrix, self.matrix_build_tasks.values(), self.n_processes
         )
 
+    def process_superset_build_tasks(self, superset_build_tasks):
+        partial_build_superset = partial(
+            run_task_with_splatted_arguments, self.matrix_builder.build_superset_matrices
+        )
+        logging.info(
+            "Starting parallel matrix building: %s feature supersets, %s processes",
+            len(superset_build_tasks.keys()),
+            self.n_processes,
+        )
+        parallelize(
+            partial_build_superset, superset_build_tasks.values(), self.n_processes
+        )
+
     def process_subset_tasks(self, subset_tasks):
         partial_subset = partial(
             run_task_with_splatted_arguments, self.subsetter.process_task
@@ -116,10 +228,10 @@ class MultiCoreExperiment(ExperimentBase):
         )
 
 
-def insert_into_table(insert_statements, feature_generator):
+def insert_into_table(insert_statements, feature_generator, table_name=None):
     try:
         logging.info("Beginning insert batch")
-        feature_generator.run_commands(insert_statements)
+        feature_generator.run_insert_batch(insert_statements, table_name=table_name)
         return True
     except Exception:
         logging.error("Child error: %s", traceback.format_exc())
@@ -150,6 +262,110 @@ def parallelize(partially_bound_function, tasks, n_processes):
         return results
 
 
+def parallelize_within_memory_budget(
+    partially_bound_function, tasks, memory_estimates, memory_budget, n_processes
+):
+    """Run tasks in a process pool, only starting a task while it fits within the memory budget
+
+    Tasks are started in order, skipping ahead to the first waiting task that fits
+    if the next one doesn't. A task that is estimated to need more than the whole
+    budget is started once nothing else is running.
+
+    Args:
+        partially_bound_function (function) The function to run each task with
+        tasks (list) The arguments to run the function with, one per task
+        memory_estimates (list) The estimated memory usage of each task, in bytes
+        memory_budget (number) The most memory that all running tasks together are
+            estimated to use, in bytes
+        n_processes (int) The most tasks to run at once
+
+    Returns: (list) of the results of the tasks that succeeded
+    """
+    num_successes = 0
+    num_failures = 0
+    results = []
+    waiting = list(zip(tasks, memory_estimates))
+    running = {}
+    with ProcessPool(n_processes, max_tasks=1) as pool:
+        while waiting or running:
+            still_waiting = []
+            for task, estimate in waiting:
+                if len(running) < n_processes and (
+                    not running or sum(running.values()) + estimate <= memory_budget
+                ):
+                    if estimate > memory_budget:
+                        logging.warning(
+                            "Task estimated to use %s MB, more than the whole memory budget. "
+                            "Running it alone",
+                            int(estimate / 1024 / 1024),
+                        )
+                    running[pool.schedule(partially_bound_function, args=task)] = estimate
+                else:
+                    still_waiting.append((task, estimate))
+            waiting = still_waiting
+            logging.debug(
+                "%s tasks running, estimated to use %s MB; %s tasks waiting",
+                len(running),
+                int(sum(running.values()) / 1024 / 1024),
+                len(waiting),
+            )
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                try:
+                    results.append(future.result())
+                except Exception:
+                    logging.exception('Child failure')
+                    num_failures += 1
+                else:
+                    num_successes += 1
+
+        logging.info("Done. successes: %s, failures: %s", num_successes, num_failures)
+        return results
+
+
+def _peak_rss():
+    """The peak resident set size of this process so far, in bytes"""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024.0
+
+
+def run_train_test_task_and_record_memory(
+    model_train_tester, task, matrix_bytes, estimated_memory, run_id=None, db_engine=None
+):
+    """Run a train/test task and record the peak memory it used
+
+    Meant to run in a fresh process for each task. A process forked from the experiment
+    starts out resident in the pages it shares with the experiment process, so the
+    memory the task used is how far the peak resident set size of the process grew
+    beyond what it started with.
+    """
+    try:
+        starting_rss = _peak_rss()
+        result = model_train_tester.process_task(**task)
+        task_rss = _peak_rss() - starting_rss
+        logging.info(
+            "Train/test task for model %s used at most %s MB (estimated %s MB)",
+            task["train_kwargs"]["model_hash"],
+            int(task_rss / 1024 / 1024),
+            int(estimated_memory / 1024 / 1024),
+        )
+        record_task_memory(
+            model_hash=task["train_kwargs"]["model_hash"],
+            test_matrix_uuid=task["test_store"].uuid,
+            class_path=task["train_kwargs"]["class_path"],
+            matrix_bytes=matrix_bytes,
+            estimated_memory=estimated_memory,
+            peak_rss=task_rss,
+            run_id=run_id,
+            db_engine=db_engine,
+        )
+        return result
+    except Exception:
+        logging.error("Child error: %s", traceback.format_exc())
+        raise
+
+
 def run_task_with_splatted_arguments(task_runner, task):
     try:
         return task_runner(**task)
@@ -1,6 +1,5 @@
 import logging
 import time
-from triage.component.catwalk.utils import Batch
 from triage.experiments import ExperimentBase
 
 try:
@@ -79,7 +78,8 @@ class RQExperiment(ExperimentBase):
 
         Will run preparation (e.g. create table) and finalize (e.g. create index) tasks
         in the main process,
-        but delegate inserts to rq Jobs in batches of 25
+        but delegate inserts to rq Jobs in batches of roughly equal estimated cost,
+        most expensive first
 
         Args: query_tasks (dict) - keys should be table names and values should be dicts.
             Each inner dict should have up to three keys, each with a list of queries:
@@ -102,13 +102,12 @@ class RQExperiment(ExperimentBase):
             logging.info("Processing features for %s", table_name)
             self.feature_generator.run_commands(tasks.get("prepare", []))
 
-            insert_batches = [
-                list(task_batch) for task_batch in Batch(tasks.get("inserts", []), 25)
-            ]
+            insert_batches = self.feature_generator.batch_inserts(tasks.get("inserts", []))
             jobs = [
                 self.queue.enqueue(
-                    self.feature_generator.run_commands,
+                    self.feature_generator.run_insert_batch,
                     insert_batch,
+                    table_name=table_name,
                     job_timeout=DEFAULT_TIMEOUT,
                     result_ttl=DEFAULT_TIMEOUT,
                     ttl=DEFAULT_TIMEOUT,
@@ -142,6 +141,28 @@ class RQExperiment(ExperimentBase):
         ]
         return self.wait_for(jobs)
 
+    def process_superset_build_tasks(self, superset_build_tasks):
+        """Run feature superset matrix build tasks using RQ
+
+        Args:
+            superset_build_tasks (dict) Keys should be superset hashes (though not used here),
+                values should be dictionaries suitable as kwargs for sending
+                to self.matrix_builder.build_superset_matrices
+
+        Returns: (list) of job results for each given task
+        """
+        jobs = [
+            self.queue.enqueue(
+                self.matrix_builder.build_superset_matrices,
+                job_timeout=DEFAULT_TIMEOUT,
+                result_ttl=DEFAULT_TIMEOUT,
+                ttl=DEFAULT_TIMEOUT,
+                **superset_task
+            )
+            for superset_task in superset_build_tasks.values()
+        ]
+        return self.wait_for(jobs)
+
     def process_train_test_batches(self, train_test_batches):
         """Run train tasks using RQ
 
@@ -908,6 +908,73 @@ class BiasAuditConfigValidator(Validator):
                              "All percentile thresholds must be between 0 and 100")
 
 
+class ModelGroupPruningValidator(Validator):
+    def _run(self, model_group_pruning_config, scoring_config):
+        if not model_group_pruning_config:
+            # if empty, that's fine, shortcut out
+            return
+        for key in ["metric", "parameter"]:
+            if key not in model_group_pruning_config:
+                raise ValueError(
+                    dedent(
+                        """
+                Section: model_group_pruning -
+                '{}' required as key: model_group_pruning config: {}""".format(
+                            key, model_group_pruning_config
+                        )
+                    )
+                )
+        testing_metrics = set(
+            metric
+            for metric_group in scoring_config.get("testing_metric_groups", [])
+            for metric in metric_group.get("metrics", [])
+        )
+        if model_group_pruning_config["metric"] not in testing_metrics:
+            raise ValueError(
+                dedent(
+                    """
+            Section: model_group_pruning -
+            Metric '{}' is not in any of the scoring testing_metric_groups,
+            so model groups could not be ranked by it""".format(
+                        model_group_pruning_config["metric"]
+                    )
+                )
+            )
+        keep_fraction = model_group_pruning_config.get("keep_fraction", 0.5)
+        if not 0 < keep_fraction <= 1:
+            raise ValueError("Section: model_group_pruning - "
+                             "keep_fraction must be greater than 0 and at most 1")
+        for key in ["initial_splits", "min_model_groups"]:
+            value = model_group_pruning_config.get(key, 1)
+            if not isinstance(value, int) or value < 1:
+                raise ValueError("Section: model_group_pruning - "
+                                 "{} must be a whole number, 1 or greater".format(key))
+
+
+class NegativeDownsamplingValidator(Validator):
+    def _run(self, negative_downsampling_config):
+        if not negative_downsampling_config:
+            # if empty, that's fine, shortcut out
+            return
+        if "rate" not in negative_downsampling_config:
+            raise ValueError(
+                dedent(
+                    """
+            Section: negative_downsampling -
+            'rate' required as key: negative_downsampling config: {}""".format(
+                        negative_downsampling_config
+                    )
+                )
+            )
+        rate = negative_downsampling_config["rate"]
+        if isinstance(rate, bool) or not isinstance(rate, (int, float)) or not 0 < rate <= 1:
+            raise ValueError("Section: negative_downsampling - "
+                             "rate must be a number greater than 0 and at most 1")
+        random_seed = negative_downsampling_config.get("random_seed", 0)
+        if isinstance(random_seed, bool) or not isinstance(random_seed, int):
+            raise ValueError("Section: negative_downsampling - "
+                             "random_seed must be a whole number")
+
 
 class ExperimentValidator(Validator):
     def run(self, experiment_config):
@@ -949,6 +1016,13 @@ class ExperimentValidator(Validator):
         BiasAuditConfigValidator(strict=self.strict).run(
             experiment_config.get("bias_audit_config", {})
         )
+        ModelGroupPruningValidator(strict=self.strict).run(
+            experiment_config.get("model_group_pruning", {}),
+            experiment_config.get("scoring", {}),
+        )
+        NegativeDownsamplingValidator(strict=self.strict).run(
+            experiment_config.get("negative_downsampling", {})
+        )
 
         # show the success message in the console as well as the logger
         # as we don't really know how they have configured logging
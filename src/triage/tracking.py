@@ -5,6 +5,8 @@ import os
 import requests
 import subprocess
 import logging
+import time
+from collections import Counter
 from functools import wraps
 from triage.util.db import scoped_session, get_for_update
 from triage.util.introspection import classpath
@@ -19,7 +21,16 @@ except ImportError:
     pip_freeze = None
 
 
-from triage.component.results_schema import ExperimentRun, ExperimentRunStatus
+from sqlalchemy.dialects.postgresql import insert
+
+from sqlalchemy import func
+
+from triage.component.results_schema import (
+    ExperimentRun,
+    ExperimentRunStatus,
+    QueryRuntime,
+    TaskMemoryUsage,
+)
 
 
 def infer_git_hash():
@@ -189,13 +200,79 @@ def increment_field(field, run_id, db_engine):
         run_id (int) The identifier/primary key of the run
         db_engine (sqlalchemy.engine)
     """
+    increment_fields({field: 1}, run_id, db_engine)
+
+
+def increment_fields(increments, run_id, db_engine):
+    """Increment several of an ExperimentRun's named fields at once.
+
+    Expects that the fields are integers in the database.
+
+    Will also kick the last_updated_time timestamp.
+
+    Args:
+        increments (dict) The name of each field to the amount to increment it by
+        run_id (int) The identifier/primary key of the run
+        db_engine (sqlalchemy.engine)
+    """
     with scoped_session(db_engine) as session:
         # Use an update query instead of a session merge so it happens in one atomic query
         # and protect against race conditions
-        session.query(ExperimentRun).filter_by(run_id=run_id).update({
-            field: getattr(ExperimentRun, field) + 1,
-            'last_updated_time': datetime.datetime.now()
-        })
+        values = {
+            field: getattr(ExperimentRun, field) + increment
+            for field, increment in increments.items()
+        }
+        values['last_updated_time'] = datetime.datetime.now()
+        session.query(ExperimentRun).filter_by(run_id=run_id).update(values)
+
+
+class BufferedIncrements(object):
+    """Increments of an ExperimentRun's fields, saved together in one update
+
+    Increments are saved once enough of them, or enough time, have accumulated since the
+    last save, and whenever flush is called. Pending increments are not pickled, so that
+    copies of the buffer sent to other processes do not save them again.
+
+    Args:
+        run_id (int) The identifier/primary key of the run
+        db_engine (sqlalchemy.engine)
+        max_increments (int) How many increments to accumulate before saving them
+        max_seconds (float) How long to accumulate increments before saving them
+    """
+    def __init__(self, run_id, db_engine, max_increments=100, max_seconds=30):
+        self.run_id = run_id
+        self.db_engine = db_engine
+        self.max_increments = max_increments
+        self.max_seconds = max_seconds
+        self._reset()
+
+    def _reset(self):
+        self._increments = Counter()
+        self._last_flush_time = time.time()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_increments'] = Counter()
+        return state
+
+    def increment(self, field):
+        """Increment a field, saving the pending increments if it is time to
+
+        Args:
+            field (str) The name of the field
+        """
+        self._increments[field] += 1
+        if (
+            sum(self._increments.values()) >= self.max_increments
+            or time.time() - self._last_flush_time >= self.max_seconds
+        ):
+            self.flush()
+
+    def flush(self):
+        """Save the pending increments"""
+        if self._increments:
+            increment_fields(dict(self._increments), self.run_id, self.db_engine)
+        self._reset()
 
 
 def record_matrix_building_started(run_id, db_engine):
@@ -278,3 +355,129 @@ def errored_model(run_id, db_engine):
         db_engine (sqlalchemy.engine)
     """
     increment_field('models_errored', run_id, db_engine)
+
+
+def record_query_runtimes(query_runtimes, table_name, run_id, db_engine):
+    """Save the observed runtimes of a collection of queries
+
+    The runtime of each query replaces any runtime recorded for the same query
+    by a previous run, so later runs can use them as cost estimates.
+
+    Args:
+        query_runtimes (dict) query hashes mapped to runtimes in seconds
+        table_name (str) The name of the table populated by the queries
+        run_id (int) The identifier/primary key of the run
+        db_engine (sqlalchemy.engine)
+    """
+    if not query_runtimes:
+        return
+    now = datetime.datetime.now()
+    statement = insert(QueryRuntime.__table__).values([
+        {
+            'query_hash': query_hash,
+            'table_name': table_name,
+            'runtime': runtime,
+            'run_id': run_id,
+            'last_updated_time': now,
+        }
+        for query_hash, runtime in query_runtimes.items()
+    ])
+    db_engine.execute(statement.on_conflict_do_update(
+        index_elements=[QueryRuntime.query_hash],
+        set_={
+            'table_name': statement.excluded.table_name,
+            'runtime': statement.excluded.runtime,
+            'run_id': statement.excluded.run_id,
+            'last_updated_time': statement.excluded.last_updated_time,
+        }
+    ))
+
+
+def previous_query_runtimes(query_hashes, db_engine):
+    """Look up the most recently observed runtimes of a collection of queries
+
+    Args:
+        query_hashes (iterable) of query hashes
+        db_engine (sqlalchemy.engine)
+
+    Returns: (dict) query hashes mapped to runtimes in seconds,
+        for only those queries that have been timed before
+    """
+    with scoped_session(db_engine) as session:
+        return dict(
+            session.query(QueryRuntime.query_hash, QueryRuntime.runtime)
+            .filter(QueryRuntime.query_hash.in_(list(query_hashes)))
+            .all()
+        )
+
+
+def record_task_memory(
+    model_hash,
+    test_matrix_uuid,
+    class_path,
+    matrix_bytes,
+    estimated_memory,
+    peak_rss,
+    run_id,
+    db_engine
+):
+    """Save the observed peak memory usage of a train/test task
+
+    The usage replaces any usage recorded for the same model and test matrix
+    by a previous run, so later runs can use it to estimate memory needs.
+
+    Args:
+        model_hash (str) The hash of the model the task trained
+        test_matrix_uuid (str) The uuid of the matrix the task tested the model on
+        class_path (str) The class path of the model's estimator
+        matrix_bytes (float) The in-memory size of the task's train and test matrices
+        estimated_memory (float) The memory the task was expected to use, in bytes
+        peak_rss (float) How far the peak resident set size of the task's process grew
+            while running it, in bytes
+        run_id (int) The identifier/primary key of the run
+        db_engine (sqlalchemy.engine)
+    """
+    statement = insert(TaskMemoryUsage.__table__).values(
+        model_hash=model_hash,
+        test_matrix_uuid=test_matrix_uuid,
+        class_path=class_path,
+        matrix_bytes=matrix_bytes,
+        estimated_memory=estimated_memory,
+        peak_rss=peak_rss,
+        run_id=run_id,
+        last_updated_time=datetime.datetime.now(),
+    )
+    db_engine.execute(statement.on_conflict_do_update(
+        index_elements=[TaskMemoryUsage.model_hash, TaskMemoryUsage.test_matrix_uuid],
+        set_={
+            'class_path': statement.excluded.class_path,
+            'matrix_bytes': statement.excluded.matrix_bytes,
+            'estimated_memory': statement.excluded.estimated_memory,
+            'peak_rss': statement.excluded.peak_rss,
+            'run_id': statement.excluded.run_id,
+            'last_updated_time': statement.excluded.last_updated_time,
+        }
+    ))
+
+
+def previous_memory_multipliers(class_paths, db_engine):
+    """Look up how much memory tasks for each estimator have used relative to their matrices
+
+    Args:
+        class_paths (iterable) of estimator class paths
+        db_engine (sqlalchemy.engine)
+
+    Returns: (dict) class paths mapped to the average ratio of peak memory usage
+        to matrix size, for only those estimators that have been measured before
+    """
+    with scoped_session(db_engine) as session:
+        return dict(
+            session.query(
+                TaskMemoryUsage.class_path,
+                func.avg(TaskMemoryUsage.peak_rss / TaskMemoryUsage.matrix_bytes)
+            )
+            .filter(TaskMemoryUsage.class_path.in_(list(class_paths)))
+            .filter(TaskMemoryUsage.matrix_bytes > 0)
+            .group_by(TaskMemoryUsage.class_path)
+            .all()
+        )